@@ -10,6 +10,8 @@ fi
 INPUT_DATA_PATH="$1"
 
 # Run split_hdf5.py with input data path
-python scripts/split_hdf5.py --input_data_path "$INPUT_DATA_PATH"
+# The split files link to the datasets in the input data path, use --split_mode copy for standalone files
+python scripts/split_hdf5.py --input_data_path "$INPUT_DATA_PATH" --split_mode link
 
-python scripts/merge_data.py
+# The merged files are virtual datasets that read the split files, use --merge_mode copy for standalone files
+python scripts/merge_data.py --merge_mode virtual
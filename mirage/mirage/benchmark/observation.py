@@ -0,0 +1,87 @@
+from collections.abc import Mapping
+from typing import Any, Iterator
+import zlib
+
+import numpy as np
+
+def _checksum(value: Any) -> tuple:
+    array = np.ascontiguousarray(value)
+    return array.shape, array.dtype.str, zlib.crc32(array.view(np.uint8) if array.ndim else array.tobytes())
+
+class Observation(Mapping):
+    """
+    Observation dictionary whose arrays are shared instead of copied.
+
+    Observations are immutable by convention: a branch that needs a different value for some keys,
+    e.g. an inpainted agentview_image, calls override, which returns a new observation sharing the
+    arrays of every other key. Writing into an array of an observation changes every observation
+    sharing it. In debug mode arrays are returned as read-only views, so that numpy writes through
+    them raise, and verify checks that no array was changed through another reference.
+    """
+
+    def __init__(self, data: Mapping, debug: bool = False, _checksums: dict = None) -> None:
+        """
+        Wraps the arrays of a dictionary without copying them.
+        :param data: observation dictionary, e.g. returned by env.step
+        :param debug: if True, detects in-place modifications of the arrays
+        """
+        self._data = dict(data)
+        self.debug = debug
+        self._checksums = None
+        if debug:
+            checksums = _checksums or {}
+            self._checksums = {key: checksums[key] if key in checksums else _checksum(value) for key, value in self._data.items()}
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._data[key]
+        if self.debug and isinstance(value, np.ndarray):
+            value = value.view()
+            value.flags.writeable = False
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"Observation({self._data!r})"
+
+    def override(self, items: Mapping) -> "Observation":
+        """
+        Returns an observation with new values for some keys, sharing the arrays of the others.
+        :param items: new values by key
+        """
+        data = dict(self._data)
+        data.update(items)
+        checksums = None
+        if self.debug:
+            checksums = {key: checksum for key, checksum in self._checksums.items() if key not in items}
+        return Observation(data, debug=self.debug, _checksums=checksums)
+
+    def to_dict(self) -> dict:
+        """
+        Returns a plain dictionary of the arrays, for code that only accepts dictionaries (e.g. robomimic policies).
+        The arrays are not copied.
+        """
+        return {key: self[key] for key in self._data}
+
+    def verify(self) -> None:
+        """
+        In debug mode, checks that no array changed since the observation was created.
+        :throws RuntimeError: If an array was modified in place.
+        """
+        if not self.debug:
+            return
+        for key, checksum in self._checksums.items():
+            if _checksum(self._data[key]) != checksum:
+                raise RuntimeError(f"Observation {key} was modified in place")
+
+def as_observation(obs: Mapping, debug: bool = False) -> Observation:
+    """
+    Wraps an observation dictionary, or returns it if it is already an Observation.
+    """
+    if isinstance(obs, Observation):
+        return obs
+    return Observation(obs, debug=debug)
@@ -0,0 +1,177 @@
+from typing import Dict, List, Optional
+import os
+import queue
+import threading
+import time
+
+import h5py
+import numpy as np
+
+# Attribute of a demo group with the number of steps readable in its datasets
+NUM_STEPS_ATTRIBUTE = "num_steps"
+# Attribute of a demo group set once the demo ended
+COMPLETE_ATTRIBUTE = "complete"
+
+def _open_file(path: str, mode: str, retries: int, retry_interval: float) -> h5py.File:
+    """
+    Opens an HDF5 file, retrying while another process holds its lock.
+    """
+    for attempt in range(retries):
+        try:
+            return h5py.File(path, mode)
+        except BlockingIOError:
+            if attempt == retries - 1:
+                raise
+            time.sleep(retry_interval)
+
+def paired_dataset_path(folder: str, robot_name: Optional[str]) -> str:
+    """
+    Path of the paired dataset of a robot in a save_paired_images folder, e.g. folder/franka.hdf5.
+    The source robot writes the franka dataset, as it is the robot the demos were collected with.
+    """
+    return os.path.join(folder, f"{'franka' if robot_name is None else robot_name.lower()}.hdf5")
+
+class PairedDatasetWriter:
+    """
+    Appends the per-step arrays of rollouts to chunked, compressed HDF5 datasets, with one group per demo,
+    e.g. demo_0/rgb of shape T x H x W x 3.
+
+    Steps are buffered in memory and written by a background thread every flush_every steps. The thread
+    opens the file only for the duration of a write, and updates the num_steps attribute of a demo after
+    its datasets were extended, so the dataset can be read while the run is in progress, see read_paired_demo.
+    """
+
+    def __init__(self, path: str, flush_every: int = 50, compression: Optional[str] = "gzip", max_pending_flushes: int = 8) -> None:
+        """
+        Starts a new dataset, replacing a previous dataset at the same path.
+        :param path: path of the HDF5 file
+        :param flush_every: number of steps buffered before they are written
+        :param compression: HDF5 compression of the datasets
+        :param max_pending_flushes: number of buffered flushes after which append waits for the writer thread
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self.compression = compression
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with h5py.File(path, "w") as f:
+            f.attrs["created"] = time.time()
+        self._buffers = {}
+        self._num_buffered = 0
+        self._error = None
+        self._flushes = queue.Queue(maxsize=max_pending_flushes)
+        self._thread = threading.Thread(target=self._write_flushes, daemon=True)
+        self._thread.start()
+
+    def append(self, demo_index: int, **arrays: np.ndarray) -> None:
+        """
+        Buffers one step of a demo.
+        :param demo_index: index of the demo
+        :param arrays: arrays of the step by dataset name, every step of a demo has the same names, shapes and dtypes
+        """
+        self._raise_error()
+        buffer = self._buffers.setdefault(demo_index, {})
+        for name, array in arrays.items():
+            buffer.setdefault(name, []).append(np.array(array))
+        self._num_buffered += 1
+        if self._num_buffered >= self.flush_every:
+            self.flush()
+
+    def start_demo(self, demo_index: int) -> None:
+        """
+        Removes the steps of a previous rollout of a demo, e.g. written for another seed.
+        """
+        self.flush(restart=[demo_index])
+
+    def end_demo(self, demo_index: int) -> None:
+        """
+        Writes the buffered steps of a demo and marks it complete.
+        """
+        self.flush(complete=[demo_index])
+
+    def flush(self, complete: Optional[List[int]] = None, restart: Optional[List[int]] = None) -> None:
+        """
+        Hands the buffered steps to the writer thread.
+        :param complete: demos marked complete once their steps are written
+        :param restart: demos removed after the buffered steps are written
+        """
+        self._raise_error()
+        buffers = {demo_index: {name: np.stack(steps) for name, steps in buffer.items()} for demo_index, buffer in self._buffers.items()}
+        self._buffers = {}
+        self._num_buffered = 0
+        if buffers or complete or restart:
+            self._flushes.put((buffers, complete or [], restart or []))
+
+    def close(self) -> None:
+        """
+        Writes the buffered steps and waits for the writer thread.
+        :throws RuntimeError: If a write failed.
+        """
+        if self._thread is None:
+            return
+        self.flush()
+        self._flushes.put(None)
+        self._thread.join()
+        self._thread = None
+        self._raise_error()
+
+    def __enter__(self) -> "PairedDatasetWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise RuntimeError(f"Writing the paired dataset {self.path} failed") from self._error
+
+    def _write_flushes(self) -> None:
+        while True:
+            item = self._flushes.get()
+            if item is None:
+                return
+            if self._error is not None:
+                # Later steps are dropped, the error is raised by the next call of the rollout
+                continue
+            try:
+                self._write(*item)
+            except Exception as error:
+                self._error = error
+
+    def _write(self, buffers: Dict[int, Dict[str, np.ndarray]], complete: List[int], restart: List[int]) -> None:
+        # Readers hold the lock of the file while they read
+        with _open_file(self.path, "a", retries=600, retry_interval=0.1) as f:
+            for demo_index, arrays in buffers.items():
+                group = f.require_group(f"demo_{demo_index}")
+                num_steps = group.attrs.get(NUM_STEPS_ATTRIBUTE, 0)
+                for name, steps in arrays.items():
+                    if name not in group:
+                        # Images are chunked per step, low dimensional arrays in blocks of steps
+                        chunk_steps = 1 if steps[0].size >= 1024 else 256
+                        group.create_dataset(name, shape=(0,) + steps.shape[1:], maxshape=(None,) + steps.shape[1:], dtype=steps.dtype,
+                                             chunks=(chunk_steps,) + steps.shape[1:], compression=self.compression)
+                    dataset = group[name]
+                    dataset.resize(num_steps + len(steps), axis=0)
+                    dataset[num_steps:] = steps
+                group.attrs[NUM_STEPS_ATTRIBUTE] = num_steps + len(next(iter(arrays.values())))
+            for demo_index in complete:
+                f.require_group(f"demo_{demo_index}").attrs[COMPLETE_ATTRIBUTE] = True
+            for demo_index in restart:
+                if f"demo_{demo_index}" in f:
+                    del f[f"demo_{demo_index}"]
+
+def read_paired_demo(path: str, demo_index: int, retries: int = 10, retry_interval: float = 0.5) -> Dict[str, np.ndarray]:
+    """
+    Reads the steps of a demo written so far.
+    :param path: path of the paired dataset
+    :param demo_index: index of the demo
+    :param retries: number of attempts while the writer holds the file
+    :param retry_interval: seconds between attempts
+    :return: arrays of the demo by dataset name
+    :throws KeyError: If the demo has no steps yet.
+    """
+    with _open_file(path, "r", retries, retry_interval) as f:
+        group = f[f"demo_{demo_index}"]
+        num_steps = group.attrs[NUM_STEPS_ATTRIBUTE]
+        return {name: dataset[:num_steps] for name, dataset in group.items()}
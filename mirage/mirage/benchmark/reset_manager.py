@@ -0,0 +1,89 @@
+from contextlib import contextmanager
+from typing import Dict
+
+class ResetManager:
+    """
+    Resets a robomimic robosuite environment at the start of the rollouts, keeping the compiled MuJoCo
+    model while the model XML does not change.
+
+    A robosuite reset rebuilds the MuJoCo model from its XML, and reset_to rebuilds it again from the XML
+    of the state, so resetting then calling reset_to builds the model three times. Here, a state whose
+    model XML is the one already loaded is restored with set_state_from_flattened and forward, after a
+    reset that keeps the model, which still resets the robots, controllers and episode counters of
+    robosuite. Only a different XML, or a model rebuilt by someone else, loads the XML again.
+    """
+
+    def __init__(self, env, core_env, fast_reset: bool = True) -> None:
+        """
+        :param env: robomimic environment, possibly wrapped
+        :param core_env: robosuite environment of env
+        :param fast_reset: if False, every reset rebuilds the model, as robosuite does by default
+        """
+        self.env = env
+        self.core_env = core_env
+        self.fast_reset = fast_reset
+        self.num_hard_resets = 0
+        self.num_fast_resets = 0
+        # XML of the loaded model and simulation it was loaded into
+        self._model_xml = None
+        self._sim = None
+
+    def reset(self):
+        """
+        Resets the task to a new initial state.
+        The first reset loads the model from its own XML, which is necessary for deterministic action
+        playback, later resets place the objects in the same model.
+        :return: observation of the initial state
+        """
+        if not self.fast_reset:
+            self.env.reset()
+            self.num_hard_resets += 1
+            return self.env.reset_to(self.env.get_state())
+        if not self._model_loaded():
+            with self._keep_model():
+                self.env.reset()
+            return self.reset_to(self.env.get_state())
+        with self._keep_model():
+            obs = self.env.reset()
+        self.num_fast_resets += 1
+        return obs
+
+    def reset_to(self, state: Dict):
+        """
+        Resets the task to a state, e.g. the initial state of a demo.
+        :param state: dictionary with the flattened simulation state in states and the model XML in model
+        :return: observation of the state
+        """
+        if not self.fast_reset:
+            self.env.reset()
+            self.num_hard_resets += 1
+            return self.env.reset_to(state)
+        model_xml = state.get("model")
+        if model_xml is not None and (model_xml != self._model_xml or not self._model_loaded()):
+            # reset_to resets before loading the XML, there is no need to build the current model again
+            with self._keep_model():
+                obs = self.env.reset_to(state)
+            self._model_xml = model_xml
+            self._sim = self.core_env.sim
+            self.num_hard_resets += 1
+            return obs
+        with self._keep_model():
+            self.env.reset()
+        self.num_fast_resets += 1
+        return self.env.reset_to({"states": state["states"]})
+
+    def stats(self) -> Dict:
+        return dict(fast_reset=self.fast_reset, hard_resets=self.num_hard_resets, fast_resets=self.num_fast_resets)
+
+    def _model_loaded(self) -> bool:
+        # A hard reset elsewhere replaces the simulation with a model built from scratch
+        return self._sim is not None and self.core_env.sim is self._sim
+
+    @contextmanager
+    def _keep_model(self):
+        hard_reset = self.core_env.hard_reset
+        self.core_env.hard_reset = False
+        try:
+            yield
+        finally:
+            self.core_env.hard_reset = hard_reset
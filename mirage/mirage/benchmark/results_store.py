@@ -0,0 +1,227 @@
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional, Tuple
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+@dataclass
+class RolloutRecord:
+    """
+    Outcome of one rollout of an evaluation.
+    """
+    robot: str
+    seed: int
+    rollout: int
+    success: bool
+    return_: float
+    horizon: int
+    # Seconds spent in the rollout
+    rollout_time: float
+    # Unix time at which the rollout finished
+    timestamp: float = field(default_factory=time.time)
+
+    def to_json(self) -> str:
+        record = asdict(self)
+        record["return"] = record.pop("return_")
+        return json.dumps(record)
+
+    @staticmethod
+    def from_dict(record: dict) -> "RolloutRecord":
+        record = dict(record)
+        record["return_"] = record.pop("return")
+        return RolloutRecord(**record)
+
+def results_store_path(save_stats_path: str) -> str:
+    """
+    Path of the rollout records written next to a stats file, e.g. results/target.txt -> results/target.jsonl.
+    """
+    return os.path.splitext(save_stats_path)[0] + ".jsonl"
+
+class ResultsStore:
+    """
+    Append-only JSON lines file of the rollout records of one evaluation run.
+
+    The first line is a header with the ID of the run, so that readers can tell a rewritten file
+    from one that grew. Every record is flushed and fsynced, so a record that can be read is complete
+    and survives a crash of the evaluation.
+    """
+
+    def __init__(self, path: str, run_id: Optional[str] = None) -> None:
+        """
+        Starts a new run, replacing the records of a previous run at the same path.
+        :param path: path of the JSON lines file
+        :param run_id: ID of the run, a random one if None
+        """
+        self.path = path
+        self.run_id = run_id if run_id is not None else uuid.uuid4().hex
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "w")
+        self._write_line(json.dumps({"run_id": self.run_id, "started": time.time()}))
+
+    def append(self, record: RolloutRecord) -> None:
+        """
+        Appends a rollout record and waits until it is on disk.
+        """
+        self._write_line(record.to_json())
+
+    def _write_line(self, line: str) -> None:
+        self._file.write(line + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+def read_run_id(path: str) -> Optional[str]:
+    """
+    Reads the run ID from the header of a results store.
+    :return: run ID, None if the header is not completely written yet
+    """
+    with open(path, "rb") as f:
+        header = f.readline()
+    if not header.endswith(b"\n"):
+        return None
+    return json.loads(header)["run_id"]
+
+def read_records(path: str, offset: int = 0) -> Tuple[Optional[str], List[RolloutRecord], int]:
+    """
+    Reads the records of a results store written after a byte offset.
+    A line that is still being written is left for the next call.
+    :param path: path of the JSON lines file
+    :param offset: byte offset to start from, 0 for the whole file
+    :return: run ID from the header, records after the offset, and the offset after the last complete line
+    """
+    with open(path, "rb") as f:
+        header = f.readline()
+        if not header.endswith(b"\n"):
+            return None, [], offset
+        run_id = json.loads(header)["run_id"]
+        f.seek(max(offset, len(header)))
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    records = [RolloutRecord.from_dict(json.loads(line)) for line in data[:end].splitlines() if line]
+    return run_id, records, max(offset, len(header)) + end
+
+class ResultsIndex:
+    """
+    SQLite index of the results stores of many experiments.
+
+    Every refresh only reads the bytes appended to each store since the last refresh, and keeps
+    per experiment and robot totals up to date, so summaries never reparse finished experiments.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        """
+        :param db_path: path of the SQLite database, ":memory:" for an index that is not kept
+        """
+        self._db = sqlite3.connect(db_path)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS stores (
+                path TEXT PRIMARY KEY, experiment TEXT NOT NULL, run_id TEXT, offset INTEGER NOT NULL DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS rollouts (
+                path TEXT NOT NULL, robot TEXT, seed INTEGER, rollout INTEGER, success INTEGER,
+                return REAL, horizon INTEGER, rollout_time REAL, timestamp REAL);
+            CREATE INDEX IF NOT EXISTS rollouts_path ON rollouts (path);
+            CREATE TABLE IF NOT EXISTS totals (
+                path TEXT NOT NULL, robot TEXT NOT NULL, num_rollouts INTEGER NOT NULL, num_success INTEGER NOT NULL,
+                sum_return REAL NOT NULL, sum_horizon REAL NOT NULL, sum_rollout_time REAL NOT NULL,
+                PRIMARY KEY (path, robot));
+        """)
+        self._db.commit()
+
+    def add(self, experiment: str, path: str) -> None:
+        """
+        Adds the results store of an experiment to the index.
+        :param experiment: name the summaries of the store are reported under
+        :param path: path of the JSON lines file
+        """
+        self._db.execute("INSERT OR IGNORE INTO stores (path, experiment) VALUES (?, ?)", (os.path.abspath(path), experiment))
+        self._db.commit()
+
+    def refresh(self, experiment: Optional[str] = None) -> int:
+        """
+        Reads what was appended to every store since the last refresh.
+        :param experiment: only refresh the stores of this experiment
+        :return: number of new records
+        """
+        num_records = 0
+        query = "SELECT path, run_id, offset FROM stores"
+        parameters = ()
+        if experiment is not None:
+            query += " WHERE experiment = ?"
+            parameters = (experiment,)
+        for path, run_id, offset in self._db.execute(query, parameters).fetchall():
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+            if size == offset and run_id is not None:
+                continue
+            file_run_id = read_run_id(path)
+            if file_run_id is None:
+                continue
+            if file_run_id != run_id or size < offset:
+                # A new run rewrote the store, the offset of the previous run falls anywhere in the new file
+                self._forget(path)
+                offset = 0
+            records_run_id, records, new_offset = read_records(path, offset)
+            if records_run_id != file_run_id:
+                # Rewritten again since the header was read, the next refresh reads the new run
+                continue
+            self._insert(path, records)
+            self._db.execute("UPDATE stores SET run_id = ?, offset = ? WHERE path = ?", (file_run_id, new_offset, path))
+            num_records += len(records)
+        self._db.commit()
+        return num_records
+
+    def _forget(self, path: str) -> None:
+        self._db.execute("DELETE FROM rollouts WHERE path = ?", (path,))
+        self._db.execute("DELETE FROM totals WHERE path = ?", (path,))
+
+    def _insert(self, path: str, records: List[RolloutRecord]) -> None:
+        self._db.executemany(
+            "INSERT INTO rollouts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(path, r.robot, r.seed, r.rollout, int(r.success), r.return_, r.horizon, r.rollout_time, r.timestamp) for r in records])
+        self._db.executemany(
+            """INSERT INTO totals VALUES (?, ?, 1, ?, ?, ?, ?)
+               ON CONFLICT (path, robot) DO UPDATE SET
+                   num_rollouts = num_rollouts + 1, num_success = num_success + excluded.num_success,
+                   sum_return = sum_return + excluded.sum_return, sum_horizon = sum_horizon + excluded.sum_horizon,
+                   sum_rollout_time = sum_rollout_time + excluded.sum_rollout_time""",
+            [(path, r.robot, int(r.success), r.return_, r.horizon, r.rollout_time) for r in records])
+
+    def summary(self, experiment: Optional[str] = None) -> List[Dict]:
+        """
+        Returns the totals of every experiment and robot, from the last refresh.
+        :param experiment: only return the totals of this experiment
+        :return: one dictionary per experiment and robot with the number of rollouts and successes,
+                 the success rate and the mean return, horizon and rollout time
+        """
+        query = """SELECT stores.experiment, totals.robot, SUM(num_rollouts), SUM(num_success),
+                          SUM(sum_return), SUM(sum_horizon), SUM(sum_rollout_time)
+                   FROM totals JOIN stores ON totals.path = stores.path"""
+        parameters = ()
+        if experiment is not None:
+            query += " WHERE stores.experiment = ?"
+            parameters = (experiment,)
+        query += " GROUP BY stores.experiment, totals.robot ORDER BY stores.experiment, totals.robot"
+        summaries = []
+        for name, robot, num_rollouts, num_success, sum_return, sum_horizon, sum_rollout_time in self._db.execute(query, parameters):
+            summaries.append({
+                "experiment": name,
+                "robot": robot,
+                "num_rollouts": num_rollouts,
+                "num_success": num_success,
+                "success_rate": num_success / num_rollouts,
+                "mean_return": sum_return / num_rollouts,
+                "mean_horizon": sum_horizon / num_rollouts,
+                "mean_rollout_time": sum_rollout_time / num_rollouts,
+            })
+        return summaries
+
+    def close(self) -> None:
+        self._db.close()
@@ -2,15 +2,13 @@ import argparse
 import pdb
 import json
 import h5py
-import imageio
 import numpy as np
-from copy import deepcopy
-import socket, pickle
+import socket
+import time
 from scipy.spatial.transform import Rotation
 import torch
 import os
 import cv2
-import struct
 import robomimic.utils.file_utils as FileUtils
 import robomimic.utils.torch_utils as TorchUtils
 import robomimic.utils.tensor_utils as TensorUtils
@@ -24,6 +22,15 @@ from robosuite.wrappers import DomainRandomizationWrapper
 from robosuite.utils.mjcf_utils import array_to_string, string_to_array
 import robosuite.utils.camera_utils as camera_utils
 from mirage.gripper_interpolation.robosuite.gripper_interpolator import GripperInterpolator
+from mirage.benchmark.observation import Observation, as_observation
+from mirage.benchmark.paired_dataset import PairedDatasetWriter, paired_dataset_path
+from mirage.benchmark.video_sink import VideoSink, render_video_frame
+from mirage.benchmark.reset_manager import ResetManager
+from mirage.benchmark.robot_ik import restored_env_state, solve_eef_ik
+from mirage.benchmark.results_store import ResultsStore, RolloutRecord, results_store_path
+from mirage.infra.robot_state_channel import RobotStateChannel
+from mirage.infra.tracing import span, trace_paths, tracer
+from mirage.infra.shared_memory_ring_buffer import SharedMemoryRingBuffer, flatten_arrays, unflatten_arrays
 
 TASK_OBJECT_DICT = {"Lift": ["cube_joint0"],
                     "NutAssemblySquare": ["SquareNut_joint0", "RoundNut_joint0"],
@@ -84,8 +91,13 @@ class Data:
 
 tracking_error_history = []
 
+DRIVE_MODES = ["controller", "ik", "ik_measured"]
+
+# Fields of the source robot info that are already known before the source robot takes its first step
+GROUND_TRUTH_FIELDS = ("ground_truth/rgb", "ground_truth/segmentation_mask", "ground_truth/low_dim/")
+
 class Robot:
-    def __init__(self, robot_name=None, ckpt_path=None, render=False, video_path=None, rollout_horizon=None, seed=None, dataset_path=None, demo_path=None, inpaint_enabled=False, save_paired_images=False, save_paired_images_folder_path=None, device=None, save_failed_demos=False, gripper_types=None, save_stats_path=None, add_patches=False):
+    def __init__(self, robot_name=None, ckpt_path=None, render=False, video_path=None, rollout_horizon=None, seed=None, dataset_path=None, demo_path=None, inpaint_enabled=False, save_paired_images=False, save_paired_images_folder_path=None, device=None, save_failed_demos=False, gripper_types=None, save_stats_path=None, add_patches=False, shared_memory_prefix=None, debug_observations=False, video_height=512, video_width=512, video_codec="libx264", drive_mode="controller", fast_reset=True):
         """_summary_
 
         Args:
@@ -96,6 +108,16 @@ class Robot:
             rollout_horizon (int, optional): 
             seed (int, optional): 
             connection (socket, optional):
+            shared_memory_prefix (string, optional): if provided, images and robot info are exchanged with the other robot process
+                through shared memory ring buffers with this name prefix instead of .npy files
+            debug_observations (bool, optional): if True, observations are read-only and checked for in-place modifications every step
+            video_height (int, optional): height of the video frames
+            video_width (int, optional): width of every camera in the video frames
+            video_codec (string, optional): ffmpeg codec of the videos
+            drive_mode (string, optional): how drive_robot_to_target_pose aligns the robot, one of DRIVE_MODES.
+                controller steps the simulation with absolute OSC actions, ik sets the joints to an IK solution
+                and falls back to the controller if IK fails, ik_measured also counts the controller iterations saved
+            fast_reset (bool, optional): if True, resets keep the compiled simulation model while its XML is unchanged, see ResetManager
         """
         
         self.robot_name = robot_name
@@ -113,14 +135,24 @@ class Robot:
     
         # Increment count and write back to file
         self.execution_count = 0
-        self.video_writer = imageio.get_writer(f'{self.execution_count}_{video_path}', fps=20) if self.write_video else None
+        self.video_height = video_height
+        self.video_width = video_width
+        self.video_codec = video_codec
+        self.video_writer = VideoSink(f'{self.execution_count}_{video_path}', fps=20, codec=video_codec) if self.write_video else None
         # Keep count of executions in a file
        
-        self.inpaint_writer = imageio.get_writer(os.path.join(os.path.dirname(self.video_path), "inpaint_video.mp4"), fps=20) if self.video_writer is not None else None
+        self.inpaint_writer = VideoSink(os.path.join(os.path.dirname(self.video_path), "inpaint_video.mp4"), fps=20, codec=video_codec) if self.video_writer is not None else None
         self.save_failed_demos = save_failed_demos
         self.gripper_types = gripper_types
         self.save_stats_path = os.path.dirname(save_stats_path)
         self.add_patches = add_patches
+        self.shared_memory_prefix = shared_memory_prefix
+        self.shared_buffers = {}
+        self.debug_observations = debug_observations
+        if drive_mode not in DRIVE_MODES:
+            raise ValueError(f"Unknown drive mode {drive_mode}, expected one of {DRIVE_MODES}")
+        self.drive_mode = drive_mode
+        self.drive_stats = dict(calls=0, ik_solved=0, ik_fallbacks=0, controller_iterations=0, controller_iterations_saved=0)
 
         self.inpaint_enabled = inpaint_enabled
         self.save_paired_images = save_paired_images
@@ -139,19 +171,8 @@ class Robot:
         if self.save_paired_images:
             assert save_paired_images_folder_path is not None, "Please specify save_paired_images_folder_path"
             self.save_paired_images_folder_path = save_paired_images_folder_path
-            # create folders if it does not exist
-            if self.robot_name is None:
-                os.makedirs(os.path.join(self.save_paired_images_folder_path, "franka_rgb"), exist_ok=True)
-                os.makedirs(os.path.join(self.save_paired_images_folder_path, "franka_mask"), exist_ok=True)
-                os.makedirs(os.path.join(self.save_paired_images_folder_path, "franka_ee_pose"), exist_ok=True)
-                os.makedirs(os.path.join(self.save_paired_images_folder_path, "franka_joint_gripper_pose"), exist_ok=True)
-                os.makedirs(os.path.join(self.save_paired_images_folder_path, "franka_depth"), exist_ok=True)
-            else:
-                os.makedirs(os.path.join(self.save_paired_images_folder_path, "{}_rgb".format(self.robot_name.lower())), exist_ok=True)
-                os.makedirs(os.path.join(self.save_paired_images_folder_path, "{}_mask".format(self.robot_name.lower())), exist_ok=True)
-                os.makedirs(os.path.join(self.save_paired_images_folder_path, "{}_ee_pose".format(self.robot_name.lower())), exist_ok=True)
-                os.makedirs(os.path.join(self.save_paired_images_folder_path, "{}_joint_gripper_pose".format(self.robot_name.lower())), exist_ok=True)
-                os.makedirs(os.path.join(self.save_paired_images_folder_path, "{}_depth".format(self.robot_name.lower())), exist_ok=True)
+            # Steps of every rollout are appended to one HDF5 file per robot, see PairedDatasetWriter
+            self.paired_dataset = PairedDatasetWriter(paired_dataset_path(self.save_paired_images_folder_path, self.robot_name))
 
         # create environment from saved checkpoint
         self.device = TorchUtils.get_torch_device(try_to_use_cuda=True) if device is None else device
@@ -211,6 +232,7 @@ class Robot:
             self.is_diffusion = True
             self.core_env = self.core_env.env
         
+        self.reset_manager = ResetManager(self.env, self.core_env, fast_reset=fast_reset)
         self.num_robots = len(self.core_env.robots)
         self.eef_site_name = []
         for i in range(self.num_robots):
@@ -232,6 +254,65 @@ class Robot:
             self.set_seed(self.seed)
             
 
+    def write_shared(self, channel, arrays):
+        """
+        Writes arrays to a shared memory channel, creating it with their shapes on the first write.
+        """
+        if channel not in self.shared_buffers:
+            self.shared_buffers[channel] = SharedMemoryRingBuffer.create_for(f"{self.shared_memory_prefix}_{channel}", arrays)
+        return self.shared_buffers[channel].write(arrays)
+
+    def read_shared(self, channel):
+        """
+        Reads the newest arrays of a shared memory channel written by the other robot process.
+        """
+        if channel not in self.shared_buffers:
+            self.shared_buffers[channel] = SharedMemoryRingBuffer.attach(f"{self.shared_memory_prefix}_{channel}")
+        _, arrays = self.shared_buffers[channel].read()
+        return arrays
+
+    def save_image(self, channel, path, image):
+        """
+        Hands an image to the other robot process, through shared memory if enabled and a .npy file otherwise.
+        """
+        if self.shared_memory_prefix is None:
+            np.save(path, image, allow_pickle=True)
+        else:
+            self.write_shared(channel, {"image": image})
+
+    def load_image(self, channel, path):
+        """
+        Loads an image saved by the other robot process with save_image.
+        """
+        if self.shared_memory_prefix is None:
+            return np.load(path, allow_pickle=True)
+        return self.read_shared(channel)["image"]
+
+    def save_source_robot_info(self, output):
+        """
+        Hands the ground truth and inpainting prediction of the source robot to the target robot.
+        """
+        if self.shared_memory_prefix is None:
+            np.save(self.groundtruth_and_inpaintedprediction_path, output)
+            return
+        flat_output = flatten_arrays(output)
+        ground_truth = {k: v for k, v in flat_output.items() if k.startswith(GROUND_TRUTH_FIELDS)}
+        self.write_shared("ground_truth", ground_truth)
+        prediction = {k: v for k, v in flat_output.items() if k not in ground_truth}
+        if prediction:
+            self.write_shared("prediction", prediction)
+
+    def load_source_robot_info(self, include_prediction=True):
+        """
+        Loads the source robot info saved with save_source_robot_info.
+        """
+        if self.shared_memory_prefix is None:
+            return np.load(self.groundtruth_and_inpaintedprediction_path, allow_pickle=True).item()
+        flat_output = self.read_shared("ground_truth")
+        if include_prediction:
+            flat_output.update(self.read_shared("prediction"))
+        return unflatten_arrays(flat_output)
+
     def set_seed(self, seed):
         self.seed = seed
         np.random.seed(seed)
@@ -240,9 +321,8 @@ class Robot:
         
 
     def initialize_robot(self):
-        self.obs = self.env.reset()
-        state_dict_source = self.env.get_state()
-        self.obs = self.env.reset_to(state_dict_source) # necessary for robosuite tasks for deterministic action playback
+        # the model is loaded from its XML, which is necessary for robosuite tasks for deterministic action playback
+        self.obs = self.reset_manager.reset()
         
     def compute_pose_error(self, target_pose):
         starting_pose = self.compute_eef_pose()
@@ -256,6 +336,62 @@ class Robot:
         return error, starting_pose
     
     def drive_robot_to_target_pose(self, target_pose=None, tracking_error_threshold=0.003, num_iter_max=100):
+        self.drive_stats["calls"] += 1
+        if self.drive_mode != "controller":
+            if self.set_robot_pose_with_ik(target_pose, tracking_error_threshold=tracking_error_threshold, num_iter_max=num_iter_max):
+                return
+            self.drive_stats["ik_fallbacks"] += 1
+            print("IK did not reach the target pose, driving the robot with the controller")
+        self.drive_stats["controller_iterations"] += self.drive_robot_with_controller(target_pose, tracking_error_threshold=tracking_error_threshold, num_iter_max=num_iter_max)
+
+    def set_robot_pose_with_ik(self, target_pose, tracking_error_threshold=0.003, num_iter_max=100):
+        """
+        Sets the joints of the robots to an IK solution for target_pose and runs forward kinematics,
+        instead of stepping the simulation until the controller reaches it.
+        In ik_measured drive mode, the controller loop is also run from the same state, to count the
+        controller iterations that IK saved, and the environment is then set back to the IK solution,
+        with the episode counters and controller state it had before the loop.
+        :return: True if the target pose was reached, otherwise the simulation is left unchanged
+        """
+        sim = self.core_env.sim
+        initial_state = sim.get_state()
+        num_ik_iters = 0
+        for i in range(self.num_robots):
+            solved, num_iters = solve_eef_ik(sim, self.core_env.robots[i].controller, target_pose[7 * i:7 * (i + 1)], tolerance=tracking_error_threshold)
+            num_ik_iters += num_iters
+            if not solved:
+                sim.set_state(initial_state)
+                sim.forward()
+                return False
+        self.drive_stats["ik_solved"] += 1
+
+        if self.drive_mode == "ik_measured":
+            ik_state = sim.get_state()
+            sim.set_state(initial_state)
+            sim.forward()
+            # the controller loop steps the environment, which is set back to the state before the loop
+            with restored_env_state(self.env, self.core_env):
+                num_controller_iters = self.drive_robot_with_controller(target_pose, tracking_error_threshold=tracking_error_threshold, num_iter_max=num_iter_max)
+            self.drive_stats["controller_iterations_saved"] += num_controller_iters
+            print("IK saved {} controller iterations".format(num_controller_iters))
+            sim.set_state(ik_state)
+            sim.forward()
+
+        for i in range(self.num_robots):
+            # the goal of the controller is still the pose before the joints were set
+            self.core_env.robots[i].controller.update(force=True)
+            self.core_env.robots[i].controller.reset_goal()
+        self.obs = self.env.get_observation()
+        if hasattr(self.env, "_get_stacked_obs_from_history"):
+            self.obs = self.env._get_stacked_obs_from_history()
+        print("Take {} IK iterations to set robot to target pose".format(num_ik_iters))
+        return True
+
+    def drive_robot_with_controller(self, target_pose, tracking_error_threshold=0.003, num_iter_max=100):
+        """
+        Drives the robots to target_pose with absolute OSC actions.
+        :return: number of controller iterations
+        """
         for i in range(self.num_robots):
             self.core_env.robots[i].controller.use_delta = False # change to absolute pose for setting the initial state
         
@@ -276,7 +412,7 @@ class Robot:
                 action[7:10] = target_pose[7:10]
                 action[10:13] = T.quat2axisangle(target_pose[10:])
             
-            self.obs, _, _, _ = self.env.step(action)
+            self.obs, _, _, _ = self.env_step(action)
 
             error, starting_pose = self.compute_pose_error(target_pose)
             num_iters += 1
@@ -295,7 +431,11 @@ class Robot:
         # change back to delta pose
         for i in range(self.num_robots):
             self.core_env.robots[i].controller.use_delta = True
-        
+        return num_iters
+
+    def env_step(self, action):
+        with span("env.step"):
+            return self.env.step(action)
 
     def compute_eef_pose(self):
         """return a 7D or 14D pose vector"""
@@ -340,7 +480,7 @@ class Robot:
             assert (len(action) == 7 and self.num_robots == 1) or (len(action) == 14 and self.num_robots == 2), "Action should be 7DOF"
             for i in range(self.num_robots):
                 self.core_env.robots[i].controller.use_delta = use_delta
-            next_obs, r, done, _ = self.env.step(action) # just execute action
+            next_obs, r, done, _ = self.env_step(action) # just execute action
             # if action[-1] != self.prev_action[-1]:
             #     print("after", self.compute_eef_pose())
             if goal_pose is None:
@@ -360,7 +500,7 @@ class Robot:
                 action_goal_pos = self.core_env.robots[0].controller.goal_pos
                 action_goal_ori = Rotation.from_matrix(self.core_env.robots[0].controller.goal_ori).as_rotvec()
                 raise NotImplementedError
-                next_obs, r, done, _ = self.env.step(action) 
+                next_obs, r, done, _ = self.env_step(action) 
             else:
                 assert (len(action) == 8 and self.num_robots == 1) or (len(action) == 16 and self.num_robots == 2), "Action should be 8DOF"
                 for i in range(self.num_robots):
@@ -386,7 +526,7 @@ class Robot:
                 while error > tracking_error_threshold and num_iters < num_iter_max:
                     # if action[-1] != self.prev_action[-1]:
                     #     print("action_target", action_target)
-                    next_obs, r, done, _ = self.env.step(action_target)
+                    next_obs, r, done, _ = self.env_step(action_target)
                     actual_pose = self.compute_eef_pose()
                     if self.num_robots == 1:
                         error = np.linalg.norm(action[:-1] - actual_pose)
@@ -403,19 +543,19 @@ class Robot:
                         # action_target = np.zeros(7)
                         action_target[-1] = action[-1]
                         # print("action_target", action_target)
-                        next_obs, r, done, _ = self.env.step(action_target)
+                        next_obs, r, done, _ = self.env_step(action_target)
                         # self.core_env.robots[0].controller.use_delta = False
                         # print("after", self.compute_eef_pose())
                 elif self.num_robots == 2:
                     action_target[6] = action[7]
                     action_target[-1] = action[-1]
-                    next_obs, r, done, _ = self.env.step(action_target)
+                    next_obs, r, done, _ = self.env_step(action_target)
                 if error > tracking_error_threshold:
                     print("Warning: did not reach target pose, error: ", error)
                 tracking_error_history.append(error)
         success = self.env.is_success()["task"]
         self.prev_action = action
-        self.obs = deepcopy(next_obs)
+        self.obs = Observation(next_obs, debug=self.debug_observations)
         return action, r, done, success
 
     
@@ -423,6 +563,8 @@ class Robot:
         """target_robot_delta_action only affects the target robot. Default is to track the absolute pose of the source robot."""
         avg_rollout_stats = dict(Seeds=[], Return=[], Horizon=[], Success_Rate=[], Num_Success=[])
         inpaint_data_for_analysis = []
+        # Per rollout records next to the stats file, which only has the latest averages
+        results_store = ResultsStore(results_store_path(save_stats_path)) if save_stats_path is not None else None
         print(seeds, 'seeds')
         for seed in seeds:
             self.seed = seed
@@ -439,19 +581,31 @@ class Robot:
                         os.remove(self.inpaint_data_for_analysis_path_temp) # remove that file
                 self.execution_count = i
                 print("Rollout {}/{}".format(i + 1, rollout_num_episodes))
-                stats, traj, inpaint_data_for_analysis_1traj = self.rollout_robot(
-                    video_skip=1,
-                    return_obs=self.write_dataset,
-                    camera_names=camera_names,
-                    set_object_state=True,
-                    set_robot_pose=inpaint_online_eval or self.save_paired_images, # no need to set it to true since the target robot will be tracking the source robot, unless it is inpainting with online eval
-                    tracking_error_threshold=tracking_error_threshold, # used only by the target robot because it is blocking
-                    num_iter_max=num_iter_max, # used only by the target robot because it is blocking
-                    target_robot_delta_action = target_robot_delta_action,
-                    demo_index=i
-                )
+                rollout_start_time = time.perf_counter()
+                with span("rollout", seed=seed, rollout=i):
+                    stats, traj, inpaint_data_for_analysis_1traj = self.rollout_robot(
+                        video_skip=1,
+                        return_obs=self.write_dataset,
+                        camera_names=camera_names,
+                        set_object_state=True,
+                        set_robot_pose=inpaint_online_eval or self.save_paired_images, # no need to set it to true since the target robot will be tracking the source robot, unless it is inpainting with online eval
+                        tracking_error_threshold=tracking_error_threshold, # used only by the target robot because it is blocking
+                        num_iter_max=num_iter_max, # used only by the target robot because it is blocking
+                        target_robot_delta_action = target_robot_delta_action,
+                        demo_index=i
+                    )
+                if self.save_paired_images:
+                    self.paired_dataset.end_demo(i)
                 rollout_stats.append(stats)
                 inpaint_data_for_analysis.append(inpaint_data_for_analysis_1traj)
+                if results_store is not None:
+                    results_store.append(RolloutRecord(robot=self.robot_name, seed=seed, rollout=i, success=stats["Success_Rate"] >= 1,
+                                                       return_=float(stats["Return"]), horizon=int(stats["Horizon"]),
+                                                       rollout_time=time.perf_counter() - rollout_start_time))
+                if tracer.enabled and save_stats_path is not None:
+                    # Rewritten after every rollout so an interrupted evaluation keeps its summary,
+                    # the Chrome trace grows with the run and is only written at the end
+                    tracer.write_summary(trace_paths(save_stats_path)[1])
                 
                 if (self.save_failed_demos or stats["Success_Rate"] >= 1) and self.write_dataset: # only save successful trajs
                     # store transitions
@@ -484,6 +638,8 @@ class Robot:
                 print(json.dumps(avg_rollout_stats, indent=4))
                 summary_stats = {k : (np.mean(avg_rollout_stats[k]), np.std(avg_rollout_stats[k])) for k in avg_rollout_stats if k not in ["Seeds", "Robot"]}
                 summary_stats["tracking_error"] = (np.mean(tracking_error_history), np.std(tracking_error_history))
+                summary_stats["drive_robot_to_target_pose"] = dict(mode=self.drive_mode, **self.drive_stats)
+                summary_stats["resets"] = self.reset_manager.stats()
                 summary_stats["config"] = dict()
                 summary_stats["config"]["Robot"] = avg_rollout_stats["Robot"]
                 summary_stats["config"]["tracking_error_threshold"] = tracking_error_threshold
@@ -495,6 +651,15 @@ class Robot:
                         json.dump(avg_rollout_stats, f, indent=4)
                         json.dump(summary_stats, f, indent=4)
         
+        if results_store is not None:
+            results_store.close()
+
+        if tracer.enabled and save_stats_path is not None:
+            tracer.write(save_stats_path)
+
+        if self.save_paired_images:
+            self.paired_dataset.close()
+
         if self.write_video:
             self.video_writer.close()
 
@@ -523,14 +688,18 @@ class Robot:
                 os.remove(self.groundtruth_and_inpaintedprediction_path)
             if os.path.isfile(self.inpainted_img_path):
                 os.remove(self.inpainted_img_path)
+
+        for shared_buffer in self.shared_buffers.values():
+            shared_buffer.close()
+        self.shared_buffers = {}
         
         if self.s is not None:
             self.s.close()
 
 
 class SourceRobot(Robot):
-    def __init__(self, robot_name=None, ckpt_path=None, render=False, video_path=None, rollout_horizon=None, seed=None, dataset_path=None, connection=None, port = 50007, passive=True, demo_path=None, inpaint_enabled=False, forward_dynamics_model_path='', save_paired_images=False, save_paired_images_folder_path=None, device=None, save_failed_demos=False, naive=False, save_stats_path=None, add_patches=False):
-        super().__init__(robot_name=robot_name, ckpt_path=ckpt_path, render=render, video_path=video_path, rollout_horizon=rollout_horizon, seed=seed, dataset_path=dataset_path, demo_path=demo_path, inpaint_enabled=inpaint_enabled, save_paired_images=save_paired_images, save_paired_images_folder_path=save_paired_images_folder_path, device=device, save_failed_demos=save_failed_demos, save_stats_path=save_stats_path, add_patches=add_patches)
+    def __init__(self, robot_name=None, ckpt_path=None, render=False, video_path=None, rollout_horizon=None, seed=None, dataset_path=None, connection=None, port = 50007, passive=True, demo_path=None, inpaint_enabled=False, forward_dynamics_model_path='', save_paired_images=False, save_paired_images_folder_path=None, device=None, save_failed_demos=False, naive=False, save_stats_path=None, add_patches=False, use_shared_memory=False, debug_observations=False, video_height=512, video_width=512, video_codec="libx264", drive_mode="controller", fast_reset=True):
+        super().__init__(robot_name=robot_name, ckpt_path=ckpt_path, render=render, video_path=video_path, rollout_horizon=rollout_horizon, seed=seed, dataset_path=dataset_path, demo_path=demo_path, inpaint_enabled=inpaint_enabled, save_paired_images=save_paired_images, save_paired_images_folder_path=save_paired_images_folder_path, device=device, save_failed_demos=save_failed_demos, save_stats_path=save_stats_path, add_patches=add_patches, shared_memory_prefix=f"mirage_{port}" if use_shared_memory else None, debug_observations=debug_observations, video_height=video_height, video_width=video_width, video_codec=video_codec, drive_mode=drive_mode, fast_reset=fast_reset)
         
         if connection:
             HOST = 'localhost'
@@ -540,10 +709,12 @@ class SourceRobot(Robot):
             self.s.bind((HOST, PORT))
             self.s.listen(1)
             self.conn, addr = self.s.accept()
+            self.channel = RobotStateChannel(self.conn, TASK_OBJECT_DICT[self.task])
             print('Connected by', addr)
         else:
             self.s = None
             self.conn = None
+            self.channel = None
             
         self.passive = passive
         
@@ -580,13 +751,11 @@ class SourceRobot(Robot):
         # assert isinstance(self.env, EnvBase)
         # assert isinstance(self.policy, RolloutPolicy)
 
-        self.video_writer = imageio.get_writer(f'{self.execution_count}_{self.video_path}', fps=20) if self.write_video else None
-        if self.save_paired_images:            
-            os.makedirs(os.path.join(self.save_paired_images_folder_path, "franka_rgb", str(demo_index)), exist_ok=True)
-            os.makedirs(os.path.join(self.save_paired_images_folder_path, "franka_mask", str(demo_index)), exist_ok=True)
-            os.makedirs(os.path.join(self.save_paired_images_folder_path, "franka_ee_pose", str(demo_index)), exist_ok=True)
-            os.makedirs(os.path.join(self.save_paired_images_folder_path, "franka_joint_gripper_pose", str(demo_index)), exist_ok=True)
-            os.makedirs(os.path.join(self.save_paired_images_folder_path, "franka_depth", str(demo_index)), exist_ok=True)
+        if self.video_writer is not None:
+            self.video_writer.close()
+        self.video_writer = VideoSink(f'{self.execution_count}_{self.video_path}', fps=20, codec=self.video_codec) if self.write_video else None
+        if self.save_paired_images:
+            self.paired_dataset.start_demo(demo_index)
         
         
         if self.use_demo:
@@ -603,8 +772,7 @@ class SourceRobot(Robot):
             traj_len = states.shape[0]
             print("Demo length: ", traj_len)
             # load the initial state
-            self.env.reset()
-            self.obs = self.env.reset_to(initial_state)
+            self.obs = self.reset_manager.reset_to(initial_state)
         else:
             self.policy.start_episode()
             self.initialize_robot()
@@ -618,16 +786,9 @@ class SourceRobot(Robot):
             variable.object_state = self.get_object_state()
             variable.robot_pose = self.compute_eef_pose()
             variable.message = "Ready"
-            # Pickle the object and send it to the server
-            data_string = pickle.dumps(variable)
-            message_length = struct.pack("!I", len(data_string))
-            self.conn.sendall(message_length)
-            self.conn.send(data_string)
+            self.channel.send(variable)
             # confirm that the target robot is ready
-            pickled_message_size = self._receive_all_bytes(4)
-            message_size = struct.unpack("!I", pickled_message_size)[0]
-            data = self._receive_all_bytes(message_size)
-            target_env_robot_state = pickle.loads(data)
+            target_env_robot_state = self.channel.receive()
             # print("Receiving target object state and target robot pose from target robot")
             assert target_env_robot_state.message == "Ready", "Target robot is not ready"
         
@@ -649,7 +810,7 @@ class SourceRobot(Robot):
                             }
                     }
                 }
-            np.save(self.groundtruth_and_inpaintedprediction_path, output)
+            self.save_source_robot_info(output)
         
         video_count = 0  # video frame counter
         total_reward = 0.
@@ -667,11 +828,7 @@ class SourceRobot(Robot):
             # receive target object state and target robot pose from target robot
             if self.passive:
                 if self.conn is not None:
-                    pickled_message_size = self._receive_all_bytes(4)
-                    message_size = struct.unpack("!I", pickled_message_size)[0]
-
-                    data = self._receive_all_bytes(message_size)
-                    target_env_robot_state = pickle.loads(data)
+                    target_env_robot_state = self.channel.receive()
                     assert target_env_robot_state.message == "Request for Action", "Wrong synchronization"
                     # print("Receiving target object state and target robot pose from target robot")
                     # if target_env_robot_state.done:
@@ -684,11 +841,13 @@ class SourceRobot(Robot):
                 if set_object_state:
                     self.set_object_state(set_to_target_object_state=target_env_robot_state.object_state)
                 if set_robot_pose:
-                    self.drive_robot_to_target_pose(target_env_robot_state.robot_pose, tracking_error_threshold=tracking_error_threshold, num_iter_max=num_iter_max)
+                    with span("drive_robot_to_target_pose"):
+                        self.drive_robot_to_target_pose(target_env_robot_state.robot_pose, tracking_error_threshold=tracking_error_threshold, num_iter_max=num_iter_max)
             
             # state_dict and obs are before taking the action
             state_dict = self.env.get_state()
-            obs = deepcopy(self.obs)
+            # Observations are never modified in place, so branches share the arrays of obs
+            obs = as_observation(self.obs, debug=self.debug_observations)
             
             if self.save_paired_images:
                 # save the rgb image and segmentation mask
@@ -701,20 +860,14 @@ class SourceRobot(Robot):
                 depth_normalized = obs['agentview_depth']
                 depth_normalized = cv2.flip(depth_normalized, 0)
                 depth_img = camera_utils.get_real_depth_map(self.core_env.sim, depth_normalized)
-                # save the rgb image
-                cv2.imwrite(os.path.join(self.save_paired_images_folder_path, "franka_rgb", str(demo_index), "{}.jpg".format(step_i)), cv2.cvtColor(rgb_img, cv2.COLOR_RGB2BGR) * 255)
-                # save the segmentation mask
-                cv2.imwrite(os.path.join(self.save_paired_images_folder_path, "franka_mask", str(demo_index), "{}.jpg".format(step_i)), segmentation_mask * 255)
-                # save the EE pose
-                with open(os.path.join(self.save_paired_images_folder_path, "franka_ee_pose", str(demo_index), "{}.txt".format(step_i)), "w") as f:
-                    f.write(str(np.concatenate([self.compute_eef_pose(), obs['robot0_gripper_qpos']])))
-                # save the joint and gripper pose
-                with open(os.path.join(self.save_paired_images_folder_path, "franka_joint_gripper_pose", str(demo_index), "{}.txt".format(step_i)), "w") as f:
-                    f.write(str(np.concatenate([obs['robot0_joint_pos'], obs['robot0_gripper_qpos']])))
-                # save the depth map
-                np.save(os.path.join(self.save_paired_images_folder_path, "franka_depth", str(demo_index), "{}.npy".format(step_i)), depth_img)
+                self.paired_dataset.append(demo_index,
+                                           rgb=np.rint(rgb_img * 255).astype(np.uint8),
+                                           mask=segmentation_mask.astype(np.uint8),
+                                           ee_pose=np.concatenate([self.compute_eef_pose(), obs['robot0_gripper_qpos']]),
+                                           joint_gripper_pose=np.concatenate([obs['robot0_joint_pos'], obs['robot0_gripper_qpos']]),
+                                           depth=depth_img.reshape(depth_img.shape[:2]).astype(np.float32))
             
-            obs_copy = deepcopy(obs)
+            obs_copy = obs
             # if obs_copy["agentview_image"].shape[-1] != 84:
             #     rgb_img = obs_copy['agentview_image']
             #     rgb_img = rgb_img.transpose(1, 2, 0)
@@ -725,9 +878,7 @@ class SourceRobot(Robot):
                 action = actions[step_i]
             else:
                 # Hack to get rid of stuff that screws with robomimic for coffee env
-                for k, v in obs_copy.items():
-                    if np.isscalar(v):
-                        obs_copy[k] = np.array([v])
+                obs_copy = obs.override({k: np.array([v]) for k, v in obs.items() if np.isscalar(v)})
 
                 gt_action = 0
                 #action2 = self.policy(ob=obs_copy) # get action from policy
@@ -744,16 +895,16 @@ class SourceRobot(Robot):
                 cv2.imwrite(f"{self.save_stats_path}/groundtruth.png", cv2.cvtColor(rgb_img, cv2.COLOR_RGB2BGR) * 255)
                 # inpainted image
                 # diffusion_model_input = np.load(self.diffusion_model_input_path)
-                inpainted_image = np.load(self.inpainted_img_path, allow_pickle=True)
+                inpainted_image = self.load_image("inpainted", self.inpainted_img_path)
                 # if inpainted_image.shape[-1] != 84:
                 #     inpainted_image_84 = Image.fromarray((inpainted_image*255).round().astype(np.uint8)).resize((84, 84))
                 #     inpainted_image_84 = np.array(inpainted_image_84).astype(np.float32) / 255.0
                 # else:
                 #     inpainted_image_84 = inpainted_image
                 inpainted_image_84 = inpainted_image
-                obs_copy = deepcopy(obs)
-                obs_copy["agentview_image"] = inpainted_image_84.transpose(2, 0, 1)
-                inpainted_img_action = self.policy(ob=obs_copy)
+                obs_copy = obs.override({"agentview_image": inpainted_image_84.transpose(2, 0, 1)})
+                with span("policy"):
+                    inpainted_img_action = self.policy(ob=obs_copy.to_dict())
                 current_pose = target_env_robot_state.robot_pose #self.compute_eef_pose()
                 transition = {
                             'current_state': np.concatenate([current_pose, obs['robot0_gripper_qpos']]),
@@ -770,19 +921,19 @@ class SourceRobot(Robot):
                 # action = gt_action.copy()
             
             if self.naive:
-                target_img = np.load(f"{self.save_stats_path}/naive_input.npy", allow_pickle=True)
+                target_img = self.load_image("naive", f"{self.save_stats_path}/naive_input.npy")
                 if self.add_patches:
                     target_img[0] = add_black_patches(target_img[0], seed=self.seed)
                     target_img[1] = add_black_patches(target_img[1], seed=self.seed)
-                obs_copy = deepcopy(obs)
-                obs_copy["agentview_image"] = target_img
-                action = self.policy(ob=obs_copy)
+                obs_copy = obs.override({"agentview_image": target_img})
+                with span("policy"):
+                    action = self.policy(ob=obs_copy.to_dict())
 
             action, r, done, success = self.step(action, use_delta=self.control_delta, blocking=False, name="Source Robot")
      
             if success:
                 has_succeeded = True
-            next_obs = deepcopy(self.obs)
+            next_obs = as_observation(self.obs, debug=self.debug_observations)
             total_reward += r
             
             # if the target robot has succeeded, allow 10 more steps for the source robot to finish
@@ -835,23 +986,16 @@ class SourceRobot(Robot):
                                 "target_state": self.compute_eef_pose()
                             }
                         }
-                    np.save(self.groundtruth_and_inpaintedprediction_path, output)
+                    self.save_source_robot_info(output)
 
-                # Pickle the object and send it to the server
-                data_string = pickle.dumps(variable)
-                message_length = struct.pack("!I", len(data_string))
-                self.conn.sendall(message_length)
-                self.conn.send(data_string)
+                self.channel.send(variable)
             
             # visualization
             if self.render:
                 self.env.render(mode="human", camera_name=camera_names[0]) # on-screen rendering can only support one camera
             if self.write_video:
                 if video_count % 1 == 0:
-                    video_img = []
-                    for cam_name in camera_names:
-                        video_img.append(self.env.render(mode="rgb_array", height=512, width=512, camera_name=cam_name))
-                    video_img = np.concatenate(video_img, axis=1) # concatenate horizontally
+                    video_img = render_video_frame(self.env, camera_names, self.video_height, self.video_width, obs=next_obs)
                     self.video_writer.append_data(video_img)
 
                 video_count += 1
@@ -865,17 +1009,14 @@ class SourceRobot(Robot):
                 # Note: We need to "unprocess" the observations to prepare to write them to dataset.
                 #       This includes operations like channel swapping and float to uint8 conversion
                 #       for saving disk space.
-                traj["obs"].append(ObsUtils.unprocess_obs_dict(obs))
-                traj["next_obs"].append(ObsUtils.unprocess_obs_dict(next_obs))
+                traj["obs"].append(ObsUtils.unprocess_obs_dict(obs.to_dict()))
+                traj["next_obs"].append(ObsUtils.unprocess_obs_dict(next_obs.to_dict()))
+            obs.verify()
                 
             
             # confirm that the target robot is ready for the next iteration
             if self.conn is not None:
-                pickled_message_size = self._receive_all_bytes(4)
-                message_size = struct.unpack("!I", pickled_message_size)[0]
-                data = self._receive_all_bytes(message_size)
-
-                target_env_robot_state = pickle.loads(data)
+                target_env_robot_state = self.channel.receive()
                 assert target_env_robot_state.message == "OK", "Wrong synchronization"
                 if target_env_robot_state.success or target_finished_step is not None:
                     print("Target robot is successful")
@@ -942,21 +1083,6 @@ class SourceRobot(Robot):
 
         
         return stats, traj, []
-
-    def _receive_all_bytes(self, num_bytes: int) -> bytes:
-        """
-        Receives all the bytes.
-        :param num_bytes: The number of bytes.
-        :return: The bytes.
-        """
-        data = bytearray(num_bytes)
-        pos = 0
-        while pos < num_bytes:
-            cr = self.conn.recv_into(memoryview(data)[pos:])
-            if cr == 0:
-                raise EOFError
-            pos += cr
-        return data
 #python /home/harshapolavaram/mirage/mirage/mirage/benchmark/robosuite/evaluate_policy_demo_source_robot_server.py --agent /home/harshapolavaram/mirage/secondversion/trained_diffusion_policies/exp_11_ur5e_can_clean/20250421045854/models/model_epoch_400.pth --n_rollouts 10 --video_path source_clean.mp4 --save_stats_path /home/harshapolavaram/mirage/
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -1032,6 +1158,26 @@ if __name__ == "__main__":
         help="render frames to video every n steps",
     )
 
+    # Resolution and codec of the videos
+    parser.add_argument(
+        "--video_height",
+        type=int,
+        default=512,
+        help="height of the video frames, camera observations of the same resolution are reused instead of rendered",
+    )
+    parser.add_argument(
+        "--video_width",
+        type=int,
+        default=512,
+        help="width of every camera in the video frames",
+    )
+    parser.add_argument(
+        "--video_codec",
+        type=str,
+        default="libx264",
+        help="ffmpeg codec of the videos",
+    )
+
     # camera names to render
     parser.add_argument(
         "--camera_names",
@@ -1109,6 +1255,19 @@ if __name__ == "__main__":
         default=100,
         help="(optional) unused by the source robot. For logging purposes only",
     )
+    parser.add_argument(
+        "--drive_mode",
+        type=str,
+        default="controller",
+        choices=DRIVE_MODES,
+        help="how the robot is driven to the pose of the other robot. controller: absolute OSC actions, ik: joints set to an IK solution, "
+             "with the controller as fallback, ik_measured: ik, also counting the controller iterations saved",
+    )
+    parser.add_argument(
+        "--hard_reset",
+        action='store_true',
+        help="if True, rebuild the simulation model on every reset instead of keeping it while the model XML is unchanged",
+    )
     parser.add_argument(
         "--inpaint_enabled",
         action='store_true',
@@ -1129,7 +1288,7 @@ if __name__ == "__main__":
         "--save_paired_images_folder_path",
         type=str,
         default=None,
-        help="directory of the folder to save paired images and masks",
+        help="directory of the folder to save paired images and masks, written to <robot>.hdf5 with one group per demo",
     )
     parser.add_argument(
         "--save_failed_demos",
@@ -1146,8 +1305,25 @@ if __name__ == "__main__":
         action='store_true',
         help="if True, add black patches to the target robot camera images",
     )
+    parser.add_argument(
+        "--shared_memory",
+        action='store_true',
+        help="if True, exchange images with the target robot through shared memory instead of .npy files",
+    )
+    parser.add_argument(
+        "--debug_observations",
+        action='store_true',
+        help="if True, raise when an observation is modified in place",
+    )
+    parser.add_argument(
+        "--trace",
+        action='store_true',
+        help="if True, time the stages of the rollouts and write a Chrome trace and a summary next to the stats file",
+    )
     args = parser.parse_args()
+    if args.trace:
+        tracer.enable("source robot")
 
-    source_robot = SourceRobot(robot_name=args.robot_name, ckpt_path=args.agent, render=args.render, video_path=args.video_path, rollout_horizon=args.horizon, seed=None, dataset_path=args.dataset_path, passive=args.passive, port=args.port, connection=args.connection, demo_path=args.demo_path, inpaint_enabled=args.inpaint_enabled, save_paired_images=args.save_paired_images, save_paired_images_folder_path=args.save_paired_images_folder_path, forward_dynamics_model_path=args.forward_dynamics_model_path, device=args.device, save_failed_demos=args.save_failed_demos, save_stats_path=args.save_stats_path, naive=args.naive, add_patches=args.add_patches)
+    source_robot = SourceRobot(robot_name=args.robot_name, ckpt_path=args.agent, render=args.render, video_path=args.video_path, rollout_horizon=args.horizon, seed=None, dataset_path=args.dataset_path, passive=args.passive, port=args.port, connection=args.connection, demo_path=args.demo_path, inpaint_enabled=args.inpaint_enabled, save_paired_images=args.save_paired_images, save_paired_images_folder_path=args.save_paired_images_folder_path, forward_dynamics_model_path=args.forward_dynamics_model_path, device=args.device, save_failed_demos=args.save_failed_demos, save_stats_path=args.save_stats_path, naive=args.naive, add_patches=args.add_patches, use_shared_memory=args.shared_memory, debug_observations=args.debug_observations, video_height=args.video_height, video_width=args.video_width, video_codec=args.video_codec, drive_mode=args.drive_mode, fast_reset=not args.hard_reset)
     source_robot.run_experiments(seeds=args.seeds, rollout_num_episodes=args.n_rollouts, video_skip=args.video_skip, camera_names=args.camera_names, dataset_obs=args.dataset_obs, save_stats_path=args.save_stats_path, tracking_error_threshold=args.tracking_error_threshold, num_iter_max=args.num_iter_max, inpaint_online_eval=args.inpaint_enabled)
 
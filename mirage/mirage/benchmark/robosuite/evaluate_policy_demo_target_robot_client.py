@@ -1,31 +1,34 @@
 from PIL import Image
 import argparse
-import struct
 import numpy as np
-from copy import deepcopy
-import socket, pickle
+import socket
 import time
 import cv2
-import os
 import robomimic.utils.tensor_utils as TensorUtils
 import robomimic.utils.obs_utils as ObsUtils
 from robomimic.envs.env_base import EnvBase
 import robosuite.utils.transform_utils as T
 import robosuite.utils.camera_utils as camera_utils
 
-from evaluate_policy_demo_source_robot_server import Data, Robot
+from evaluate_policy_demo_source_robot_server import Data, Robot, TASK_OBJECT_DICT, DRIVE_MODES
+from mirage.benchmark.observation import as_observation
+from mirage.benchmark.video_sink import render_video_frame
+from mirage.infra.robot_state_channel import RobotStateChannel
+from mirage.infra.tracing import span, tracer
 
 class TargetRobot(Robot):
-    def __init__(self, robot_name=None, ckpt_path=None, render=False, video_path=None, rollout_horizon=None, seed=None, dataset_path=None, connection=None, port = 50007, passive=False, demo_path=None, inpaint_enabled=False, offline_eval=False, save_paired_images=False, save_paired_images_folder_path=None, use_diffusion=False, use_ros=False, diffusion_input=None, device=None, save_failed_demos=False, gripper_types=None, naive=None, save_stats_path=None, add_patches=False):
-        super().__init__(robot_name=robot_name, ckpt_path=ckpt_path, render=render, video_path=video_path, rollout_horizon=rollout_horizon, seed=seed, dataset_path=dataset_path, demo_path=demo_path, inpaint_enabled=inpaint_enabled, save_paired_images=save_paired_images, save_paired_images_folder_path=save_paired_images_folder_path, device=device, save_failed_demos=save_failed_demos, gripper_types=gripper_types, save_stats_path=save_stats_path, add_patches=add_patches)
+    def __init__(self, robot_name=None, ckpt_path=None, render=False, video_path=None, rollout_horizon=None, seed=None, dataset_path=None, connection=None, port = 50007, passive=False, demo_path=None, inpaint_enabled=False, offline_eval=False, save_paired_images=False, save_paired_images_folder_path=None, use_diffusion=False, use_ros=False, diffusion_input=None, device=None, save_failed_demos=False, gripper_types=None, naive=None, save_stats_path=None, add_patches=False, use_shared_memory=False, debug_observations=False, video_height=512, video_width=512, video_codec="libx264", drive_mode="controller", fast_reset=True):
+        super().__init__(robot_name=robot_name, ckpt_path=ckpt_path, render=render, video_path=video_path, rollout_horizon=rollout_horizon, seed=seed, dataset_path=dataset_path, demo_path=demo_path, inpaint_enabled=inpaint_enabled, save_paired_images=save_paired_images, save_paired_images_folder_path=save_paired_images_folder_path, device=device, save_failed_demos=save_failed_demos, gripper_types=gripper_types, save_stats_path=save_stats_path, add_patches=add_patches, shared_memory_prefix=f"mirage_{port}" if use_shared_memory else None, debug_observations=debug_observations, video_height=video_height, video_width=video_width, video_codec=video_codec, drive_mode=drive_mode, fast_reset=fast_reset)
         
         if connection:
             HOST = 'localhost'
             PORT = port
             self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.s.connect((HOST, PORT))
+            self.channel = RobotStateChannel(self.s, TASK_OBJECT_DICT[self.task])
         else:
             self.s = None
+            self.channel = None
             
         self.passive = passive
         self.naive = naive
@@ -53,6 +56,9 @@ class TargetRobot(Robot):
                             print("NOT USING ROS! Will use the groundtruth Franka masks instead")                        
     
         self.should_kill_early = False
+
+        # Intrinsic matrix and pixel rays of every (camera, height, width) used by image_to_pointcloud
+        self.camera_rays = {}
         
         import threading
         self.thread = threading.Thread(target=self.wait_for_skip)
@@ -63,26 +69,36 @@ class TargetRobot(Robot):
             input()
             self.should_kill_early = True
 
+    def get_camera_rays(self, camera_name, camera_height, camera_width):
+        """
+        Returns the intrinsic matrix of a camera and the ray of every pixel at unit depth, computed once per camera and resolution.
+        :return: 3 x 3 intrinsic matrix, and camera_width x camera_height x 3 rays in camera coordinates indexed by [x, y]
+        """
+        key = (camera_name, camera_height, camera_width)
+        if key not in self.camera_rays:
+            intrinsic_matrix = camera_utils.get_camera_intrinsic_matrix(self.core_env.sim, camera_name=camera_name, camera_height=camera_height, camera_width=camera_width)
+            x, y = np.meshgrid(np.arange(camera_width), np.arange(camera_height), indexing="ij")
+            rays = np.stack([(x - intrinsic_matrix[0, -1]) / intrinsic_matrix[0, 0], (y - intrinsic_matrix[1, -1]) / intrinsic_matrix[1, 1], np.ones(x.shape)], axis=-1)
+            self.camera_rays[key] = (intrinsic_matrix, rays)
+        return self.camera_rays[key]
+
     def image_to_pointcloud(self, depth_map, camera_name, camera_height=84, camera_width=84, segmask=None):
         """
         Convert depth image to point cloud
+        :return: N x 3 float32 points in world coordinates, ordered column by column, only where segmask is nonzero if given
         """
         real_depth_map = camera_utils.get_real_depth_map(self.core_env.sim, depth_map)
         # Camera transform matrix to project from camera coordinates to world coordinates.
         extrinsic_matrix = camera_utils.get_camera_extrinsic_matrix(self.core_env.sim, camera_name=camera_name)
-        intrinsic_matrix = camera_utils.get_camera_intrinsic_matrix(self.core_env.sim, camera_name=camera_name, camera_height=camera_height, camera_width=camera_width)
-
-        # Convert depth image to point cloud
-        points = [] # 3D points in robot frame of shape […, 3]
-        for x in range(camera_width):
-            for y in range(camera_height):
-                if segmask is not None and segmask[y, x] == 0:
-                    continue
-                coord_cam_frame = np.array([(x-intrinsic_matrix[0, -1])/intrinsic_matrix[0, 0], (y-intrinsic_matrix[1, -1])/intrinsic_matrix[1, 1], 1]) * real_depth_map[y, x]
-                # points.append(coord_cam_frame)                
-                coord_world_frame = np.dot(extrinsic_matrix, np.concatenate((coord_cam_frame, [1])))
-                points.append(coord_world_frame)
-        return points
+        _, rays = self.get_camera_rays(camera_name, camera_height, camera_width)
+
+        # Images are indexed by [y, x], the rays by [x, y]
+        coord_cam_frame = rays * real_depth_map.reshape(camera_height, camera_width).T[..., None]
+        if segmask is not None:
+            coord_cam_frame = coord_cam_frame[segmask.reshape(camera_height, camera_width).T != 0]
+        coord_cam_frame = coord_cam_frame.reshape(-1, 3)
+        coord_world_frame = coord_cam_frame @ extrinsic_matrix[:3, :3].T + extrinsic_matrix[:3, 3]
+        return coord_world_frame.astype(np.float32)
     
     def rollout_robot(self, video_skip=5, return_obs=False, camera_names=None, set_object_state=False, set_robot_pose=False, tracking_error_threshold=0.003, num_iter_max=100, target_robot_delta_action=False, demo_index=0):
         print(type(self.env))
@@ -90,34 +106,24 @@ class TargetRobot(Robot):
         
         self.initialize_robot()
         
-        if self.save_paired_images:            
-            os.makedirs(os.path.join(self.save_paired_images_folder_path, "{}_rgb".format(self.robot_name.lower()), str(demo_index)), exist_ok=True)
-            os.makedirs(os.path.join(self.save_paired_images_folder_path, "{}_mask".format(self.robot_name.lower()), str(demo_index)), exist_ok=True)
-            os.makedirs(os.path.join(self.save_paired_images_folder_path, "{}_ee_pose".format(self.robot_name.lower()), str(demo_index)), exist_ok=True)
-            os.makedirs(os.path.join(self.save_paired_images_folder_path, "{}_joint_gripper_pose".format(self.robot_name.lower()), str(demo_index)), exist_ok=True)
-            os.makedirs(os.path.join(self.save_paired_images_folder_path, "{}_depth".format(self.robot_name.lower()), str(demo_index)), exist_ok=True)
+        if self.save_paired_images:
+            self.paired_dataset.start_demo(demo_index)
         
         # the target robot needs to be first initialized to the source object state and source robot pose
         # receive source object state and source robot pose from source robot
         if self.s is not None:
-            pickled_message_size = self._receive_all_bytes(4)
-            message_size = struct.unpack("!I", pickled_message_size)[0]
-            data = self._receive_all_bytes(message_size)
-            source_env_robot_state = pickle.loads(data)
+            source_env_robot_state = self.channel.receive()
             print("Receiving source object state and source robot pose from source robot")
             assert source_env_robot_state.message == "Ready"
             self.set_object_state(set_to_target_object_state=source_env_robot_state.object_state)
-            self.drive_robot_to_target_pose(source_env_robot_state.robot_pose)
+            with span("drive_robot_to_target_pose"):
+                self.drive_robot_to_target_pose(source_env_robot_state.robot_pose)
             
             # tell the source robot that the target robot is ready
             # Create an instance of Data() to send to client.
             variable = Data()
             variable.message = "Ready"
-            # Pickle the object and send it to the server
-            data_string = pickle.dumps(variable)
-            message_length = struct.pack("!I", len(data_string))
-            self.s.sendall(message_length)
-            self.s.send(data_string)
+            self.channel.send(variable)
         
         video_count = 0  # video frame counter
         total_reward = 0.
@@ -136,7 +142,8 @@ class TargetRobot(Robot):
             # state_dict and obs are before taking the action
             state_dict = self.env.get_state()
             # print("State dict: ", state_dict)
-            obs = deepcopy(self.obs)
+            # Observations are never modified in place, so obs shares its arrays with self.obs
+            obs = as_observation(self.obs, debug=self.debug_observations)
             # import matplotlib.pyplot as plt; plt.imshow(obs["agentview_image"]); plt.show()
             if not self.passive:
                 # send state_dict and obs to source robot
@@ -156,18 +163,12 @@ class TargetRobot(Robot):
                     depth_normalized = obs['agentview_depth']
                     depth_normalized = cv2.flip(depth_normalized, 0)
                     depth_img = camera_utils.get_real_depth_map(self.core_env.sim, depth_normalized)
-                    # save the rgb image
-                    cv2.imwrite(os.path.join(self.save_paired_images_folder_path, "{}_rgb".format(self.robot_name.lower()), str(demo_index), "{}.jpg".format(step_i)), cv2.cvtColor(rgb_img, cv2.COLOR_RGB2BGR) * 255)
-                    # save the segmentation mask
-                    cv2.imwrite(os.path.join(self.save_paired_images_folder_path, "{}_mask".format(self.robot_name.lower()), str(demo_index), "{}.jpg".format(step_i)), segmentation_mask * 255)
-                    # save the EE pose
-                    with open(os.path.join(self.save_paired_images_folder_path, "{}_ee_pose".format(self.robot_name.lower()), str(demo_index), "{}.txt".format(step_i)), "w") as f:
-                        f.write(str(np.concatenate([self.compute_eef_pose(), obs['robot0_gripper_qpos']])))
-                    # save the joint angles and gripper pose
-                    with open(os.path.join(self.save_paired_images_folder_path, "{}_joint_gripper_pose".format(self.robot_name.lower()), str(demo_index), "{}.txt".format(step_i)), "w") as f:
-                        f.write(str(np.concatenate([obs['robot0_joint_pos'], obs['robot0_gripper_qpos']])))
-                    # save the depth map
-                    np.save(os.path.join(self.save_paired_images_folder_path, "{}_depth".format(self.robot_name.lower()), str(demo_index), "{}.npy".format(step_i)), depth_img)
+                    self.paired_dataset.append(demo_index,
+                                               rgb=np.rint(rgb_img * 255).astype(np.uint8),
+                                               mask=segmentation_mask.astype(np.uint8),
+                                               ee_pose=np.concatenate([self.compute_eef_pose(), obs['robot0_gripper_qpos']]),
+                                               joint_gripper_pose=np.concatenate([obs['robot0_joint_pos'], obs['robot0_gripper_qpos']]),
+                                               depth=depth_img.reshape(depth_img.shape[:2]).astype(np.float32))
 
                 if self.inpaint_enabled:
                     joint_angles = obs['robot0_joint_pos']
@@ -192,7 +193,7 @@ class TargetRobot(Robot):
                                 "real_depth_map": depth_img,
                                 "points": points,
                                 "extrinsic_matrix": camera_utils.get_camera_extrinsic_matrix(self.core_env.sim, camera_name="agentview"),
-                                "intrinsic_matrix": camera_utils.get_camera_intrinsic_matrix(self.core_env.sim, camera_name="agentview", camera_height=84, camera_width=84),
+                                "intrinsic_matrix": self.get_camera_rays("agentview", 84, 84)[0],
                             },
                             "low_dim": {
                                 "joint_angles": joint_angles,
@@ -226,8 +227,10 @@ class TargetRobot(Robot):
 
                             data = ROSInpaintSimData(ros_rgb_img, ros_depth_img, ros_segmentation_mask, eef_pose_matrix, obs['robot0_gripper_qpos'][-1:])
                             print("Joints including gripper", sent_joint_angles)
-                            self.ros_inpaint_publisher.publish_to_ros_node(data)
-                            inpainted_image = self.ros_inpaint_publisher.get_inpainted_image(True)
+                            with span("publish_to_ros_node"):
+                                self.ros_inpaint_publisher.publish_to_ros_node(data)
+                            with span("get_inpainted_image"):
+                                inpainted_image = self.ros_inpaint_publisher.get_inpainted_image(True)
                             inpainted_image = inpainted_image.astype(np.float32) / 255.0
                             print("Received inpainted image")
                         
@@ -244,7 +247,7 @@ class TargetRobot(Robot):
                                     segmentation_mask_source_robot = inpainted_image
                                     masked_image = mask_rgb_image(rgb_img, segmentation_mask_target_robot, segmentation_mask_source_robot)
                                 else:
-                                    source_robot_info = np.load(self.groundtruth_and_inpaintedprediction_path, allow_pickle=True).item()
+                                    source_robot_info = self.load_source_robot_info(include_prediction=False)
                                     segmentation_mask_target_robot = segmentation_mask
                                     segmentation_mask_source_robot = source_robot_info["ground_truth"]["segmentation_mask"]
                                     masked_image = mask_rgb_image(rgb_img, segmentation_mask_target_robot, segmentation_mask_source_robot)
@@ -253,7 +256,7 @@ class TargetRobot(Robot):
                                 inpainted_image_256, inpainted_image_84 = self.controlnet.inpaint(masked_image)
                             
                             inpainted_image = inpainted_image_256
-                    np.save(self.inpainted_img_path, inpainted_image, allow_pickle=True)
+                    self.save_image("inpainted", self.inpainted_img_path, inpainted_image)
                     if self.use_diffusion:
                         np.save(self.diffusion_model_input_path, diffusion_input, allow_pickle=True)
                     cv2.imwrite(self.inpainted_rgb_img_path, cv2.cvtColor(inpainted_image, cv2.COLOR_RGB2BGR) * 255)
@@ -262,25 +265,18 @@ class TargetRobot(Robot):
 
                 if self.naive:
                     rgb_img = obs['agentview_image']
-                    np.save(f"{self.save_stats_path}/naive_input.npy", rgb_img, allow_pickle=True)
+                    self.save_image("naive", f"{self.save_stats_path}/naive_input.npy", rgb_img)
 
-                # Pickle the object and send it to the server
-                data_string = pickle.dumps(variable)
-                message_length = struct.pack("!I", len(data_string))
-                self.s.sendall(message_length)
-                self.s.sendall(data_string)
+                self.channel.send(variable)
             
                 
             # receive target object state and target robot pose from target robot
             if self.s is not None:
-                pickled_message_size = self._receive_all_bytes(4)
-                message_size = struct.unpack("!I", pickled_message_size)[0]
-                data = self._receive_all_bytes(message_size)
-                source_env_robot_state = pickle.loads(data)
+                source_env_robot_state = self.channel.receive()
                 assert source_env_robot_state.message == "Respond with Action", "Wrong Synchronization"
                 # print("Received actions")
                 if self.inpaint_enabled:
-                    timestep_info_dict["source_robot"] = np.load(self.groundtruth_and_inpaintedprediction_path, allow_pickle=True).item()
+                    timestep_info_dict["source_robot"] = self.load_source_robot_info()
                 if source_env_robot_state.done:
                     print("Source robot is done")
                 if source_env_robot_state.success:
@@ -351,7 +347,7 @@ class TargetRobot(Robot):
                 #     np.save(self.inpaint_data_for_analysis_path_temp, trajectory_timestep_infos_temp, allow_pickle=True)
             if success:
                 has_succeeded = True
-            next_obs = deepcopy(self.obs)
+            next_obs = as_observation(self.obs, debug=self.debug_observations)
             total_reward += r
             
             # if the source robot has succeeded, allow 10 more steps for the target robot to finish so we can terminate early
@@ -372,11 +368,7 @@ class TargetRobot(Robot):
             variable.success = has_succeeded
             if done or success:
                 print("Done: ", done, "Success: ", success)
-            # Pickle the object and send it to the server
-            data_string = pickle.dumps(variable)
-            message_length = struct.pack("!I", len(data_string))
-            self.s.sendall(message_length)
-            self.s.send(data_string)
+            self.channel.send(variable)
             
             # visualization
             if self.render:
@@ -384,15 +376,7 @@ class TargetRobot(Robot):
             if self.write_video:
                 
                 if video_count % video_skip == 0:
-                    video_img = []
-                    for cam_name in camera_names:
-                        video_img.append(self.env.render(mode="rgb_array", height=512, width=512, camera_name=cam_name))
-                    video_img = np.concatenate(video_img, axis=1) # concatenate horizontally
-                    #save video frame
-                    img_to_save = video_img
-                    if img_to_save.dtype != np.uint8:
-                        img_to_save = (img_to_save * 255).astype(np.uint8)
-                    cv2.imwrite(f"{self.save_stats_path}/video_frame_{video_count}.png", cv2.cvtColor(img_to_save, cv2.COLOR_RGB2BGR))
+                    video_img = render_video_frame(self.env, camera_names, self.video_height, self.video_width, obs=next_obs)
                     self.video_writer.append_data(video_img)
 
                 video_count += 1
@@ -413,8 +397,9 @@ class TargetRobot(Robot):
                 # Note: We need to "unprocess" the observations to prepare to write them to dataset.
                 #       This includes operations like channel swapping and float to uint8 conversion
                 #       for saving disk space.
-                traj["obs"].append(ObsUtils.unprocess_obs_dict(obs))
-                traj["next_obs"].append(ObsUtils.unprocess_obs_dict(next_obs))
+                traj["obs"].append(ObsUtils.unprocess_obs_dict(obs.to_dict()))
+                traj["next_obs"].append(ObsUtils.unprocess_obs_dict(next_obs.to_dict()))
+            obs.verify()
                 
             
             # break if done or if success
@@ -469,21 +454,6 @@ class TargetRobot(Robot):
                 traj[k] = np.array(traj[k])
 
         return stats, traj, trajectory_timestep_infos
-    
-    def _receive_all_bytes(self, num_bytes: int) -> bytes:
-        """
-        Receives all the bytes.
-        :param num_bytes: The number of bytes.
-        :return: The bytes.
-        """
-        data = bytearray(num_bytes)
-        pos = 0
-        while pos < num_bytes:
-            cr = self.s.recv_into(memoryview(data)[pos:])
-            if cr == 0:
-                raise EOFError
-            pos += cr
-        return data
 
 def mask_rgb_image(rgb_image, mask1, mask2):
     # Create a combined mask of the union of mask1 and mask2
@@ -563,6 +533,26 @@ if __name__ == "__main__":
         help="render frames to video every n steps",
     )
 
+    # Resolution and codec of the videos
+    parser.add_argument(
+        "--video_height",
+        type=int,
+        default=512,
+        help="height of the video frames, camera observations of the same resolution are reused instead of rendered",
+    )
+    parser.add_argument(
+        "--video_width",
+        type=int,
+        default=512,
+        help="width of every camera in the video frames",
+    )
+    parser.add_argument(
+        "--video_codec",
+        type=str,
+        default="libx264",
+        help="ffmpeg codec of the videos",
+    )
+
     # camera names to render
     parser.add_argument(
         "--camera_names",
@@ -646,6 +636,19 @@ if __name__ == "__main__":
         default=100,
         help="(optional) if provided, the source robot will drive to the target pose with this maximum number of iterations",
     )
+    parser.add_argument(
+        "--drive_mode",
+        type=str,
+        default="controller",
+        choices=DRIVE_MODES,
+        help="how the robot is driven to the pose of the other robot. controller: absolute OSC actions, ik: joints set to an IK solution, "
+             "with the controller as fallback, ik_measured: ik, also counting the controller iterations saved",
+    )
+    parser.add_argument(
+        "--hard_reset",
+        action='store_true',
+        help="if True, rebuild the simulation model on every reset instead of keeping it while the model XML is unchanged",
+    )
     parser.add_argument(
         "--delta_action",
         action='store_true',
@@ -670,7 +673,7 @@ if __name__ == "__main__":
         "--save_paired_images_folder_path",
         type=str,
         default=None,
-        help="directory of the folder to save paired images and masks",
+        help="directory of the folder to save paired images and masks, written to <robot>.hdf5 with one group per demo",
     )    
     parser.add_argument(
         "--use_diffusion",
@@ -709,11 +712,28 @@ if __name__ == "__main__":
         action='store_true',
         help="if True, add black patches to the target robot camera images",
     )
+    parser.add_argument(
+        "--shared_memory",
+        action='store_true',
+        help="if True, exchange images with the source robot through shared memory instead of .npy files",
+    )
+    parser.add_argument(
+        "--debug_observations",
+        action='store_true',
+        help="if True, raise when an observation is modified in place",
+    )
+    parser.add_argument(
+        "--trace",
+        action='store_true',
+        help="if True, time the stages of the rollouts and write a Chrome trace and a summary next to the stats file",
+    )
     args = parser.parse_args()
+    if args.trace:
+        tracer.enable("target robot")
     
     
    
     time.sleep(4) # wait for the server to start
-    target_robot = TargetRobot(robot_name=args.robot_name, ckpt_path=args.agent, render=args.render, video_path=args.video_path, rollout_horizon=args.horizon, dataset_path=args.dataset_path, passive=args.passive, port=args.port, connection=args.connection, demo_path=args.demo_path, inpaint_enabled=args.inpaint_enabled, offline_eval=args.offline_eval, save_paired_images=args.save_paired_images, save_paired_images_folder_path=args.save_paired_images_folder_path, use_diffusion=args.use_diffusion, use_ros=args.use_ros, diffusion_input=args.diffusion_input, device=args.device, save_failed_demos=args.save_failed_demos, gripper_types=args.gripper, naive=args.naive, save_stats_path=args.save_stats_path, add_patches=args.add_patches)
+    target_robot = TargetRobot(robot_name=args.robot_name, ckpt_path=args.agent, render=args.render, video_path=args.video_path, rollout_horizon=args.horizon, dataset_path=args.dataset_path, passive=args.passive, port=args.port, connection=args.connection, demo_path=args.demo_path, inpaint_enabled=args.inpaint_enabled, offline_eval=args.offline_eval, save_paired_images=args.save_paired_images, save_paired_images_folder_path=args.save_paired_images_folder_path, use_diffusion=args.use_diffusion, use_ros=args.use_ros, diffusion_input=args.diffusion_input, device=args.device, save_failed_demos=args.save_failed_demos, gripper_types=args.gripper, naive=args.naive, save_stats_path=args.save_stats_path, add_patches=args.add_patches, use_shared_memory=args.shared_memory, debug_observations=args.debug_observations, video_height=args.video_height, video_width=args.video_width, video_codec=args.video_codec, drive_mode=args.drive_mode, fast_reset=not args.hard_reset)
     target_robot.run_experiments(seeds=args.seeds, rollout_num_episodes=args.n_rollouts, video_skip=args.video_skip, camera_names=args.camera_names, dataset_obs=args.dataset_obs, save_stats_path=args.save_stats_path, tracking_error_threshold=args.tracking_error_threshold, num_iter_max=args.num_iter_max, target_robot_delta_action=args.delta_action, inpaint_online_eval=not target_robot.offline_eval)
 
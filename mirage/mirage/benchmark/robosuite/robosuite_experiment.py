@@ -1,9 +1,20 @@
 import subprocess
-import random
+import socket
 import os
+from typing import Optional, Tuple
 
 from mirage.benchmark.robosuite.robosuite_experiment_config import ExperimentRobotsuiteConfig
 
+def find_free_port(host: str = "localhost") -> int:
+    """
+    Asks the OS for a free port by binding port 0, so that concurrent experiments get different ports.
+    :param host: host the source robot server binds to
+    :return: port number
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
 class RobosuiteExperiment:
     """
     Used to manage the processes running in the experiments.
@@ -17,6 +28,8 @@ class RobosuiteExperiment:
 
         self._source_process = None
         self._target_process = None
+        self._log_files = []
+        self.port = None
 
     def get_config(self) -> ExperimentRobotsuiteConfig:
         """
@@ -24,9 +37,12 @@ class RobosuiteExperiment:
         """
         return self._config
 
-    def launch(self, override=False) -> None:
+    def launch(self, override=False, port: Optional[int] = None, log_to_files=False) -> None:
         """
         Launches the experiment
+        :param override: If True, reuses an existing results folder
+        :param port: Port of the connection between the source and target robots, a free one is found if None
+        :param log_to_files: If True, the output of the processes goes to source.log and target.log in the results folder
         """
         if not os.path.exists(self._config.results_folder):
             os.makedirs(self._config.results_folder)
@@ -75,12 +91,11 @@ class RobosuiteExperiment:
             source_agent_args.append("--connection")
             target_agent_args.append("--connection")
 
-            # TODO(kdharmarajan): This is not actually guaranteed to be random, so this needs to be fixed downstream.
-            random_port = random.randint(10000, 65535)
+            self.port = find_free_port() if port is None else port
             source_agent_args.append("--port")
-            source_agent_args.append(str(random_port))
+            source_agent_args.append(str(self.port))
             target_agent_args.append("--port")
-            target_agent_args.append(str(random_port))
+            target_agent_args.append(str(self.port))
 
         if self._config.delta_action:
             target_agent_args.append("--delta_action")
@@ -92,6 +107,18 @@ class RobosuiteExperiment:
         if self._config.target_video_path:
             target_agent_args.append("--video_path")
             target_agent_args.append(self._config.target_video_path)
+
+        for agent_args in [source_agent_args, target_agent_args]:
+            agent_args.append("--video_height")
+            agent_args.append(str(self._config.video_height))
+            agent_args.append("--video_width")
+            agent_args.append(str(self._config.video_width))
+            agent_args.append("--video_codec")
+            agent_args.append(self._config.video_codec)
+            agent_args.append("--drive_mode")
+            agent_args.append(self._config.drive_mode)
+            if self._config.hard_reset:
+                agent_args.append("--hard_reset")
         
         if self._config.enable_inpainting:
             source_agent_args.append("--inpaint_enabled")
@@ -120,8 +147,21 @@ class RobosuiteExperiment:
             source_agent_args.append("--add_patches")
             target_agent_args.append("--add_patches")
 
-        self._source_process = subprocess.Popen(source_agent_args)
-        self._target_process = subprocess.Popen(target_agent_args)
+        if self._config.use_shared_memory:
+            source_agent_args.append("--shared_memory")
+            target_agent_args.append("--shared_memory")
+
+        if self._config.trace:
+            source_agent_args.append("--trace")
+            target_agent_args.append("--trace")
+
+        source_output = target_output = None
+        if log_to_files:
+            source_output = open(os.path.join(self._config.results_folder, "source.log"), "w")
+            target_output = open(os.path.join(self._config.results_folder, "target.log"), "w")
+            self._log_files = [source_output, target_output]
+        self._source_process = subprocess.Popen(source_agent_args, stdout=source_output, stderr=subprocess.STDOUT if log_to_files else None)
+        self._target_process = subprocess.Popen(target_agent_args, stdout=target_output, stderr=subprocess.STDOUT if log_to_files else None)
 
     def stop(self) -> None:
         """
@@ -129,6 +169,31 @@ class RobosuiteExperiment:
         """
         self._source_process.kill()
         self._target_process.kill()
+        self._close_log_files()
+
+    def poll(self) -> Optional[Tuple[int, int]]:
+        """
+        Checks whether the experiment finished without waiting for it.
+        If one of the processes failed, the other one is stopped since it would wait on the connection forever.
+        :return: Return codes of the source and target processes, or None if the experiment is still running
+        """
+        source_returncode = self._source_process.poll()
+        target_returncode = self._target_process.poll()
+        if source_returncode is None and target_returncode is None:
+            return None
+        if (source_returncode or target_returncode) and (source_returncode is None or target_returncode is None):
+            self.stop()
+            source_returncode = self._source_process.wait()
+            target_returncode = self._target_process.wait()
+        if source_returncode is None or target_returncode is None:
+            return None
+        self._close_log_files()
+        return source_returncode, target_returncode
+
+    def _close_log_files(self) -> None:
+        for log_file in self._log_files:
+            log_file.close()
+        self._log_files = []
 
     def get_results(self, blocking = False) -> None:
         """
@@ -138,6 +203,7 @@ class RobosuiteExperiment:
         if blocking:
             self._source_process.wait()
             self._target_process.wait()
+            self._close_log_files()
         with open(os.path.join(self._config.results_folder, "source.txt"), "r") as source_file:
             source_stats = source_file.read()
         with open(os.path.join(self._config.results_folder, "target.txt"), "r") as target_file:
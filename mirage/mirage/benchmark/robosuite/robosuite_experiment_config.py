@@ -46,6 +46,10 @@ class ExperimentRobotsuiteConfig(ExperimentConfig):
     # Optional video paths for source and target
     source_video_path: Optional[str] = None
     target_video_path: Optional[str] = None
+    # Resolution and ffmpeg codec of the videos
+    video_height: Optional[int] = 512
+    video_width: Optional[int] = 512
+    video_codec: Optional[str] = "libx264"
 
     # Optional gripper type for source and target
     source_gripper_type: Optional[str] = None
@@ -57,6 +61,18 @@ class ExperimentRobotsuiteConfig(ExperimentConfig):
     # Optional add_patches parameter
     add_patches: Optional[bool] = False
 
+    # Optional exchange of images between the source and target robots through shared memory
+    use_shared_memory: Optional[bool] = False
+
+    # Optional way of driving a robot to the pose of the other robot, one of controller, ik or ik_measured
+    drive_mode: Optional[str] = "controller"
+
+    # Optional rebuild of the simulation model on every reset, instead of keeping it while the model XML is unchanged
+    hard_reset: Optional[bool] = False
+
+    # Optional timing of the rollout stages, written as source_trace.json and target_trace.json in the results folder
+    trace: Optional[bool] = False
+
     def validate_config(self):
         """
         Validates the configuration to see if the values are feasible.
@@ -83,6 +99,9 @@ class ExperimentRobotsuiteConfig(ExperimentConfig):
         if self.target_num_iter_max <= 0:
             raise ValueError("Target number of iterations should be a positive integer")
         
+        if self.drive_mode not in ["controller", "ik", "ik_measured"]:
+            raise ValueError("Drive mode should be one of controller, ik or ik_measured")
+        
         # TODO(kdharmarajan): Properly validate everything
 
     def __str__(self):
@@ -110,10 +129,16 @@ class ExperimentRobotsuiteConfig(ExperimentConfig):
         table.add_row(["Diffusion Input Type", self.diffusion_input_type])
         table.add_row(["Source Video Path", self.source_video_path])
         table.add_row(["Target Video Path", self.target_video_path])
+        table.add_row(["Video Resolution", f"{self.video_height}x{self.video_width}"])
+        table.add_row(["Video Codec", self.video_codec])
         table.add_row(["Source Gripper Type", self.source_gripper_type])
         table.add_row(["Target Gripper Type", self.target_gripper_type])
         table.add_row(["Results Folder", self.results_folder])
         table.add_row(["Device", self.device])
+        table.add_row(["Use Shared Memory", self.use_shared_memory])
+        table.add_row(["Drive Mode", self.drive_mode])
+        table.add_row(["Hard Reset", self.hard_reset])
+        table.add_row(["Trace", self.trace])
         return table.get_formatted_string()
     
     @staticmethod
@@ -148,8 +173,15 @@ class ExperimentRobotsuiteConfig(ExperimentConfig):
                 results_folder=config["results_folder"],
                 source_video_path=config.get("source_video_path"),
                 target_video_path=config.get("target_video_path"),
+                video_height=config.get("video_height", 512),
+                video_width=config.get("video_width", 512),
+                video_codec=config.get("video_codec", "libx264"),
                 source_gripper_type=config.get("source_gripper_type"),
                 target_gripper_type=config.get("target_gripper_type"),
                 device=config.get("device", "cuda"),
                 add_patches=config.get("add_patches", False),
+                use_shared_memory=config.get("use_shared_memory", False),
+                drive_mode=config.get("drive_mode", "controller"),
+                hard_reset=config.get("hard_reset", False),
+                trace=config.get("trace", False),
             )
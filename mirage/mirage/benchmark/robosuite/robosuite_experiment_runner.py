@@ -0,0 +1,127 @@
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+import os
+import time
+
+from mirage.benchmark.robosuite.robosuite_experiment import RobosuiteExperiment, find_free_port
+from mirage.benchmark.robosuite.robosuite_experiment_config import ExperimentRobotsuiteConfig
+
+@dataclass
+class ExperimentResult:
+    """
+    Outcome of one source/target pair run by the RobosuiteExperimentRunner.
+    """
+    config: ExperimentRobotsuiteConfig
+    source_returncode: int
+    target_returncode: int
+    # Contents of source.txt and target.txt, None if the process did not write them
+    source_stats: Optional[str] = None
+    target_stats: Optional[str] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.source_returncode == 0 and self.target_returncode == 0
+
+class RobosuiteExperimentRunner:
+    """
+    Runs many experiments while keeping several source/target pairs running at the same time.
+
+    Every pair gets a port the OS reported free, and the ports of running pairs are never handed
+    out again, so pairs do not connect to each other. Pairs only share the files of their results
+    folder and video paths, which therefore have to be different for every experiment. A pair
+    takes one of max_parallel slots and, if its device is in gpu_slots, one slot of its device.
+    Pairs inpainting through ROS take the single ROS slot, since the ROS inpainting node serves
+    one robot at a time.
+    """
+
+    def __init__(self, configs: List[ExperimentRobotsuiteConfig], max_parallel: int = 4, gpu_slots: Optional[Dict[str, int]] = None, poll_interval: float = 1.0) -> None:
+        """
+        :param configs: Experiments to run, launched in order
+        :param max_parallel: Maximum number of pairs running at the same time
+        :param gpu_slots: Maximum number of pairs running at the same time per device, e.g. {"cuda:0": 2, "cuda:1": 2}
+        :param poll_interval: Seconds between checks for finished pairs
+        """
+        if max_parallel <= 0:
+            raise ValueError("Number of parallel experiments should be a positive integer")
+        self._configs = list(configs)
+        self._max_parallel = max_parallel
+        self._gpu_slots = dict(gpu_slots or {})
+        self._poll_interval = poll_interval
+        self._validate_isolation()
+
+    def _validate_isolation(self) -> None:
+        """
+        Checks that no two experiments write to the same scratch files.
+        :throws ValueError: If two experiments share a results folder or video path.
+        """
+        used_paths = {}
+        for index, config in enumerate(self._configs):
+            config.validate_config()
+            for path in (config.results_folder, config.source_video_path, config.target_video_path):
+                if path is None:
+                    continue
+                path = os.path.abspath(path)
+                if path in used_paths and used_paths[path] != index:
+                    raise ValueError(f"Experiments {used_paths[path]} and {index} both write to {path}")
+                used_paths[path] = index
+        for device, slots in self._gpu_slots.items():
+            if slots <= 0:
+                raise ValueError(f"Number of slots of {device} should be a positive integer")
+
+    def _uses_ros(self, config: ExperimentRobotsuiteConfig) -> bool:
+        return config.enable_inpainting and config.use_ros
+
+    def _can_launch(self, config: ExperimentRobotsuiteConfig, running: List[RobosuiteExperiment]) -> bool:
+        if len(running) >= self._max_parallel:
+            return False
+        running_configs = [experiment.get_config() for experiment in running]
+        if config.device in self._gpu_slots:
+            if sum(running_config.device == config.device for running_config in running_configs) >= self._gpu_slots[config.device]:
+                return False
+        if self._uses_ros(config) and any(self._uses_ros(running_config) for running_config in running_configs):
+            return False
+        return True
+
+    def _allocate_port(self, running: List[RobosuiteExperiment]) -> int:
+        running_ports = {experiment.port for experiment in running}
+        port = find_free_port()
+        while port in running_ports:
+            port = find_free_port()
+        return port
+
+    def run(self, override: bool = False) -> Iterator[ExperimentResult]:
+        """
+        Launches the experiments and yields their results in the order they finish.
+        :param override: If True, reuses existing results folders
+        """
+        pending = list(self._configs)
+        running = []
+        try:
+            while pending or running:
+                # Launch in order, so a pair waiting for a busy slot is not starved by later ones
+                while pending and self._can_launch(pending[0], running):
+                    experiment = RobosuiteExperiment(pending.pop(0))
+                    experiment.launch(override=override, port=self._allocate_port(running), log_to_files=True)
+                    running.append(experiment)
+
+                finished = False
+                for experiment in list(running):
+                    returncodes = experiment.poll()
+                    if returncodes is None:
+                        continue
+                    running.remove(experiment)
+                    finished = True
+                    yield self._collect_result(experiment, *returncodes)
+                if not finished:
+                    time.sleep(self._poll_interval)
+        finally:
+            for experiment in running:
+                experiment.stop()
+
+    def _collect_result(self, experiment: RobosuiteExperiment, source_returncode: int, target_returncode: int) -> ExperimentResult:
+        result = ExperimentResult(experiment.get_config(), source_returncode, target_returncode)
+        try:
+            result.source_stats, result.target_stats = experiment.get_results()
+        except FileNotFoundError:
+            pass
+        return result
@@ -1,5 +1,6 @@
 from mirage.benchmark.robosuite.robosuite_experiment_config import ExperimentRobotsuiteConfig
 from mirage.benchmark.robosuite.robosuite_experiment import RobosuiteExperiment
+from mirage.benchmark.robosuite.robosuite_experiment_runner import RobosuiteExperimentRunner
 
 import argparse
 import random
@@ -37,14 +38,37 @@ def setup_deterministic_behavior(seed):
     
     print(f"✓ Deterministic behavior configured with seed: {seed}")
 
+def run_parallel(config_paths, max_parallel, gpu_slots):
+    """
+    Runs several experiments with at most max_parallel source/target pairs at the same time.
+    """
+    configs = [ExperimentRobotsuiteConfig.from_yaml(config_path) for config_path in config_paths]
+    gpu_slots = {device: int(slots) for device, slots in (device_slots.split("=") for device_slots in gpu_slots)}
+    runner = RobosuiteExperimentRunner(configs, max_parallel=max_parallel, gpu_slots=gpu_slots)
+    for config_path, config in zip(config_paths, configs):
+        print(f"Queued {config_path}: {config.source_robot_name} -> {config.target_robot_name}, results in {config.results_folder}")
+    for result in runner.run(override=True):
+        status = "finished" if result.succeeded else f"failed (source {result.source_returncode}, target {result.target_returncode})"
+        print(f"Experiment in {result.config.results_folder} {status}")
+        print("Source Results:")
+        print(result.source_stats)
+        print("Target Results:")
+        print(result.target_stats)
+
 def main():
     parser = argparse.ArgumentParser(description="Mirage Robosuite Benchmark")
-    parser.add_argument("--config", type=str)
+    parser.add_argument("--config", type=str, nargs="+", help="One or more experiment configs, several are run in parallel")
+    parser.add_argument("--max_parallel", type=int, default=4, help="Maximum number of experiments running at the same time")
+    parser.add_argument("--gpu_slots", type=str, nargs="*", default=[], help="Maximum number of experiments per device, e.g. cuda:0=2 cuda:1=2")
     parser.add_argument("-y", action="store_true")
     args = parser.parse_args()
 
-    print("Loading config from: ", args.config)
-    config = ExperimentRobotsuiteConfig.from_yaml(args.config)
+    if len(args.config) > 1:
+        run_parallel(args.config, args.max_parallel, args.gpu_slots)
+        return
+
+    print("Loading config from: ", args.config[0])
+    config = ExperimentRobotsuiteConfig.from_yaml(args.config[0])
     print(config)
     
     # Set up deterministic behavior using the seed from config
@@ -0,0 +1,125 @@
+from contextlib import contextmanager
+from typing import Tuple
+import copy
+
+import numpy as np
+
+def eef_pose(sim, site_name: str) -> np.ndarray:
+    """
+    :return: 7D pose of an end effector site, position and xyzw quaternion
+    """
+    import robosuite.utils.transform_utils as T
+
+    site_id = sim.model.site_name2id(site_name)
+    position = np.array(sim.data.site_xpos[site_id])
+    rotation = np.array(T.mat2quat(sim.data.site_xmat[site_id].reshape([3, 3])))
+    return np.concatenate((position, rotation))
+
+def pose_error(pose: np.ndarray, target_pose: np.ndarray) -> float:
+    """
+    Error between 7D poses, as in Robot.compute_pose_error. Quaternions are equivalent up to sign.
+    """
+    return min(np.linalg.norm(pose - target_pose), np.linalg.norm(pose - np.concatenate((target_pose[:3], -target_pose[3:]))))
+
+def solve_eef_ik(sim, controller, target_pose: np.ndarray, tolerance: float = 0.003, max_iters: int = 100,
+                 damping: float = 0.05, max_step: float = 0.2) -> Tuple[bool, int]:
+    """
+    Moves the arm joints of a robosuite robot so that its end effector reaches a pose, by damped least
+    squares on the Jacobian of the MuJoCo end effector site. Only qpos is written and sim.forward run,
+    the simulation does not step, so this costs a forward kinematics pass per iteration instead of a
+    controlled env.step.
+    :param sim: MuJoCo simulation of the robosuite environment
+    :param controller: controller of the robot, which knows its end effector site and arm joints
+    :param target_pose: 7D end effector pose, position and xyzw quaternion
+    :param tolerance: pose error, as in Robot.compute_pose_error, below which the pose is reached
+    :param max_iters: maximum number of iterations
+    :param damping: damping of the least squares, avoids large steps near singularities
+    :param max_step: maximum norm of the joint update of an iteration in radians
+    :return: whether the pose was reached, and the number of iterations. If it was not reached, the
+             joints are restored.
+    """
+    import robosuite.utils.transform_utils as T
+    from robosuite.utils.control_utils import orientation_error
+
+    qpos_index = np.array(controller.qpos_index)
+    qvel_index = np.array(controller.qvel_index)
+    joint_index = np.array(controller.joint_index)
+    limited = sim.model.jnt_limited[joint_index].astype(bool)
+    lower_limits = sim.model.jnt_range[joint_index, 0][limited]
+    upper_limits = sim.model.jnt_range[joint_index, 1][limited]
+    target_rotation = T.quat2mat(target_pose[3:])
+    initial_qpos = np.array(sim.data.qpos[qpos_index])
+
+    for num_iters in range(max_iters + 1):
+        pose = eef_pose(sim, controller.eef_name)
+        if pose_error(pose, target_pose) <= tolerance:
+            sim.data.qvel[qvel_index] = 0
+            sim.forward()
+            return True, num_iters
+        if num_iters == max_iters:
+            break
+        error = np.concatenate((target_pose[:3] - pose[:3], orientation_error(target_rotation, T.quat2mat(pose[3:]))))
+        jacobian = np.concatenate((sim.data.get_site_jacp(controller.eef_name).reshape((3, -1))[:, qvel_index],
+                                   sim.data.get_site_jacr(controller.eef_name).reshape((3, -1))[:, qvel_index]))
+        step = jacobian.T @ np.linalg.solve(jacobian @ jacobian.T + damping ** 2 * np.eye(6), error)
+        # The linearization only holds for small steps
+        step_norm = np.linalg.norm(step)
+        if step_norm > max_step:
+            step *= max_step / step_norm
+        qpos = sim.data.qpos[qpos_index] + step
+        qpos[limited] = np.clip(qpos[limited], lower_limits, upper_limits)
+        sim.data.qpos[qpos_index] = qpos
+        sim.forward()
+
+    sim.data.qpos[qpos_index] = initial_qpos
+    sim.forward()
+    return False, max_iters
+
+def _as_list(value) -> list:
+    # Bimanual robots have a controller and a gripper per arm
+    return list(value.values()) if isinstance(value, dict) else [value]
+
+@contextmanager
+def restored_env_state(env, core_env):
+    """
+    Restores a robomimic robosuite environment to its state on entry when the block exits, so that env.step
+    can be called in the block without affecting the rollout: the simulation state, the step counters
+    and done flag of the episode, the controllers, the robot and gripper action buffers, the observables
+    and the observation history of frame stacking wrappers.
+    :param env: robomimic environment, possibly wrapped
+    :param core_env: robosuite environment of env
+    """
+    sim = core_env.sim
+    # The simulation, the environment and the robot models are shared with the copies, not copied
+    memo = {id(sim): sim, id(core_env): core_env}
+    for robot in core_env.robots:
+        memo[id(robot)] = robot
+        memo[id(robot.robot_model)] = robot.robot_model
+        for part in _as_list(robot.controller) + _as_list(robot.gripper):
+            memo[id(part)] = part
+    sim_state = sim.get_state()
+    episode = (core_env.timestep, core_env.cur_time, core_env.done)
+    objects = list(core_env.robots)
+    objects += [controller for robot in core_env.robots for controller in _as_list(robot.controller)]
+    objects += list(core_env._observables.values())
+    saved = [(obj, copy.deepcopy(obj.__dict__, memo)) for obj in objects]
+    grippers = [(gripper, copy.deepcopy(gripper.current_action)) for robot in core_env.robots for gripper in _as_list(robot.gripper)
+                if hasattr(gripper, "current_action")]
+    wrappers = []
+    wrapper = env
+    while wrapper is not core_env and hasattr(wrapper, "env"):
+        if hasattr(wrapper, "obs_history"):
+            wrappers.append((wrapper, copy.deepcopy(wrapper.obs_history)))
+        wrapper = wrapper.env
+    try:
+        yield
+    finally:
+        for obj, state in saved:
+            obj.__dict__.update(state)
+        for gripper, current_action in grippers:
+            gripper.current_action = current_action
+        for wrapper, obs_history in wrappers:
+            wrapper.obs_history = obs_history
+        core_env.timestep, core_env.cur_time, core_env.done = episode
+        sim.set_state(sim_state)
+        sim.forward()
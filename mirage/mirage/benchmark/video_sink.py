@@ -0,0 +1,92 @@
+from typing import List, Mapping, Optional
+import queue
+import threading
+
+import numpy as np
+
+class VideoSink:
+    """
+    Video file encoded by a background thread, so that encoding is not on the critical path of the rollouts.
+
+    append_data hands frames to the encoder through a bounded queue and only waits when the encoder
+    is max_queue_size frames behind. Frames are not copied, the caller must not modify them afterwards,
+    which holds for rendered frames and for observation images, see Observation.
+    """
+
+    def __init__(self, path: str, fps: int = 20, codec: str = "libx264", max_queue_size: int = 32) -> None:
+        """
+        :param path: path of the video file
+        :param fps: frames per second of the video
+        :param codec: ffmpeg codec of the video, e.g. libx264 or mpeg4
+        :param max_queue_size: number of frames waiting for the encoder after which append_data blocks
+        """
+        self.path = path
+        self._frames = queue.Queue(maxsize=max_queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._encode, args=(fps, codec), daemon=True)
+        self._thread.start()
+
+    def append_data(self, frame: np.ndarray) -> None:
+        """
+        Queues a H x W x 3 uint8 frame.
+        :throws RuntimeError: If encoding failed.
+        """
+        self._raise_error()
+        self._frames.put(frame)
+
+    def close(self) -> None:
+        """
+        Waits for the queued frames to be encoded and closes the video file.
+        :throws RuntimeError: If encoding failed.
+        """
+        if self._thread is None:
+            return
+        self._frames.put(None)
+        self._thread.join()
+        self._thread = None
+        self._raise_error()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise RuntimeError(f"Encoding the video {self.path} failed") from self._error
+
+    def _encode(self, fps: int, codec: str) -> None:
+        closed = False
+        try:
+            import imageio
+            writer = imageio.get_writer(self.path, fps=fps, codec=codec)
+            try:
+                while True:
+                    frame = self._frames.get()
+                    if frame is None:
+                        closed = True
+                        break
+                    writer.append_data(frame)
+            finally:
+                writer.close()
+        except Exception as error:
+            self._error = error
+            # Keeps consuming frames, so that append_data does not block until it raises the error
+            while not closed:
+                closed = self._frames.get() is None
+
+def render_video_frame(env, camera_names: List[str], height: int, width: int, obs: Optional[Mapping] = None) -> np.ndarray:
+    """
+    Renders a video frame with the cameras side by side.
+    Cameras whose observation image already has the resolution of the video are taken from obs instead of being rendered again.
+    :param env: robomimic environment
+    :param camera_names: cameras of the frame
+    :param height: height of the frame
+    :param width: width of a camera in the frame
+    :param obs: observation of the current simulator state
+    :return: height x (width * len(camera_names)) x 3 uint8 frame
+    """
+    images = []
+    for camera_name in camera_names:
+        image = None if obs is None else obs.get(f"{camera_name}_image")
+        if image is not None and image.shape == (3, height, width):
+            # Observation images are 3 x H x W floats in [0, 1], already upright
+            images.append(np.rint(image.transpose(1, 2, 0) * 255).astype(np.uint8))
+        else:
+            images.append(env.render(mode="rgb_array", height=height, width=width, camera_name=camera_name))
+    return np.concatenate(images, axis=1)
@@ -0,0 +1,235 @@
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import List, Optional, Set, Tuple
+
+import h5py
+import numpy as np
+
+from mirage.crosspainting.compositing import composite_robot
+
+# Attribute set on a demo of the output once all its datasets are written, demos without it are
+# rewritten when resuming
+COMPLETE_ATTRIBUTE = "crosspainted"
+# Gripper command of robosuite robots before their first action
+GRIPPER_OPEN = -1.0
+COMPRESSIONS = ["gzip", "lzf", "none"]
+
+# Renderers of a worker process, built once by _init_worker
+_worker = None
+
+
+def dataset_robot(env_meta: dict) -> str:
+    """
+    :return: robot of the environment a robomimic dataset was collected in
+    """
+    robots = env_meta["env_kwargs"]["robots"]
+    return robots[0] if isinstance(robots, (list, tuple)) else robots
+
+
+def _init_worker(input_path: str, target_robot: str, camera_name: str, image_size: int) -> None:
+    import robomimic.utils.file_utils as FileUtils
+    from mirage.crosspainting.robosuite_renderer import RobosuiteRobotRenderer
+
+    global _worker
+    env_meta = FileUtils.get_env_metadata_from_dataset(dataset_path=input_path)
+    source = RobosuiteRobotRenderer(env_meta, dataset_robot(env_meta), camera_name, image_size)
+    target = RobosuiteRobotRenderer(env_meta, target_robot, camera_name, image_size)
+    _worker = (input_path, source, target)
+
+
+def crosspaint_demo(demo: str, tracking_error_threshold: float, num_iter_max: int) -> Tuple[str, np.ndarray, np.ndarray]:
+    """
+    Crosspaints every frame of a demo in a worker process.
+    The source robot is rendered by replaying the states of the demo, and the target robot is driven
+    to the end effector pose of the source robot with the gripper command of the previous action,
+    which is the command the gripper of the source robot followed to reach the frame.
+    :param demo: name of the demo, e.g. demo_0
+    :return: demo, T x H x W x 3 uint8 crosspainted images in the dataset convention, and the
+             remaining retargeting error of every frame
+    """
+    input_path, source, target = _worker
+    with h5py.File(input_path, "r") as f:
+        states = f[f"data/{demo}/states"][()]
+        actions = f[f"data/{demo}/actions"][()]
+    target.reset()
+    images = None
+    errors = np.zeros(len(states))
+    for t, state in enumerate(states):
+        source_render = source.replay(state)
+        target.copy_objects_from(source)
+        gripper_action = actions[t - 1][-1] if t > 0 else GRIPPER_OPEN
+        errors[t] = target.drive_to(source.eef_pose(), gripper_action, tracking_error_threshold, num_iter_max)
+        target_render = target.render()
+        image = composite_robot(source_render.rgb, source_render.depth, source_render.mask,
+                                target_render.rgb, target_render.depth, target_render.mask)
+        if images is None:
+            images = np.zeros((len(states),) + image.shape, dtype=np.uint8)
+        # robosuite renders upside down, robomimic datasets store the images flipped
+        images[t] = image[::-1]
+    return demo, images, errors
+
+
+def open_output(f_in: h5py.File, output_path: str, source_robot: str, target_robot: str, resume: bool) -> Tuple[h5py.File, Set[str]]:
+    """
+    Opens the output dataset, and when resuming, removes the demos that were not completely written.
+    :return: output file and names of the demos already crosspainted
+    :throws ValueError: If the dataset to resume was crosspainted for other robots.
+    """
+    if resume and os.path.exists(output_path):
+        f_out = h5py.File(output_path, "a")
+        data = f_out["data"]
+        robots = (data.attrs.get("crosspaint_source_robot"), data.attrs.get("crosspaint_target_robot"))
+        if robots != (source_robot, target_robot):
+            f_out.close()
+            raise ValueError(f"{output_path} was crosspainted from {robots[0]} to {robots[1]}, not from {source_robot} to {target_robot}")
+        done = set()
+        for demo in list(data.keys()):
+            if data[demo].attrs.get(COMPLETE_ATTRIBUTE, False):
+                done.add(demo)
+            else:
+                del data[demo]
+        return f_out, done
+
+    f_out = h5py.File(output_path, "w")
+    data = f_out.create_group("data")
+    for key, value in f_in["data"].attrs.items():
+        data.attrs[key] = value
+    data.attrs["crosspaint_source_robot"] = source_robot
+    data.attrs["crosspaint_target_robot"] = target_robot
+    if "mask" in f_in:
+        f_in.copy(f_in["mask"], f_out, name="mask")
+    return f_out, set()
+
+
+def write_demo(f_in: h5py.File, f_out: h5py.File, demo: str, image_key: str, images: np.ndarray, errors: np.ndarray, compression: Optional[str]) -> None:
+    """
+    Writes a crosspainted demo: the crosspainted images replace image_key and every other dataset
+    of the demo is copied from the input.
+    """
+    demo_in = f_in[f"data/{demo}"]
+    demo_out = f_out["data"].create_group(demo)
+    for key, value in demo_in.attrs.items():
+        demo_out.attrs[key] = value
+    for name, item in demo_in.items():
+        if name in ("obs", "next_obs"):
+            obs_group = demo_out.create_group(name)
+            for obs_name, obs_item in item.items():
+                if obs_name != image_key:
+                    f_in.copy(obs_item, obs_group, name=obs_name)
+        else:
+            f_in.copy(item, demo_out, name=name)
+
+    # One chunk per frame, so that training reads single frames without decompressing the demo
+    chunks = (1,) + images.shape[1:]
+    demo_out["obs"].create_dataset(image_key, data=images, chunks=chunks, compression=compression)
+    if "next_obs" in demo_in and image_key in demo_in["next_obs"]:
+        # The frame after the last action was not recorded, the last frame is repeated instead
+        next_images = np.concatenate((images[1:], images[-1:]))
+        demo_out["next_obs"].create_dataset(image_key, data=next_images, chunks=chunks, compression=compression)
+    demo_out.create_dataset("crosspaint_error", data=errors)
+    demo_out.attrs[COMPLETE_ATTRIBUTE] = True
+    f_out.flush()
+
+
+def crosspaint_dataset(input_path: str,
+                       output_path: str,
+                       target_robot: str,
+                       image_key: str = "agentview_image",
+                       camera_name: str = "agentview",
+                       num_workers: int = os.cpu_count(),
+                       resume: bool = False,
+                       demos: Optional[List[str]] = None,
+                       compression: Optional[str] = "gzip",
+                       tracking_error_threshold: float = 0.003,
+                       num_iter_max: int = 100) -> str:
+    """
+    Crosspaints a robomimic dataset, e.g. a file written by scripts/split_hdf5.py, to another robot without ROS.
+    Demos are crosspainted in parallel by worker processes, each with its own simulators, and written
+    by this process as they finish, so an interrupted run can be resumed.
+    :param input_path: robomimic dataset whose images and states belong to the same robot
+    :param output_path: crosspainted dataset written
+    :param target_robot: robot painted into the images, one of [Sawyer, UR5e, Panda, Kinova3, Jaco, IIWA]
+    :param image_key: observation crosspainted
+    :param camera_name: robosuite camera of image_key
+    :param num_workers: number of worker processes
+    :param resume: if True, keeps the demos already written to output_path
+    :param demos: demos crosspainted, all demos of the input if None
+    :param compression: HDF5 compression of the crosspainted images
+    :param tracking_error_threshold: pose error below which the target robot stops moving
+    :param num_iter_max: maximum number of simulator steps to reach a pose
+    :return: output_path
+    """
+    import robomimic.utils.file_utils as FileUtils
+
+    env_meta = FileUtils.get_env_metadata_from_dataset(dataset_path=input_path)
+    source_robot = dataset_robot(env_meta)
+    with h5py.File(input_path, "r") as f_in:
+        if demos is None:
+            demos = sorted(f_in["data"].keys(), key=lambda demo: int(demo.split("_")[-1]))
+        image_size = f_in[f"data/{demos[0]}/obs/{image_key}"].shape[1]
+        f_out, done = open_output(f_in, output_path, source_robot, target_robot, resume)
+    todo = [demo for demo in demos if demo not in done]
+    print(f"Crosspainting {len(todo)} demos from {source_robot} to {target_robot}, {len(done)} already done")
+
+    # Simulators and HDF5 files do not survive a fork, the workers are spawned
+    context = multiprocessing.get_context("spawn")
+    start_time = time.time()
+    try:
+        with h5py.File(input_path, "r") as f_in, \
+             ProcessPoolExecutor(max_workers=num_workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(input_path, target_robot, camera_name, image_size)) as executor:
+            remaining = iter(todo)
+            pending = set()
+            num_written = 0
+            while True:
+                # At most two demos per worker are in flight, so finished demos do not pile up in memory
+                for demo in remaining:
+                    pending.add(executor.submit(crosspaint_demo, demo, tracking_error_threshold, num_iter_max))
+                    if len(pending) >= 2 * num_workers:
+                        break
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    demo, images, errors = future.result()
+                    write_demo(f_in, f_out, demo, image_key, images, errors, compression)
+                    num_written += 1
+                    print(f"{demo}: {len(images)} frames, max retargeting error {errors.max():.4f} "
+                          f"({num_written}/{len(todo)}, {time.time() - start_time:.0f}s)")
+    finally:
+        f_out.close()
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crosspaint robomimic datasets to other robots without ROS")
+    parser.add_argument("--input", type=str, required=True, help="robomimic dataset, e.g. a robot file of scripts/split_hdf5.py")
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--target_robots", type=str, nargs="+", required=True, help="Robots painted into the images, one output file each")
+    parser.add_argument("--image_key", type=str, default="agentview_image")
+    parser.add_argument("--camera_name", type=str, default="agentview")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--resume", action="store_true", help="Keep the demos already written to the output files")
+    parser.add_argument("--demos", type=str, nargs="+", default=None, help="Demos crosspainted, all demos by default")
+    parser.add_argument("--compression", type=str, default="gzip", choices=COMPRESSIONS)
+    parser.add_argument("--tracking_error_threshold", type=float, default=0.003)
+    parser.add_argument("--num_iter_max", type=int, default=100)
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    input_name = os.path.splitext(os.path.basename(args.input))[0]
+    for target_robot in args.target_robots:
+        output_path = os.path.join(args.output_dir, f"{input_name}_crosspainted_{target_robot}.hdf5")
+        crosspaint_dataset(args.input, output_path, target_robot,
+                           image_key=args.image_key,
+                           camera_name=args.camera_name,
+                           num_workers=args.num_workers,
+                           resume=args.resume,
+                           demos=args.demos,
+                           compression=None if args.compression == "none" else args.compression,
+                           tracking_error_threshold=args.tracking_error_threshold,
+                           num_iter_max=args.num_iter_max)
+        print(f"Wrote {output_path}")
@@ -0,0 +1,38 @@
+import cv2
+import numpy as np
+
+# Depth given to the pixels without target robot, and to the masked source robot pixels, as in the
+# inpainting of the write_data nodes: the inpainted background is behind every robot pixel
+NO_ROBOT_DEPTH = 1000.0
+MASKED_SCENE_DEPTH = 5.0
+
+
+def composite_robot(source_rgb: np.ndarray,
+                    source_depth: np.ndarray,
+                    source_mask: np.ndarray,
+                    target_rgb: np.ndarray,
+                    target_depth: np.ndarray,
+                    target_mask: np.ndarray,
+                    inpaint_radius: int = 3) -> np.ndarray:
+    """
+    Replaces the source robot of an image with a rendered target robot.
+    The source robot is removed with cv2.inpaint, and the target robot is drawn wherever it is
+    closer to the camera than the scene, so objects in front of the robot keep occluding it.
+    This is the compositing of the inpainting callback of the write_data nodes, without the Gazebo render.
+    :param source_rgb: H x W x 3 uint8 image of the source robot
+    :param source_depth: H x W depth of the source image in meters
+    :param source_mask: H x W mask of the source robot, non-zero on the robot
+    :param target_rgb: H x W x 3 uint8 render of the target robot
+    :param target_depth: H x W depth of the target render in meters
+    :param target_mask: H x W mask of the target robot, non-zero on the robot
+    :param inpaint_radius: radius of cv2.inpaint
+    :return: H x W x 3 uint8 crosspainted image
+    """
+    source_mask_255 = np.where(source_mask > 0, 255, 0).astype(np.uint8)
+    background = cv2.inpaint(np.ascontiguousarray(source_rgb, dtype=np.uint8), source_mask_255, inpaintRadius=inpaint_radius, flags=cv2.INPAINT_TELEA)
+
+    scene_depth = np.where((source_mask > 0) | (source_depth == 0), MASKED_SCENE_DEPTH, source_depth)
+    robot_depth = np.where((target_mask > 0) & (target_depth > 0), target_depth, NO_ROBOT_DEPTH)
+    # Ties go to the robot, like the argmin over (robot, scene) depths in the nodes
+    show_robot = robot_depth <= scene_depth
+    return np.where(show_robot[:, :, np.newaxis], target_rgb, background).astype(np.uint8)
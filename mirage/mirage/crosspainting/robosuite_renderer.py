@@ -0,0 +1,138 @@
+from copy import deepcopy
+from dataclasses import dataclass
+
+import numpy as np
+
+# MuJoCo joint type of the free joints of the task objects
+_FREE_JOINT = 0
+
+
+@dataclass
+class RobotRender:
+    """
+    Render of a robot in a camera, in the raw robosuite image convention.
+    """
+    rgb: np.ndarray
+    # Depth in meters
+    depth: np.ndarray
+    # Non-zero on the robot
+    mask: np.ndarray
+
+
+class RobosuiteRobotRenderer:
+    """
+    Renders one robot of a robosuite task with depth and a robot-only segmentation, without ROS.
+
+    The source robot of a dataset is rendered by replaying its simulator states. The target robot
+    cannot replay them, since the states of another robot do not fit its simulator, so it is
+    retargeted instead: the task objects are copied from the source simulator and the robot is
+    driven to the end effector pose of the source robot with absolute OSC actions, like
+    drive_robot_to_target_pose in the robosuite benchmark.
+    """
+
+    def __init__(self, env_meta: dict, robot: str, camera_name: str = "agentview", image_size: int = 84) -> None:
+        """
+        :param env_meta: environment metadata of the dataset, from FileUtils.get_env_metadata_from_dataset
+        :param robot: robot of the environment, one of [Sawyer, UR5e, Panda, Kinova3, Jaco, IIWA]
+        :param camera_name: camera rendered
+        :param image_size: height and width of the renders
+        """
+        import robomimic.utils.env_utils as EnvUtils
+
+        env_meta = deepcopy(env_meta)
+        env_meta["env_kwargs"]["camera_depths"] = True
+        env_meta["env_kwargs"]["camera_segmentations"] = "robot_only"
+        self.env = EnvUtils.create_env_for_data_processing(
+            env_meta=env_meta,
+            camera_names=[camera_name],
+            camera_height=image_size,
+            camera_width=image_size,
+            reward_shaping=False,
+            robot=robot
+        )
+        self.core_env = self.env.env
+        while hasattr(self.core_env, "env"):
+            self.core_env = self.core_env.env
+        if len(self.core_env.robots) != 1:
+            raise ValueError("Only single arm tasks can be crosspainted")
+        self.robot = robot
+        self.camera_name = camera_name
+        self.eef_site_name = self.core_env.robots[0].controller.eef_name
+        sim = self.core_env.sim
+        self.object_joint_names = [sim.model.joint_id2name(i) for i in range(sim.model.njnt) if sim.model.jnt_type[i] == _FREE_JOINT]
+        self._gripper_action = None
+
+    def reset(self) -> None:
+        self.env.reset()
+        self._gripper_action = None
+
+    def render(self) -> RobotRender:
+        """
+        Renders the current simulator state.
+        """
+        import robosuite.utils.camera_utils as camera_utils
+
+        obs = self.core_env._get_observations(force_update=True)
+        depth = camera_utils.get_real_depth_map(self.core_env.sim, obs[f"{self.camera_name}_depth"])
+        mask = obs[f"{self.camera_name}_segmentation_robot_only"]
+        return RobotRender(obs[f"{self.camera_name}_image"], depth.reshape(depth.shape[:2]), mask.reshape(mask.shape[:2]))
+
+    def replay(self, state: np.ndarray) -> RobotRender:
+        """
+        Sets the simulator to a state of the dataset and renders it.
+        """
+        self.env.reset_to({"states": state})
+        return self.render()
+
+    def eef_pose(self) -> np.ndarray:
+        """
+        :return: 7D end effector pose, position and xyzw quaternion
+        """
+        import robosuite.utils.transform_utils as T
+
+        site_id = self.core_env.sim.model.site_name2id(self.eef_site_name)
+        position = np.array(self.core_env.sim.data.site_xpos[site_id])
+        rotation = np.array(T.mat2quat(self.core_env.sim.data.site_xmat[site_id].reshape([3, 3])))
+        return np.concatenate((position, rotation))
+
+    def copy_objects_from(self, other: "RobosuiteRobotRenderer") -> None:
+        """
+        Moves the task objects to their poses in the simulator of another renderer of the same task.
+        """
+        for name in self.object_joint_names:
+            self.core_env.sim.data.set_joint_qpos(name, other.core_env.sim.data.get_joint_qpos(name))
+        self.core_env.sim.forward()
+
+    def drive_to(self, eef_pose: np.ndarray, gripper_action: float, tracking_error_threshold: float = 0.003, num_iter_max: int = 100) -> float:
+        """
+        Drives the robot to an end effector pose with absolute OSC actions.
+        :param eef_pose: 7D end effector pose, position and xyzw quaternion
+        :param gripper_action: gripper command held while driving
+        :param tracking_error_threshold: pose error below which the robot stops
+        :param num_iter_max: maximum number of simulator steps
+        :return: remaining pose error
+        """
+        import robosuite.utils.transform_utils as T
+
+        controller = self.core_env.robots[0].controller
+        controller.use_delta = False
+        action = np.zeros(7)
+        action[:3] = eef_pose[:3]
+        action[3:6] = T.quat2axisangle(eef_pose[3:])
+        action[6] = gripper_action
+        error = self._pose_error(eef_pose)
+        num_iters = 0
+        # The gripper only moves when the simulator steps, even if the arm is already in place
+        num_iter_min = 1 if gripper_action != self._gripper_action else 0
+        self._gripper_action = gripper_action
+        while (error > tracking_error_threshold or num_iters < num_iter_min) and num_iters < num_iter_max:
+            self.env.step(action)
+            error = self._pose_error(eef_pose)
+            num_iters += 1
+        controller.use_delta = True
+        return error
+
+    def _pose_error(self, eef_pose: np.ndarray) -> float:
+        pose = self.eef_pose()
+        # Quaternions are equivalent up to sign
+        return min(np.linalg.norm(pose - eef_pose), np.linalg.norm(pose - np.concatenate((eef_pose[:3], -eef_pose[3:]))))
@@ -0,0 +1,382 @@
+import argparse
+import os
+import socket
+import sqlite3
+import subprocess
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+CPU_DEVICE = "cpu"
+
+
+@dataclass
+class Job:
+    """
+    Shell command queued for a worker, with the resources it reserves while it runs.
+    """
+    id: int
+    name: str
+    command: str
+    cwd: Optional[str]
+    # MB of GPU memory reserved on one GPU, 0 for jobs that do not use a GPU
+    gpu_memory: int
+    cpu_cores: int
+    max_retries: int
+    attempts: int
+    status: str
+    worker: Optional[str] = None
+    host: Optional[str] = None
+    device: Optional[str] = None
+    returncode: Optional[int] = None
+
+
+@dataclass
+class DeviceCapacity:
+    """
+    Resources of one device of a host, as reported by a probe.
+    """
+    device: str
+    gpu_memory: int = 0
+
+
+class ResourceProbe:
+    """
+    Reports the devices of the host a worker runs on.
+    """
+
+    def devices(self) -> List[DeviceCapacity]:
+        raise NotImplementedError
+
+    def cpu_cores(self) -> int:
+        return os.cpu_count() or 1
+
+
+class NvmlProbe(ResourceProbe):
+    """
+    Reports the GPUs of the host through NVML.
+    """
+
+    def __init__(self, memory_fraction: float = 0.9) -> None:
+        """
+        :param memory_fraction: fraction of the memory of every GPU that jobs can reserve
+        """
+        self._memory_fraction = memory_fraction
+
+    def devices(self) -> List[DeviceCapacity]:
+        import pynvml
+        pynvml.nvmlInit()
+        try:
+            devices = []
+            for i in range(pynvml.nvmlDeviceGetCount()):
+                info = pynvml.nvmlDeviceGetMemoryInfo(pynvml.nvmlDeviceGetHandleByIndex(i))
+                devices.append(DeviceCapacity(f"cuda:{i}", int(info.total / 2**20 * self._memory_fraction)))
+            return devices
+        finally:
+            pynvml.nvmlShutdown()
+
+
+class FakeProbe(ResourceProbe):
+    """
+    Reports fixed devices, for tests and hosts without NVML.
+    """
+
+    def __init__(self, gpu_memory: List[int] = (), cpu_cores: int = 1) -> None:
+        """
+        :param gpu_memory: MB of memory of every GPU
+        :param cpu_cores: number of CPU cores
+        """
+        self._devices = [DeviceCapacity(f"cuda:{i}", memory) for i, memory in enumerate(gpu_memory)]
+        self._cpu_cores = cpu_cores
+
+    def devices(self) -> List[DeviceCapacity]:
+        return list(self._devices)
+
+    def cpu_cores(self) -> int:
+        return self._cpu_cores
+
+
+class JobQueue:
+    """
+    Durable queue of jobs in a SQLite database, shared by any number of worker processes.
+
+    Claims happen in IMMEDIATE transactions, so two workers never start the same job. Workers on
+    several hosts can share a queue on a filesystem with working POSIX locks, which excludes most
+    NFS setups.
+    """
+
+    def __init__(self, db_path: str, timeout: float = 30.0) -> None:
+        """
+        :param db_path: path of the SQLite database, created if needed
+        :param timeout: seconds to wait for another process holding the database lock
+        """
+        self._db = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, command TEXT NOT NULL, cwd TEXT,
+                gpu_memory INTEGER NOT NULL, cpu_cores INTEGER NOT NULL, max_retries INTEGER NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL DEFAULT 'queued',
+                worker TEXT, host TEXT, device TEXT, returncode INTEGER, updated REAL);
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+            CREATE TABLE IF NOT EXISTS workers (name TEXT PRIMARY KEY, host TEXT NOT NULL, last_seen REAL NOT NULL);
+        """)
+
+    def submit(self, name: str, command: str, cwd: Optional[str] = None, gpu_memory: int = 0, cpu_cores: int = 1, max_retries: int = 2) -> int:
+        """
+        Queues a job.
+        :param name: name of the job, used for its log file
+        :param command: shell command
+        :param cwd: directory the command runs in, the directory of the worker if None
+        :param gpu_memory: MB of GPU memory reserved on one GPU, 0 to run without a GPU
+        :param cpu_cores: number of CPU cores reserved
+        :param max_retries: number of times the job is requeued after it crashed
+        :return: ID of the job
+        """
+        if gpu_memory < 0 or cpu_cores < 0 or max_retries < 0:
+            raise ValueError("Resources and retries of a job should be non-negative")
+        cursor = self._db.execute(
+            "INSERT INTO jobs (name, command, cwd, gpu_memory, cpu_cores, max_retries, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (name, command, cwd, gpu_memory, cpu_cores, max_retries, time.time()))
+        return cursor.lastrowid
+
+    def jobs(self, status: Optional[str] = None) -> List[Job]:
+        """
+        :param status: only return jobs with this status
+        :return: jobs in submission order
+        """
+        query = "SELECT id, name, command, cwd, gpu_memory, cpu_cores, max_retries, attempts, status, worker, host, device, returncode FROM jobs"
+        parameters = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            parameters = (status,)
+        return [Job(*row) for row in self._db.execute(query + " ORDER BY id", parameters)]
+
+    def counts(self) -> Dict[str, int]:
+        """
+        :return: number of jobs with every status
+        """
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        counts.update(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+        return counts
+
+    def heartbeat(self, worker: str, host: str) -> None:
+        self._db.execute("INSERT OR REPLACE INTO workers VALUES (?, ?, ?)", (worker, host, time.time()))
+
+    def requeue_lost_jobs(self, timeout: float) -> int:
+        """
+        Requeues the running jobs of workers that have not sent a heartbeat for timeout seconds.
+        :return: number of requeued jobs
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            lost = self._db.execute(
+                "SELECT jobs.id, jobs.worker FROM jobs LEFT JOIN workers ON jobs.worker = workers.name "
+                "WHERE jobs.status = 'running' AND (workers.last_seen IS NULL OR workers.last_seen < ?)",
+                (time.time() - timeout,)).fetchall()
+            for job_id, worker in lost:
+                self._finish(job_id, worker, None)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return len(lost)
+
+    def claim(self, worker: str, host: str, probe: ResourceProbe) -> Optional[Job]:
+        """
+        Starts the oldest queued job that fits in the resources of the host left by its running jobs.
+        GPU jobs go to the GPU with the least free memory that fits them, to keep room for large jobs.
+        :param worker: name of the claiming worker
+        :param host: host of the claiming worker
+        :param probe: devices of the host
+        :return: the claimed job with its device set, or None if no queued job fits
+        """
+        devices = probe.devices()
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            free_memory = {device.device: device.gpu_memory for device in devices}
+            free_cores = probe.cpu_cores()
+            for device, gpu_memory, cpu_cores in self._db.execute(
+                    "SELECT device, gpu_memory, cpu_cores FROM jobs WHERE status = 'running' AND host = ?", (host,)):
+                if device in free_memory:
+                    free_memory[device] -= gpu_memory
+                free_cores -= cpu_cores
+
+            claimed = None
+            for job in self.jobs("queued"):
+                if job.cpu_cores > free_cores:
+                    continue
+                if job.gpu_memory == 0:
+                    claimed, device = job, CPU_DEVICE
+                    break
+                fitting = [(memory, name) for name, memory in free_memory.items() if memory >= job.gpu_memory]
+                if fitting:
+                    claimed, device = job, min(fitting)[1]
+                    break
+            if claimed is not None:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, host = ?, device = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                    (worker, host, device, time.time(), claimed.id))
+                claimed.status, claimed.worker, claimed.host, claimed.device = "running", worker, host, device
+                claimed.attempts += 1
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return claimed
+
+    def finish(self, job_id: int, worker: str, returncode: Optional[int]) -> Optional[str]:
+        """
+        Records the end of a job, requeueing it if it crashed and has retries left.
+        The result is ignored if the job no longer runs on the worker, e.g. it was requeued after the
+        worker stopped sending heartbeats and claimed by another worker.
+        :param job_id: ID of the job
+        :param worker: name of the worker that ran the job
+        :param returncode: exit code of the command, None if it was lost with its worker
+        :return: new status of the job, or None if the result was ignored
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            status = self._finish(job_id, worker, returncode)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return status
+
+    def release(self, job_id: int, worker: str) -> bool:
+        """
+        Puts a job that was stopped with its worker, not crashed, back in the queue without using one of its retries.
+        :param job_id: ID of the job
+        :param worker: name of the worker that ran the job
+        :return: False if the job no longer runs on the worker
+        """
+        cursor = self._db.execute(
+            "UPDATE jobs SET status = 'queued', attempts = attempts - 1, returncode = NULL, updated = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time(), job_id, worker))
+        return cursor.rowcount > 0
+
+    def _finish(self, job_id: int, worker: str, returncode: Optional[int]) -> Optional[str]:
+        row = self._db.execute("SELECT attempts, max_retries FROM jobs WHERE id = ? AND worker = ? AND status = 'running'", (job_id, worker)).fetchone()
+        if row is None:
+            return None
+        attempts, max_retries = row
+        if returncode == 0:
+            status = "done"
+        elif attempts <= max_retries:
+            status = "queued"
+        else:
+            status = "failed"
+        self._db.execute("UPDATE jobs SET status = ?, returncode = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                         (status, returncode, time.time(), job_id, worker))
+        return status
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class Worker:
+    """
+    Runs the jobs of a queue on one host, starting a job as soon as the host has room for it.
+
+    GPU jobs see their GPU as CUDA_VISIBLE_DEVICES, and write their output to <log_dir>/<name>_<id>.log.
+    Several workers can run on one host since reservations are counted per host.
+    """
+
+    def __init__(self, queue: JobQueue, probe: ResourceProbe, log_dir: str = "job_logs", poll_interval: float = 2.0, heartbeat_timeout: float = 120.0) -> None:
+        """
+        :param queue: queue the jobs are claimed from
+        :param probe: devices of the host
+        :param log_dir: directory of the job logs
+        :param poll_interval: seconds between checks for finished jobs and free resources
+        :param heartbeat_timeout: seconds after which the jobs of a silent worker are requeued
+        """
+        self._queue = queue
+        self._probe = probe
+        self._log_dir = log_dir
+        self._poll_interval = poll_interval
+        self._heartbeat_timeout = heartbeat_timeout
+        self.host = socket.gethostname()
+        self.name = f"{self.host}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._running = {}
+
+    def run(self, until_empty: bool = True) -> None:
+        """
+        Claims and runs jobs.
+        :param until_empty: return once no job is queued or running, otherwise wait for new jobs forever
+        """
+        os.makedirs(self._log_dir, exist_ok=True)
+        try:
+            while True:
+                self._queue.heartbeat(self.name, self.host)
+                self._queue.requeue_lost_jobs(self._heartbeat_timeout)
+                self._reap()
+                while self._start_next():
+                    pass
+                counts = self._queue.counts()
+                if until_empty and not self._running and counts["queued"] == 0 and counts["running"] == 0:
+                    return
+                time.sleep(self._poll_interval)
+        finally:
+            # The jobs did not crash, they are queued again for another worker
+            for job, process, log_file in self._running.values():
+                process.kill()
+                process.wait()
+                log_file.close()
+                self._queue.release(job.id, self.name)
+            self._running = {}
+
+    def _start_next(self) -> bool:
+        job = self._queue.claim(self.name, self.host, self._probe)
+        if job is None:
+            return False
+        env = dict(os.environ)
+        env["CUDA_VISIBLE_DEVICES"] = job.device.split(":")[1] if job.device != CPU_DEVICE else ""
+        log_file = open(os.path.join(self._log_dir, f"{job.name}_{job.id}.log"), "a")
+        process = subprocess.Popen(job.command, shell=True, cwd=job.cwd, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        print(f"Started job {job.id} ({job.name}) on {job.device}, attempt {job.attempts}")
+        self._running[job.id] = (job, process, log_file)
+        return True
+
+    def _reap(self) -> None:
+        for job_id, (job, process, log_file) in list(self._running.items()):
+            if process.poll() is None:
+                continue
+            log_file.close()
+            del self._running[job_id]
+            status = self._queue.finish(job_id, self.name, process.returncode)
+            if status is None:
+                print(f"Job {job_id} ({job.name}) exited with {process.returncode}, ignored since it was requeued")
+            else:
+                print(f"Job {job_id} ({job.name}) exited with {process.returncode}, now {status}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Durable job queue for evaluation and training runs")
+    parser.add_argument("--db", type=str, default="jobs.sqlite", help="Path of the queue database")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    submit_parser = subparsers.add_parser("submit", help="Queue a command")
+    submit_parser.add_argument("--name", type=str, required=True)
+    submit_parser.add_argument("--cwd", type=str, default=None)
+    submit_parser.add_argument("--gpu_memory", type=int, default=0, help="MB of GPU memory reserved, 0 for CPU jobs")
+    submit_parser.add_argument("--cpu_cores", type=int, default=1)
+    submit_parser.add_argument("--max_retries", type=int, default=2)
+    submit_parser.add_argument("job_command", type=str)
+    worker_parser = subparsers.add_parser("worker", help="Run queued jobs on this host")
+    worker_parser.add_argument("--log_dir", type=str, default="job_logs")
+    worker_parser.add_argument("--memory_fraction", type=float, default=0.9, help="Fraction of the memory of every GPU that jobs can reserve")
+    worker_parser.add_argument("--forever", action="store_true", help="Keep waiting for jobs when the queue is empty")
+    subparsers.add_parser("status", help="Print the jobs of the queue")
+    args = parser.parse_args()
+
+    queue = JobQueue(args.db)
+    if args.action == "submit":
+        print(queue.submit(args.name, args.job_command, cwd=args.cwd, gpu_memory=args.gpu_memory, cpu_cores=args.cpu_cores, max_retries=args.max_retries))
+    elif args.action == "worker":
+        Worker(queue, NvmlProbe(args.memory_fraction), log_dir=args.log_dir).run(until_empty=not args.forever)
+    else:
+        for job in queue.jobs():
+            print(f"{job.id:5d} {job.status:8s} {job.name:40s} attempts {job.attempts} device {job.device} returncode {job.returncode}")
+        print(queue.counts())
@@ -0,0 +1,160 @@
+import socket
+import struct
+import numpy as np
+from typing import List, Optional
+
+from mirage.infra.tracing import span
+
+# Messages exchanged by the source and target robot processes, encoded by their index
+MESSAGES = ("", "Ready", "Request for Action", "Respond with Action", "OK")
+
+_MAGIC = b"MRGS"
+_VERSION = 1
+
+# magic, version, message, flags, image dtype, image ndim, (padding),
+# object_state length, robot_pose length, action length, image shape
+_HEADER = struct.Struct("<4sBBBBBxxxIII3I")
+
+_DONE = 1
+_SUCCESS = 2
+_OBJECT_STATE_IS_DICT = 4
+
+# Image dtypes that can be carried by a message, encoded by their index (0 means no image)
+_IMAGE_DTYPES = (None, np.dtype(np.uint8), np.dtype(np.float32), np.dtype(np.float64))
+
+_VECTOR_DTYPE = np.dtype("<f8")
+
+
+class RobotStateMessage:
+    """
+    Message received over a RobotStateChannel. Mirrors the fields of Data in the robosuite
+    evaluation scripts.
+    """
+
+    def __init__(self, message: str = "", object_state=None, robot_pose: Optional[np.ndarray] = None,
+                 action: Optional[np.ndarray] = None, done: bool = False, success: bool = False,
+                 image: Optional[np.ndarray] = None) -> None:
+        self.message = message
+        self.object_state = np.zeros(7) if object_state is None else object_state
+        self.robot_pose = np.zeros(7) if robot_pose is None else robot_pose
+        self.action = np.zeros(7) if action is None else action
+        self.done = done
+        self.success = success
+        self.image = image
+
+
+class RobotStateChannel:
+    """
+    Pickle-free framing of the robot state messages sent between the source and target robot
+    processes. Every message is a fixed-layout header followed by the raw float64 buffers of
+    object_state, robot_pose and action, and optionally the raw buffer of an image.
+
+    Messages are sent with a single scatter/gather sendmsg call and received with recv_into into
+    buffers that are allocated once and grown as needed, and Nagle's algorithm is disabled since
+    every message is small and answered right away.
+    """
+
+    def __init__(self, sock: socket.socket, object_names: List[str]) -> None:
+        """
+        :param sock: connected TCP socket
+        :param object_names: names of the task objects, in the order their states are packed
+        """
+        self.sock = sock
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.object_names = list(object_names)
+        self._header = bytearray(_HEADER.size)
+        self._vectors = np.empty(32, dtype=_VECTOR_DTYPE)
+        self._image = np.empty(0, dtype=np.uint8)
+
+    def send(self, data, image: Optional[np.ndarray] = None) -> None:
+        """
+        Sends the message, object_state, robot_pose, action, done and success fields of data.
+        :param data: Data or RobotStateMessage to send
+        :param image: optional image sent along with the message
+        """
+        if data.message not in MESSAGES:
+            raise ValueError(f"Unknown message {data.message}")
+        flags = (_DONE if data.done else 0) | (_SUCCESS if data.success else 0)
+        object_state = data.object_state
+        if isinstance(object_state, dict):
+            flags |= _OBJECT_STATE_IS_DICT
+            object_state = np.concatenate([np.ravel(object_state[name]) for name in self.object_names])
+        vectors = [np.ascontiguousarray(vector, dtype=_VECTOR_DTYPE).ravel()
+                   for vector in (object_state, data.robot_pose, data.action)]
+
+        image_dtype, image_shape, buffers = 0, (0, 0, 0), []
+        if image is not None:
+            image = np.ascontiguousarray(image)
+            if image.dtype not in _IMAGE_DTYPES or not 1 <= image.ndim <= 3:
+                raise ValueError(f"Unsupported image with dtype {image.dtype} and shape {image.shape}")
+            image_dtype = _IMAGE_DTYPES.index(image.dtype)
+            image_shape = image.shape + (0,) * (3 - image.ndim)
+            buffers = [memoryview(image).cast("B")]
+
+        header = _HEADER.pack(_MAGIC, _VERSION, MESSAGES.index(data.message), flags, image_dtype,
+                              0 if image is None else image.ndim, *[len(vector) for vector in vectors], *image_shape)
+        with span("channel.send"):
+            self._send_all([header] + [memoryview(vector).cast("B") for vector in vectors] + buffers)
+
+    def receive(self) -> RobotStateMessage:
+        """
+        Receives the next message. The image of the message is received into a buffer that is
+        reused by the next call, so it has to be copied if it is kept around.
+        :return: RobotStateMessage
+        """
+        # Most of the time of a receive is spent waiting for the other robot to send its message
+        with span("channel.receive"):
+            self._receive_into(memoryview(self._header))
+        magic, version, message, flags, image_dtype, image_ndim, *lengths = _HEADER.unpack(self._header)
+        image_shape = tuple(lengths[3:3 + image_ndim])
+        lengths = lengths[:3]
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"Unexpected header {magic}, version {version}")
+        if message >= len(MESSAGES) or image_dtype >= len(_IMAGE_DTYPES):
+            raise ValueError(f"Unexpected message {message} or image dtype {image_dtype}")
+
+        num_values = sum(lengths)
+        if num_values > len(self._vectors):
+            self._vectors = np.empty(num_values, dtype=_VECTOR_DTYPE)
+        self._receive_into(memoryview(self._vectors[:num_values]).cast("B"))
+        # The vectors are tiny, copies keep them valid after the next receive
+        object_state, robot_pose, action = np.split(self._vectors[:num_values].copy(), np.cumsum(lengths[:2]))
+        if flags & _OBJECT_STATE_IS_DICT:
+            object_state = dict(zip(self.object_names, np.split(object_state, len(self.object_names))))
+
+        image = None
+        if image_dtype:
+            dtype = _IMAGE_DTYPES[image_dtype]
+            num_bytes = int(np.prod(image_shape)) * dtype.itemsize
+            if num_bytes > self._image.nbytes:
+                self._image = np.empty(num_bytes, dtype=np.uint8)
+            self._receive_into(memoryview(self._image[:num_bytes]))
+            image = self._image[:num_bytes].view(dtype).reshape(image_shape)
+
+        return RobotStateMessage(MESSAGES[message], object_state, robot_pose, action,
+                                 done=bool(flags & _DONE), success=bool(flags & _SUCCESS), image=image)
+
+    def _send_all(self, buffers: list) -> None:
+        """
+        Sends all the buffers, resuming after partial sends.
+        """
+        buffers = [memoryview(buffer) for buffer in buffers if len(buffer)]
+        while buffers:
+            sent = self.sock.sendmsg(buffers)
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            if buffers:
+                buffers[0] = buffers[0][sent:]
+
+    def _receive_into(self, buffer: memoryview) -> None:
+        """
+        Fills the buffer from the socket.
+        :throws EOFError: if the connection is closed first
+        """
+        pos = 0
+        while pos < len(buffer):
+            received = self.sock.recv_into(buffer[pos:])
+            if received == 0:
+                raise EOFError
+            pos += received
@@ -1,4 +1,4 @@
-from input_filenames_msg.msg import InputFilesRealDataMulti, InputFilesRealData
+from input_filenames_msg.msg import InputFilesRealDataMulti, InputFilesRealData, InputFilesRealDataMultiBinary, InputFilesRealDataBinary
 from mirage.infra.ros_inpaint_publisher import ROSInpaintPublisher
 import numpy as np
 from typing import List
@@ -26,27 +26,40 @@ class ROSInpaintPublisherReal(ROSInpaintPublisher):
     to a node that performs inpainting on a target robot.
     """
 
-    def __init__(self, use_diffusion: bool = False):
+    def __init__(self, use_diffusion: bool = False, use_binary_payload: bool = True):
         """
         Initializes the ROS2 node.
+        :param use_diffusion: whether the inpainted images are passed through diffusion
+        :param use_binary_payload: send depth as a 32FC1 sensor_msgs/Image (InputFilesRealDataMultiBinary)
+                                   instead of the float64[] list of InputFilesRealDataMulti
         """
         super().__init__(use_diffusion=use_diffusion)
 
-        self._publisher = self.node.create_publisher(
-            InputFilesRealDataMulti, 'input_files_data_real', 1)
+        self._use_binary_payload = use_binary_payload
+        if self._use_binary_payload:
+            self._publisher = self.node.create_publisher(
+                InputFilesRealDataMultiBinary, 'input_files_data_real_binary', 1)
+        else:
+            self._publisher = self.node.create_publisher(
+                InputFilesRealDataMulti, 'input_files_data_real', 1)
 
     def publish_to_ros_node(self, data: List[ROSInpaintRealData]):
         """
         Publishes the RGB image, segmentation mask, and joint angles to the ROS2 node.
         :param data: The ROS Inpainting data to be published.
         """
-        msg = InputFilesRealDataMulti()
+        msg = InputFilesRealDataMultiBinary() if self._use_binary_payload else InputFilesRealDataMulti()
 
         out_msg_data = []
         for inpaint_data in data:
-            current_data_msg = InputFilesRealData()
+            if self._use_binary_payload:
+                current_data_msg = InputFilesRealDataBinary()
+                current_data_msg.depth_map = self._cv_bridge.cv2_to_imgmsg(
+                    inpaint_data.depth_map.astype(np.float32), encoding="32FC1")
+            else:
+                current_data_msg = InputFilesRealData()
+                current_data_msg.depth_map = inpaint_data.depth_map.flatten().tolist()
             current_data_msg.rgb = self._cv_bridge.cv2_to_imgmsg(inpaint_data.rgb)
-            current_data_msg.depth_map = inpaint_data.depth_map.flatten().tolist()
 
             joints_out = inpaint_data.joints
             if type(joints_out) == np.ndarray:
@@ -1,4 +1,4 @@
-from input_filenames_msg.msg import InputFilesSimData
+from input_filenames_msg.msg import InputFilesSimData, InputFilesSimDataBinary
 from mirage.infra.ros_inpaint_publisher import ROSInpaintPublisher
 from mirage.gripper_interpolation.robosuite.gripper_interpolator import GripperInterpolator
 import numpy as np
@@ -30,16 +30,23 @@ class ROSInpaintPublisherSim(ROSInpaintPublisher):
     to a node that performs inpainting on a target robot.
     """
 
-    def __init__(self):
+    def __init__(self, use_binary_payload: bool = True):
         """
         Initializes the ROS2 node.
         :param source_robot_info: the information about the source robot to determine which interpolation scheme to use
         :param target_robot_info: the information about the target robot to determine which interpolation scheme to use
+        :param use_binary_payload: send depth and segmentation as sensor_msgs/Image buffers (InputFilesSimDataBinary)
+                                   instead of the float64[] / uint8[] lists of InputFilesSimData
         """
         super().__init__(uses_single_img=True)
 
-        self._publisher = self.node.create_publisher(
-            InputFilesSimData, '/input_files_data_sim', 1)
+        self._use_binary_payload = use_binary_payload
+        if self._use_binary_payload:
+            self._publisher = self.node.create_publisher(
+                InputFilesSimDataBinary, '/input_files_data_sim_binary', 1)
+        else:
+            self._publisher = self.node.create_publisher(
+                InputFilesSimData, '/input_files_data_sim', 1)
 
         # TODO(kdharmarajandev): generalize this
         self.gripper_interpolator = GripperInterpolator('Panda', 'Panda')
@@ -49,13 +56,22 @@ class ROSInpaintPublisherSim(ROSInpaintPublisher):
         Publishes the RGB image, segmentation mask, and joint angles to the ROS2 node.
         :param data: The ROS Inpainting data to be published.
         """
-        msg = InputFilesSimData()
-        msg.rgb = self._cv_bridge.cv2_to_imgmsg(data.rgb)
-        msg.depth_map = data.depth_map.flatten().tolist()
         segmentation_mask = data.segmentation
         if segmentation_mask.max() <= 1:
             segmentation_mask = (segmentation_mask * 255).astype(np.uint8)
-        msg.segmentation = segmentation_mask.flatten().tolist()
+        if self._use_binary_payload:
+            msg = InputFilesSimDataBinary()
+            msg.rgb = self._cv_bridge.cv2_to_imgmsg(data.rgb)
+            msg.depth_map = self._cv_bridge.cv2_to_imgmsg(data.depth_map.astype(np.float32), encoding="32FC1")
+            if segmentation_mask.ndim == 3:
+                # The mask is replicated over the color channels, one channel is enough
+                segmentation_mask = np.ascontiguousarray(segmentation_mask[:, :, 0])
+            msg.segmentation = self._cv_bridge.cv2_to_imgmsg(segmentation_mask.astype(np.uint8), encoding="mono8")
+        else:
+            msg = InputFilesSimData()
+            msg.rgb = self._cv_bridge.cv2_to_imgmsg(data.rgb)
+            msg.depth_map = data.depth_map.flatten().tolist()
+            msg.segmentation = segmentation_mask.flatten().tolist()
         msg.ee_pose = data.ee_pose.flatten().tolist()
         msg.interpolated_gripper = self.gripper_interpolator.interpolate_gripper(data.gripper_angles).flatten().tolist()
         # msg.camera_name = data.camera_name
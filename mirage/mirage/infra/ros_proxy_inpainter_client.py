@@ -1,46 +1,129 @@
+from collections import deque
+from concurrent.futures import Future
 from typing import Any
+import itertools
 import numpy as np
 import pickle
 import socket
 import struct
+import threading
 from mirage.infra.xembody_publisher import XEmbodyPublisher
 
+# Every request and response is framed as (request id, payload size) followed by the pickled payload
+FRAME_HEADER = struct.Struct("!II")
+
 class ROSProxyInpainterClient(XEmbodyPublisher):
     """
-    Proxy process that sends to another process which performs the ROS communication
+    Proxy process that sends to another process which performs the ROS communication.
+
+    Requests are tagged with an ID and can be pipelined: submit() returns a Future right away and
+    up to max_in_flight requests can be outstanding, so the next frames (e.g. the other cameras or
+    the next timestep) are sent while the server is still inpainting. Responses are matched to
+    their Future by ID on a background thread.
     """
 
-    def __init__(self, ip: str = "localhost", port: int = 31025) -> None:
+    def __init__(self, ip: str = "localhost", port: int = 31025, max_in_flight: int = 2) -> None:
         """
         Initializes the publisher code.
+        :param ip: IP of the ROSProxyInpaintServer
+        :param port: port of the ROSProxyInpaintServer
+        :param max_in_flight: maximum number of requests awaiting a response, submit blocks beyond it
         """
         super().__init__()
+        if max_in_flight < 1:
+            raise ValueError("At least one request has to be allowed in flight")
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self._socket.connect((ip, port))
 
+        self._request_ids = itertools.count()
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        # Futures of publish_to_ros_node, consumed in order by get_inpainted_image
+        self._published = deque()
+
+        self._receive_thread = threading.Thread(target=self._receive_responses, daemon=True)
+        self._receive_thread.start()
+
+    def submit(self, data: Any) -> Future:
+        """
+        Sends a request to be inpainted without waiting for the response.
+        :param data: The data to be published in dictionary form.
+        :return: Future resolving to the inpainted images of this request.
+        """
+        self._in_flight.acquire()
+        future = Future()
+        request_id = next(self._request_ids) & 0xFFFFFFFF
+        with self._pending_lock:
+            self._pending[request_id] = future
+
+        serialized_data = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            with self._send_lock:
+                self._socket.sendall(FRAME_HEADER.pack(request_id, len(serialized_data)))
+                self._socket.sendall(serialized_data)
+        except OSError as e:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            self._in_flight.release()
+            future.set_exception(e)
+        return future
+
     def publish_to_ros_node(self, data: Any) -> None:
         """
         Publishes the RGB image, segmentation mask, and joint angles to the ROS2 node.
         :param data: The data to be published in dictionary form.
         """
-        serialized_data = pickle.dumps(data)
-        num_bytes = len(serialized_data)
-        byte_count = struct.pack("!I", num_bytes)
-        print(f"Sending {num_bytes} bytes")
-        self._socket.send(byte_count)
-        self._socket.send(serialized_data)
-    
+        self._published.append(self.submit(data))
+
+    def close(self) -> None:
+        """
+        Closes the connection, failing the requests that are still in flight.
+        """
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        self._receive_thread.join()
+
+    def _receive_responses(self) -> None:
+        """
+        Resolves the Future of every response received from the server.
+        """
+        try:
+            while True:
+                request_id, num_bytes = FRAME_HEADER.unpack(self._receive_all_bytes(FRAME_HEADER.size))
+                data = pickle.loads(self._receive_all_bytes(num_bytes))
+                with self._pending_lock:
+                    future = self._pending.pop(request_id, None)
+                if future is None:
+                    print(f"Dropping response to unknown request {request_id}")
+                    continue
+                self._in_flight.release()
+                future.set_result(data)
+                with self._blocking_cond_variable:
+                    self._blocking_cond_variable.notify_all()
+        except (EOFError, OSError) as e:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                self._in_flight.release()
+                future.set_exception(EOFError(f"Connection to the inpainting server closed: {e}"))
+            with self._blocking_cond_variable:
+                self._blocking_cond_variable.notify_all()
+
     def _get_inpainted_image_impl(self) -> np.array:
         """
         The implementation of getting an inpainted image.
-        :return: The inpainted image.
+        :return: The inpainted image of the oldest published request, None if it is not ready.
         """
-        received_bytes = self._receive_all_bytes(4)
-        num_bytes = struct.unpack("!I", received_bytes)[0]
-        received_data = self._receive_all_bytes(num_bytes)
-        data = pickle.loads(received_data)
-        return data
-    
+        if not self._is_item_available():
+            return None
+        return self._published.popleft().result()
+
     def _receive_all_bytes(self, num_bytes: int) -> bytes:
         """
         Receives all the bytes.
@@ -52,13 +135,13 @@ class ROSProxyInpainterClient(XEmbodyPublisher):
         while pos < num_bytes:
             cr = self._socket.recv_into(memoryview(data)[pos:])
             if cr == 0:
-                continue
+                raise EOFError()
             pos += cr
         return data
-    
+
     def _is_item_available(self) -> bool:
         """
         Whether an item is available.
         :return: Whether an item is available.
         """
-        return True
\ No newline at end of file
+        return len(self._published) > 0 and self._published[0].done()
@@ -1,14 +1,18 @@
 from typing import Any
-import numpy as np
+import asyncio
 import pickle
 import socket
-import struct
-import threading
 from mirage.infra.ros_inpaint_publisher_real import ROSInpaintRealData, ROSInpaintPublisherReal
+from mirage.infra.ros_proxy_inpainter_client import FRAME_HEADER
 
 class ROSProxyInpaintServer:
     """
-    Proxy process that sends to another process which performs the ROS communication
+    Proxy process that sends to another process which performs the ROS communication.
+
+    Connections are served by asyncio: every connection keeps reading requests while earlier ones
+    are being inpainted, and all requests are multiplexed in arrival order onto the single ROS
+    publisher, which can only have one request in flight since inpainted images carry no ID.
+    Responses are sent back with the ID of their request.
     """
 
     def __init__(self, ip: str = "169.254.91.160", port: int = 31028) -> None:
@@ -16,68 +20,84 @@ class ROSProxyInpaintServer:
         Initializes the publisher code.
         """
         super().__init__()
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.bind((ip, port))
-        self._socket.listen(1)
+        self._ip = ip
+        self._port = port
         self.ros_inpaint_publisher_real = ROSInpaintPublisherReal()
-    
+
     def listen_for_connections(self) -> None:
-        while True:
-            conn, address = self._socket.accept()
-            threading.Thread(target=self.handle_inpainting_info, args=(conn,)).start()
+        asyncio.run(self.serve())
 
-    def handle_inpainting_info(self, socket) -> None:
+    async def serve(self) -> None:
         """
-        Handles the inpainting info.
-        :param inpainting_info: The inpainting info.
+        Accepts connections and inpaints their requests until cancelled.
         """
+        self._requests = asyncio.Queue()
+        server = await asyncio.start_server(self.handle_connection, self._ip, self._port)
         print("Server is up and running!")
-        while True:
-            try:
-                received_bytes = self._receive_all_bytes(4, socket)
-                num_bytes = struct.unpack("!I", received_bytes)[0]
-                received_data = self._receive_all_bytes(num_bytes, socket)
-                data = pickle.loads(received_data)
-                print("Received data from client")
-
-                list_of_ros_inpaint_data = []
-                for dict_info in data:
-                    ros_inpaint_data = ROSInpaintRealData(
-                        rgb=dict_info["rgb"],
-                        depth_map=dict_info["depth_map"],
-                        joints=dict_info["joints"],
-                        camera_name=dict_info["camera_name"]
-                    )
-                    list_of_ros_inpaint_data.append(ros_inpaint_data)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self._inpaint_requests())
 
-                self.ros_inpaint_publisher_real.publish_to_ros_node(list_of_ros_inpaint_data)
-                print("Sending data to ROS")
-
-                inpainted_img = self.ros_inpaint_publisher_real.get_inpainted_image(blocking=True)
-                print("Received inpainted data from ROS, sending back to client")
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Queues the requests of a connection for inpainting.
+        :param reader: stream of the requests
+        :param writer: stream the responses are written to
+        """
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                request_id, num_bytes = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+                data = pickle.loads(await reader.readexactly(num_bytes))
+                print(f"Received request {request_id} from client")
+                await self._requests.put((request_id, data, writer))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
 
-                serialized_data = pickle.dumps(inpainted_img)
-                num_bytes = len(serialized_data)
-                byte_count = struct.pack("!I", num_bytes)
-                socket.send(byte_count)
-                socket.send(serialized_data)
-            except:
-                return
+    async def _inpaint_requests(self) -> None:
+        """
+        Publishes the queued requests to ROS one at a time and sends the inpainted images back.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            request_id, data, writer = await self._requests.get()
+            try:
+                inpainted_img = await loop.run_in_executor(None, self.handle_inpainting_info, data)
+            except Exception as e:
+                print(f"Failed to inpaint request {request_id}: {e}")
+                writer.close()
+                continue
+            if writer.is_closing():
+                continue
+            serialized_data = pickle.dumps(inpainted_img, protocol=pickle.HIGHEST_PROTOCOL)
+            writer.write(FRAME_HEADER.pack(request_id, len(serialized_data)))
+            writer.write(serialized_data)
+            try:
+                await writer.drain()
+            except ConnectionError:
+                writer.close()
 
-    def _receive_all_bytes(self, num_bytes: int, socket) -> bytes:
+    def handle_inpainting_info(self, data: Any) -> Any:
         """
-        Receives all the bytes.
-        :param num_bytes: The number of bytes.
-        :return: The bytes.
+        Handles the inpainting info.
+        :param data: list of dictionaries with the rgb, depth_map, joints and camera_name of every camera
+        :return: The inpainted images.
         """
-        data = bytearray(num_bytes)
-        pos = 0
-        while pos < num_bytes:
-            cr = socket.recv_into(memoryview(data)[pos:])
-            if cr == 0:
-                raise EOFError()
-            pos += cr
-        return data
+        list_of_ros_inpaint_data = []
+        for dict_info in data:
+            ros_inpaint_data = ROSInpaintRealData(
+                rgb=dict_info["rgb"],
+                depth_map=dict_info["depth_map"],
+                joints=dict_info["joints"],
+                camera_name=dict_info["camera_name"]
+            )
+            list_of_ros_inpaint_data.append(ros_inpaint_data)
+
+        self.ros_inpaint_publisher_real.publish_to_ros_node(list_of_ros_inpaint_data)
+        print("Sending data to ROS")
+
+        inpainted_img = self.ros_inpaint_publisher_real.get_inpainted_image(blocking=True)
+        print("Received inpainted data from ROS, sending back to client")
+        return inpainted_img
 
 if __name__ == "__main__":
     ros_proxy_inpaint_server = ROSProxyInpaintServer()
@@ -0,0 +1,250 @@
+import json
+import time
+import numpy as np
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Tuple
+
+_MAGIC = 0x4D49524147455242  # "MIRAGERB"
+_ALIGNMENT = 64
+
+# Indices into the int64 control block at the start of the segment
+_MAGIC_INDEX = 0
+_READY_INDEX = 1
+_NUM_SLOTS_INDEX = 2
+_LAYOUT_NBYTES_INDEX = 3
+_SLOT_NBYTES_INDEX = 4
+_LATEST_SEQ_INDEX = 5
+_HEADER_LENGTH = 8
+
+# Slot sequence number while the writer is filling the slot
+_WRITING = -1
+
+
+def _align(num_bytes: int) -> int:
+    return (num_bytes + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def flatten_arrays(nested: dict, prefix: str = "") -> Dict[str, np.ndarray]:
+    """
+    Flattens a nested dictionary of arrays into "/" separated keys.
+    :param nested: the (possibly nested) dictionary of array-like values
+    :param prefix: prefix prepended to every key
+    :return: flat dictionary of arrays
+    """
+    flat = {}
+    for key, value in nested.items():
+        if isinstance(value, dict):
+            flat.update(flatten_arrays(value, prefix + key + "/"))
+        else:
+            flat[prefix + key] = np.asarray(value)
+    return flat
+
+
+def unflatten_arrays(flat: Dict[str, np.ndarray]) -> dict:
+    """
+    Inverse of flatten_arrays.
+    :param flat: flat dictionary with "/" separated keys
+    :return: nested dictionary of arrays
+    """
+    nested = {}
+    for key, value in flat.items():
+        *parents, leaf = key.split("/")
+        current = nested
+        for parent in parents:
+            current = current.setdefault(parent, {})
+        current[leaf] = value
+    return nested
+
+
+class SharedMemoryRingBuffer:
+    """
+    Single producer ring buffer of fixed-shape numpy arrays in shared memory, used to hand images
+    and low-dim data between the source and target robot processes without going through the
+    filesystem or pickle.
+
+    Every write goes to the next slot and is tagged with an increasing sequence number. Readers
+    copy the newest slot and validate it with the slot's sequence number (seqlock), so a reader
+    never observes a half-written entry. The layout (field names, shapes and dtypes) is stored
+    in the segment so that readers only need its name.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool) -> None:
+        """
+        Use SharedMemoryRingBuffer.create or SharedMemoryRingBuffer.attach instead.
+        :param shm: the shared memory segment
+        :param owner: whether this instance created the segment and unlinks it on close
+        """
+        self._shm = shm
+        self._owner = owner
+        self._header = np.ndarray((_HEADER_LENGTH,), dtype=np.int64, buffer=shm.buf)
+        self.num_slots = int(self._header[_NUM_SLOTS_INDEX])
+        self._slot_seqs = np.ndarray((self.num_slots,), dtype=np.int64, buffer=shm.buf,
+                                     offset=self._header.nbytes)
+        layout_offset = self._header.nbytes + self._slot_seqs.nbytes
+        layout_nbytes = int(self._header[_LAYOUT_NBYTES_INDEX])
+        self.fields = {name: (tuple(shape), np.dtype(dtype)) for name, shape, dtype in
+                       json.loads(bytes(shm.buf[layout_offset:layout_offset + layout_nbytes]).decode())}
+
+        slot_nbytes = int(self._header[_SLOT_NBYTES_INDEX])
+        data_offset = _align(layout_offset + layout_nbytes)
+        self._slots = []
+        for slot in range(self.num_slots):
+            offset = data_offset + slot * slot_nbytes
+            arrays = {}
+            for name, (shape, dtype) in self.fields.items():
+                arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+                offset += _align(arrays[name].nbytes)
+            self._slots.append(arrays)
+
+    @classmethod
+    def create(cls, name: str, fields: Dict[str, Tuple[tuple, np.dtype]], num_slots: int = 2):
+        """
+        Creates the shared memory segment, replacing a stale segment with the same name.
+        :param name: name of the segment, shared by the writer and the readers
+        :param fields: shape and dtype of every array carried by an entry
+        :param num_slots: number of entries that can be in the buffer at the same time
+        :return: SharedMemoryRingBuffer that owns the segment
+        """
+        if num_slots < 1:
+            raise ValueError("The ring buffer needs at least one slot")
+        layout = json.dumps([[field, list(shape), np.dtype(dtype).str] for field, (shape, dtype) in fields.items()]).encode()
+        slot_nbytes = sum(_align(int(np.prod(shape)) * np.dtype(dtype).itemsize) for shape, dtype in fields.values())
+        layout_offset = _HEADER_LENGTH * 8 + num_slots * 8
+        total_nbytes = _align(layout_offset + len(layout)) + num_slots * slot_nbytes
+
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name=name, create=True, size=total_nbytes)
+
+        header = np.ndarray((_HEADER_LENGTH,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[_MAGIC_INDEX] = _MAGIC
+        header[_NUM_SLOTS_INDEX] = num_slots
+        header[_LAYOUT_NBYTES_INDEX] = len(layout)
+        header[_SLOT_NBYTES_INDEX] = slot_nbytes
+        np.ndarray((num_slots,), dtype=np.int64, buffer=shm.buf, offset=header.nbytes)[:] = 0
+        shm.buf[layout_offset:layout_offset + len(layout)] = layout
+        # Readers only trust the layout once the segment is marked ready
+        header[_READY_INDEX] = 1
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def create_for(cls, name: str, arrays: Dict[str, np.ndarray], num_slots: int = 2):
+        """
+        Creates a ring buffer whose layout matches a dictionary of example arrays.
+        :param name: name of the segment
+        :param arrays: example entry
+        :param num_slots: number of entries that can be in the buffer at the same time
+        :return: SharedMemoryRingBuffer that owns the segment
+        """
+        fields = {field: (np.shape(value), np.asarray(value).dtype) for field, value in arrays.items()}
+        return cls.create(name, fields, num_slots=num_slots)
+
+    @classmethod
+    def attach(cls, name: str, timeout: Optional[float] = 60.0):
+        """
+        Attaches to a segment created by another process, waiting for it to be created.
+        :param name: name of the segment
+        :param timeout: seconds to wait for the segment, None waits forever
+        :return: SharedMemoryRingBuffer that does not own the segment
+        :throws TimeoutError: if the segment does not become available in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+                header = np.ndarray((_HEADER_LENGTH,), dtype=np.int64, buffer=shm.buf)
+                ready = header[_MAGIC_INDEX] == _MAGIC and header[_READY_INDEX] == 1
+                del header
+                if ready:
+                    cls._untrack(shm)
+                    return cls(shm, owner=False)
+                shm.close()
+            except FileNotFoundError:
+                pass
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Shared memory ring buffer {name} was not created within {timeout} seconds")
+            time.sleep(0.001)
+
+    @staticmethod
+    def _untrack(shm: shared_memory.SharedMemory) -> None:
+        """
+        Stops the resource tracker of an attaching process from unlinking a segment it does not own.
+        """
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def latest_seq(self) -> int:
+        """
+        Sequence number of the newest entry, 0 if nothing has been written yet.
+        """
+        return int(self._header[_LATEST_SEQ_INDEX])
+
+    def write(self, arrays: Dict[str, np.ndarray]) -> int:
+        """
+        Copies an entry into the next slot and publishes it.
+        :param arrays: one array per field, with the shapes the buffer was created with
+        :return: sequence number of the entry
+        """
+        if arrays.keys() != self.fields.keys():
+            raise ValueError(f"Expected fields {sorted(self.fields)}, got {sorted(arrays)}")
+        seq = self.latest_seq + 1
+        slot = seq % self.num_slots
+        self._slot_seqs[slot] = _WRITING
+        for field, value in arrays.items():
+            self._slots[slot][field][...] = value
+        self._slot_seqs[slot] = seq
+        self._header[_LATEST_SEQ_INDEX] = seq
+        return seq
+
+    def read(self, newer_than: int = 0, timeout: Optional[float] = 60.0) -> Tuple[int, Dict[str, np.ndarray]]:
+        """
+        Copies out the newest entry, waiting for one with a sequence number above newer_than.
+        :param newer_than: sequence number of the last entry the caller has seen
+        :param timeout: seconds to wait for a new entry, None waits forever
+        :return: (sequence number, one array per field)
+        :throws TimeoutError: if no new entry is written in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        wait = 1e-5
+        while True:
+            seq = self.latest_seq
+            if seq > newer_than:
+                slot = seq % self.num_slots
+                if self._slot_seqs[slot] == seq:
+                    arrays = {field: value.copy() for field, value in self._slots[slot].items()}
+                    if self._slot_seqs[slot] == seq:
+                        return seq, arrays
+                # The writer lapped us while copying, retry with the newer entry
+                continue
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"No entry newer than {newer_than} in {self.name} within {timeout} seconds")
+            time.sleep(wait)
+            wait = min(wait * 2, 1e-3)
+
+    def close(self) -> None:
+        """
+        Detaches from the segment, and removes it if this instance created it.
+        """
+        self._slots = []
+        self._header = None
+        self._slot_seqs = None
+        self._shm.close()
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
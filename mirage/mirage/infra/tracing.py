@@ -0,0 +1,223 @@
+import functools
+import json
+import os
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+SUMMARY_PERCENTILES = (50, 90, 99)
+
+
+class _NullSpan:
+    """
+    Span returned while tracing is disabled, entering and exiting it does nothing.
+    """
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("_tracer", "_name", "_category", "_args", "_start")
+
+    def __init__(self, tracer: "Tracer", name: str, category: str, args: Optional[dict]) -> None:
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def __enter__(self) -> "_Span":
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        self._tracer.record(self._name, self._start, time.perf_counter_ns(), self._category, self._args)
+        return False
+
+
+class Tracer:
+    """
+    Records how long the named stages of a process take, as nested spans.
+
+    Spans are context managers. While the tracer is disabled, span returns a shared object whose
+    enter and exit do nothing, so instrumented code only pays for one attribute check. Timestamps come
+    from the monotonic clock, which is shared by the processes of a host, so the Chrome traces of
+    the source and target robot line up when they are loaded together.
+
+    The durations of every stage are kept separately from the events of the Chrome trace, in 8 bytes
+    per span, so the summary covers every span even after the trace reached max_events.
+    """
+
+    def __init__(self, enabled: bool = False, process_name: Optional[str] = None, max_events: int = 1000000) -> None:
+        """
+        :param enabled: if True, spans are recorded from the start
+        :param process_name: name of the process in the Chrome trace
+        :param max_events: number of spans kept in the Chrome trace, later spans are only in the summary
+        """
+        self.enabled = enabled
+        self.process_name = process_name
+        self.num_dropped = 0
+        self._max_events = max_events
+        self._events = []
+        # Durations in nanoseconds by stage
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def enable(self, process_name: Optional[str] = None) -> None:
+        self.enabled = True
+        if process_name is not None:
+            self.process_name = process_name
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def span(self, name: str, category: str = "stage", **args):
+        """
+        Returns a context manager recording the time spent in its block under name.
+        :param name: name of the stage, spans with the same name are summarized together
+        :param category: category of the span in the Chrome trace
+        :param args: values shown with the span in the Chrome trace
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category, args or None)
+
+    def record(self, name: str, start_ns: int, end_ns: int, category: str = "stage", args: Optional[dict] = None) -> None:
+        """
+        Records a span timed by the caller with time.perf_counter_ns.
+        """
+        with self._lock:
+            durations = self._durations.get(name)
+            if durations is None:
+                durations = self._durations[name] = array("q")
+            durations.append(end_ns - start_ns)
+            if len(self._events) >= self._max_events:
+                self.num_dropped += 1
+                return
+            self._events.append((name, category, start_ns, end_ns - start_ns, threading.get_ident(), args))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._events = []
+            self._durations = {}
+            self.num_dropped = 0
+
+    def stage_durations(self) -> Dict[str, np.ndarray]:
+        """
+        :return: durations in milliseconds of the spans of every stage
+        """
+        with self._lock:
+            return {name: np.array(values, dtype=np.float64) / 1e6 for name, values in self._durations.items()}
+
+    def summary(self, percentiles: Tuple[int, ...] = SUMMARY_PERCENTILES) -> List[Dict]:
+        """
+        :param percentiles: percentiles of the durations to report
+        :return: one dictionary per stage with the number of spans, the total time in seconds and
+                 the mean, percentiles and maximum in milliseconds, stages with the largest total first
+        """
+        summaries = []
+        for name, durations in self.stage_durations().items():
+            summary = {
+                "stage": name,
+                "count": len(durations),
+                "total_s": float(durations.sum() / 1e3),
+                "mean_ms": float(durations.mean()),
+            }
+            for percentile, value in zip(percentiles, np.percentile(durations, percentiles)):
+                summary[f"p{percentile}_ms"] = float(value)
+            summary["max_ms"] = float(durations.max())
+            summaries.append(summary)
+        summaries.sort(key=lambda summary: summary["total_s"], reverse=True)
+        return summaries
+
+    def format_summary(self, percentiles: Tuple[int, ...] = SUMMARY_PERCENTILES) -> str:
+        """
+        :return: the summary as a text table
+        """
+        columns = ["stage", "count", "total_s", "mean_ms"] + [f"p{percentile}_ms" for percentile in percentiles] + ["max_ms"]
+        rows = [[summary[column] for column in columns] for summary in self.summary(percentiles)]
+        cells = [columns] + [[row[0], str(row[1])] + [f"{value:.3f}" for value in row[2:]] for row in rows]
+        widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+        lines = ["  ".join(cell.ljust(width) if i == 0 else cell.rjust(width) for i, (cell, width) in enumerate(zip(row, widths))) for row in cells]
+        if self.num_dropped:
+            lines.append(f"{self.num_dropped} spans dropped from the Chrome trace")
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> Dict:
+        """
+        :return: the spans in the Chrome trace event format, loadable in chrome://tracing or Perfetto
+        """
+        pid = os.getpid()
+        events = []
+        if self.process_name is not None:
+            events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": self.process_name}})
+        with self._lock:
+            for name, category, start, duration, tid, args in self._events:
+                event = {"name": name, "cat": category, "ph": "X", "ts": start / 1e3, "dur": duration / 1e3, "pid": pid, "tid": tid}
+                if args:
+                    event["args"] = args
+                events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+    def write_summary(self, path: str) -> None:
+        with open(path, "w") as f:
+            f.write(self.format_summary() + "\n")
+
+    def write(self, save_stats_path: str) -> Tuple[str, str]:
+        """
+        Writes the Chrome trace and the summary next to a stats file.
+        :param save_stats_path: path of the stats file, e.g. results/target.txt
+        :return: paths of the Chrome trace and of the summary
+        """
+        trace_path, summary_path = trace_paths(save_stats_path)
+        self.write_chrome_trace(trace_path)
+        self.write_summary(summary_path)
+        return trace_path, summary_path
+
+
+def trace_paths(save_stats_path: str) -> Tuple[str, str]:
+    """
+    Paths of the Chrome trace and summary written next to a stats file,
+    e.g. results/target.txt -> results/target_trace.json, results/target_trace_summary.txt.
+    """
+    base_path = os.path.splitext(save_stats_path)[0]
+    return base_path + "_trace.json", base_path + "_trace_summary.txt"
+
+
+# Tracer of the process, shared by every instrumented module
+tracer = Tracer()
+
+
+def span(name: str, category: str = "stage", **args):
+    """
+    Returns a span of the tracer of the process, see Tracer.span.
+    """
+    return tracer.span(name, category, **args)
+
+
+def traced(name: str, category: str = "stage"):
+    """
+    Decorator recording every call of a function as a span of the tracer of the process.
+    :param name: name of the stage
+    :param category: category of the span in the Chrome trace
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name, category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
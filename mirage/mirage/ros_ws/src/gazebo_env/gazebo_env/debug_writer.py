@@ -0,0 +1,114 @@
+import os
+import queue
+import threading
+import cv2
+import numpy as np
+
+# Debug image levels, from writing nothing to writing every intermediate mask
+DEBUG_LEVELS = ("off", "final", "all")
+DEFAULT_PARAMETER_NAME = "debug_images"
+
+
+class DebugImageWriter:
+    """
+    Writes the debug images of the inpainting nodes from a background thread.
+
+    Images are only queued if their level is enabled: "final" images are the per frame inpainting
+    results and masks, "all" also includes the intermediate masks that are overwritten every frame.
+    Encoding and disk I/O happen on the background thread, and images are dropped instead of
+    blocking the caller when the queue is full.
+    """
+
+    def __init__(self, level: str = "off", max_queue_size: int = 64):
+        """
+        :param level: one of DEBUG_LEVELS
+        :param max_queue_size: number of images that can wait to be written before new ones are dropped
+        """
+        if level not in DEBUG_LEVELS:
+            raise ValueError(f"Debug image level {level} is not one of {DEBUG_LEVELS}")
+        self.level = level
+        self.num_dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        if self.level != "off":
+            self._thread = threading.Thread(target=self._write_images, daemon=True)
+            self._thread.start()
+
+    @classmethod
+    def from_node(cls, node, parameter_name: str = DEFAULT_PARAMETER_NAME, max_queue_size: int = 64):
+        """
+        Creates the writer from a string ROS parameter of the node, declaring it with "off" as default.
+        :param node: rclpy Node
+        :param parameter_name: name of the parameter holding the level
+        :param max_queue_size: number of images that can wait to be written before new ones are dropped
+        :return: DebugImageWriter
+        """
+        if not node.has_parameter(parameter_name):
+            node.declare_parameter(parameter_name, "off")
+        level = node.get_parameter(parameter_name).get_parameter_value().string_value
+        return cls(level, max_queue_size=max_queue_size)
+
+    def enabled(self, level: str = "all") -> bool:
+        """
+        Whether images of the given level are written.
+        """
+        return DEBUG_LEVELS.index(level) <= DEBUG_LEVELS.index(self.level) and self.level != "off"
+
+    def write(self, filename: str, image, *args, level: str = "all") -> None:
+        """
+        Queues an image to be written with cv2.imwrite, creating its directory if needed.
+        The image can be given as a function and its arguments, in which case the function is only
+        called on the background thread if the level is enabled,
+        e.g. write('depth.png', self.normalize_depth_image, depth).
+        :param filename: path of the image
+        :param image: image, or function returning the image
+        :param args: arguments of the function
+        :param level: "final" or "all"
+        """
+        self._put(filename, image, args, cv2.imwrite, level)
+
+    def save_array(self, filename: str, array, *args, level: str = "all") -> None:
+        """
+        Queues an array to be written with np.savetxt if filename ends with .txt, np.save otherwise,
+        creating its directory if needed. As in write, the array can be given as a function and its arguments.
+        :param filename: path of the array
+        :param array: array, or function returning the array
+        :param args: arguments of the function
+        :param level: "final" or "all"
+        """
+        self._put(filename, array, args, np.savetxt if filename.endswith(".txt") else np.save, level)
+
+    def close(self) -> None:
+        """
+        Writes the queued images and stops the background thread.
+        """
+        if self._thread is not None:
+            self._queue.put((None, None, None, None))
+            self._thread.join()
+            self._thread = None
+
+    def _put(self, filename: str, image, args: tuple, write_function, level: str) -> None:
+        if not self.enabled(level):
+            return
+        # The caller keeps modifying its arrays, so the background thread gets copies
+        image = image.copy() if isinstance(image, np.ndarray) else image
+        args = tuple(arg.copy() if isinstance(arg, np.ndarray) else arg for arg in args)
+        try:
+            self._queue.put_nowait((filename, image, args, write_function))
+        except queue.Full:
+            self.num_dropped += 1
+
+    def _write_images(self) -> None:
+        while True:
+            filename, image, args, write_function = self._queue.get()
+            if filename is None:
+                return
+            try:
+                if callable(image):
+                    image = image(*args)
+                directory = os.path.dirname(filename)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                write_function(filename, image)
+            except Exception as e:
+                print(f"Could not write debug image {filename}: {e}")
@@ -0,0 +1,141 @@
+import time
+from collections import OrderedDict, deque
+from typing import Optional, Tuple
+import numpy as np
+
+# Bounds of the first solve, the defaults of tracikpy, widened tenfold until the maximum bound
+MIN_BOUND_XYZ = 1e-5
+MIN_BOUND_RPY = 1e-3
+
+
+class RetargetingIKSolver:
+    """
+    Solves the inverse kinematics of the target robot for the end effector poses of the source robot.
+
+    Wraps a tracikpy TracIKSolver with:
+    - an LRU cache of solutions keyed on the quantized end effector pose, since demo replays revisit
+      the same poses across robot pairs and seeds,
+    - trajectory aware seeding, where the first solve starts from the joints extrapolated from the
+      last two solutions instead of the last solution,
+    - a bounds schedule that widens the bounds tenfold after every failed solve, and jumps to the
+      maximum bound once the time budget is spent,
+    - counts of cache hits and misses, solves, fallbacks and the time spent solving.
+    """
+
+    def __init__(self, solver, max_bound_xyz: float = 0.01, time_budget: float = 0.05,
+                 position_resolution: float = 1e-4, rotation_resolution: float = 1e-4,
+                 cache_size: int = 4096, log_interval: int = 100):
+        """
+        :param solver: tracikpy TracIKSolver of the target robot
+        :param max_bound_xyz: widest position bound tried before falling back, the rotation bound is 100 times wider
+        :param time_budget: seconds of solving after which the schedule jumps to the maximum bound
+        :param position_resolution: meters per step of the quantized pose used as cache key
+        :param rotation_resolution: step of the rotation matrix entries of the quantized pose
+        :param cache_size: number of cached solutions, 0 disables the cache
+        :param log_interval: number of calls between printed statistics, 0 disables them
+        """
+        if max_bound_xyz < MIN_BOUND_XYZ:
+            raise ValueError(f"Maximum bound {max_bound_xyz} is smaller than the first bound {MIN_BOUND_XYZ}")
+        self.solver = solver
+        self.max_bound_xyz = max_bound_xyz
+        self.time_budget = time_budget
+        self.position_resolution = position_resolution
+        self.rotation_resolution = rotation_resolution
+        self.cache_size = cache_size
+        self.log_interval = log_interval
+        self._cache = OrderedDict()
+        self._history = deque(maxlen=2)
+        self.num_calls = 0
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_solves = 0
+        self.num_fallbacks = 0
+        self.solve_time = 0.0
+
+    def ik(self, ee_pose: np.ndarray, qinit: np.ndarray, retry_qinit: Optional[np.ndarray] = None,
+           fallback: Optional[np.ndarray] = None) -> Tuple[np.ndarray, float]:
+        """
+        Finds the joints reaching an end effector pose.
+        :param ee_pose: 4 x 4 end effector pose
+        :param qinit: joints the solve starts from, usually the previous solution
+        :param retry_qinit: joints the solves with widened bounds start from, defaults to qinit
+        :param fallback: joints returned if no solution is found within the maximum bound, defaults to qinit
+        :return: joints, and the position bound of the solve (the maximum bound for a fallback)
+        """
+        self.num_calls += 1
+        if self.log_interval and self.num_calls % self.log_interval == 0:
+            print(self.summary())
+
+        key = self._cache_key(ee_pose)
+        if key in self._cache:
+            self.num_hits += 1
+            self._cache.move_to_end(key)
+            qout, b_xyz = self._cache[key]
+            self._history.append(qout)
+            return qout.copy(), b_xyz
+        self.num_misses += 1
+
+        start_time = time.perf_counter()
+        qout, b_xyz = self._solve(ee_pose, qinit, qinit if retry_qinit is None else retry_qinit)
+        self.solve_time += time.perf_counter() - start_time
+        if qout is None:
+            print("Couldn't find good IK")
+            self.num_fallbacks += 1
+            self._history.clear()
+            return np.array(qinit if fallback is None else fallback), b_xyz
+
+        if self.cache_size > 0:
+            self._cache[key] = (qout.copy(), b_xyz)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        self._history.append(qout.copy())
+        return qout, b_xyz
+
+    def summary(self) -> str:
+        """
+        :return: one line with the cache and solve statistics
+        """
+        hit_rate = self.num_hits / max(self.num_hits + self.num_misses, 1)
+        mean_solve_time = self.solve_time / max(self.num_misses, 1)
+        return (f"IK: {self.num_calls} calls, {self.num_hits} hits ({100 * hit_rate:.1f}%), "
+                f"{self.num_misses} misses, {self.num_solves} solves, {self.num_fallbacks} fallbacks, "
+                f"{1000 * mean_solve_time:.2f} ms per miss")
+
+    def clear(self) -> None:
+        """
+        Forgets the cached solutions and the trajectory, e.g. when the source robot changes.
+        """
+        self._cache.clear()
+        self._history.clear()
+
+    def _solve(self, ee_pose: np.ndarray, qinit: np.ndarray, retry_qinit: np.ndarray) -> Tuple[Optional[np.ndarray], float]:
+        start_time = time.perf_counter()
+        b_xyz = MIN_BOUND_XYZ
+        b_rpy = MIN_BOUND_RPY
+        seed = self._extrapolated_seed(qinit)
+        while True:
+            self.num_solves += 1
+            qout = self.solver.ik(ee_pose, qinit=seed, bx=b_xyz, by=b_xyz, bz=b_xyz, brx=b_rpy, bry=b_rpy, brz=b_rpy)
+            if qout is not None or b_xyz >= self.max_bound_xyz:
+                return qout, b_xyz
+            seed = retry_qinit
+            if time.perf_counter() - start_time >= self.time_budget:
+                b_rpy *= self.max_bound_xyz / b_xyz
+                b_xyz = self.max_bound_xyz
+            else:
+                b_xyz = min(b_xyz * 10, self.max_bound_xyz)
+                b_rpy *= 10
+
+    def _extrapolated_seed(self, qinit: np.ndarray) -> np.ndarray:
+        """
+        Continues the trajectory of the last two solutions if qinit is the last one, clipped to the joint limits.
+        """
+        if len(self._history) < 2 or not np.allclose(qinit, self._history[-1]):
+            return qinit
+        lower, upper = self.solver.joint_limits
+        return np.clip(2 * self._history[-1] - self._history[-2], lower, upper)
+
+    def _cache_key(self, ee_pose: np.ndarray) -> bytes:
+        position = np.round(ee_pose[:3, 3] / self.position_resolution)
+        rotation = np.round(ee_pose[:3, :3] / self.rotation_resolution)
+        return np.concatenate([position, rotation.ravel()]).astype(np.int64).tobytes()
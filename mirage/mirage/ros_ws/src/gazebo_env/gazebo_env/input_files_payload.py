@@ -0,0 +1,37 @@
+import cv2
+import numpy as np
+from sensor_msgs.msg import Image
+
+
+def depth_map_to_numpy(msg) -> np.ndarray:
+    """
+    Reads the depth map of an InputFiles*Data message. The binary variants carry it as a 32FC1
+    sensor_msgs/Image, returned as a float32 view of the message buffer without a copy, so writes
+    to the array modify the message; the list variants carry it as float64[], which is copied.
+    :param msg: InputFilesSimData(Binary) or InputFilesRealData(Binary) message
+    :return: H x W writable depth map, float32 for the binary variants and float64 for the list variants
+    :throws ValueError: If the depth image is not little endian 32FC1 with unpadded rows.
+    """
+    if isinstance(msg.depth_map, Image):
+        image = msg.depth_map
+        if image.encoding != "32FC1" or image.is_bigendian or image.step != image.width * 4:
+            raise ValueError(f"Depth map should be little endian 32FC1 with {image.width * 4} bytes per row, "
+                             f"got {image.encoding} with big endian {bool(image.is_bigendian)} and {image.step} bytes per row")
+        depth = np.frombuffer(image.data, np.float32).reshape(image.height, image.width)
+        # rclpy delivers the data as a writable array.array, a bytes buffer gives a read only view
+        return depth if depth.flags.writeable else depth.copy()
+    return np.array(msg.depth_map, dtype=np.float64).reshape((msg.rgb.height, msg.rgb.width))
+
+
+def segmentation_to_numpy(msg, cv_bridge) -> np.ndarray:
+    """
+    Reads the segmentation mask of an InputFilesSimData(Binary) message. The binary variant
+    carries it as a mono8 sensor_msgs/Image, the list variant as a 3 channel uint8[].
+    :param msg: InputFilesSimData(Binary) message
+    :param cv_bridge: CvBridge used to view the image buffer
+    :return: H x W uint8 mask
+    """
+    if isinstance(msg.segmentation, Image):
+        return cv_bridge.imgmsg_to_cv2(msg.segmentation)
+    seg_color = np.array(msg.segmentation, dtype=np.uint8).reshape((msg.rgb.height, msg.rgb.width, 3))
+    return cv2.cvtColor(seg_color, cv2.COLOR_BGR2GRAY)
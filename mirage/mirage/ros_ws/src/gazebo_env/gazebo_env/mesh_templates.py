@@ -0,0 +1,146 @@
+import math
+import os
+import numpy as np
+
+DEFAULT_NUM_POINTS = 200000
+
+# Hand-tuned visual origins that override the URDF for the panda links
+PANDA_LINK_XYZ_OVERRIDES = {
+    "panda_link1": [0, 0, -0.1929999099],
+    "panda_link3": [0, 0, -0.1219998142],
+    "panda_link5": [0, 0, -0.2630000007],
+    "panda_link7": [0, 0, 0.03679997502 + (0.028439417985386614 / 2)],
+}
+PANDA_LINK_RPY_OVERRIDES = {
+    "panda_link7": [0, 0, -math.pi / 4],
+}
+
+
+def euler_to_rotation(rpy: np.ndarray) -> np.ndarray:
+    """
+    Converts URDF roll, pitch, yaw angles to a rotation matrix (R = Rz @ Ry @ Rx).
+    :param rpy: roll, pitch, yaw in radians
+    :return: 3 x 3 rotation matrix
+    """
+    rotation_x, rotation_y, rotation_z = rpy
+    Rx = np.array([[1, 0, 0], [0, np.cos(rotation_x), -np.sin(rotation_x)], [0, np.sin(rotation_x), np.cos(rotation_x)]])
+    Ry = np.array([[np.cos(rotation_y), 0, np.sin(rotation_y)], [0, 1, 0], [-np.sin(rotation_y), 0, np.cos(rotation_y)]])
+    Rz = np.array([[np.cos(rotation_z), -np.sin(rotation_z), 0], [np.sin(rotation_z), np.cos(rotation_z), 0], [0, 0, 1]])
+    return Rz @ Ry @ Rx
+
+
+def load_link_mesh(filename: str, link_name: str, rpy_str: str, xyz_str: str):
+    """
+    Loads the visual mesh of a URDF link in millimeters and moves it into the link frame.
+    This is the per-link geometry that setupMesh in the write_data nodes used to redo every frame.
+    :param filename: path to the mesh file
+    :param link_name: name of the URDF link
+    :param rpy_str: rpy attribute of the visual origin
+    :param xyz_str: xyz attribute of the visual origin
+    :return: open3d TriangleMesh in the link frame, in millimeters
+    """
+    import open3d as o3d
+    import trimesh
+
+    mesh_scene = trimesh.load(filename)
+    geometries = dict(mesh_scene.geometry)
+    if link_name == "panda_link6":
+        for name, geometry in geometries.items():
+            if name != 'Shell006_000-mesh':
+                geometries[name] = trimesh.Trimesh(vertices=geometry.vertices + np.array([0, 0, -0.028439417985386614 / 2]),
+                                                   faces=geometry.faces)
+    mesh = trimesh.util.concatenate(tuple(trimesh.Trimesh(vertices=g.vertices, faces=g.faces)
+                                          for g in geometries.values()))
+    open3d_mesh = o3d.geometry.TriangleMesh(o3d.utility.Vector3dVector(mesh.vertices),
+                                            o3d.utility.Vector3iVector(mesh.faces))
+    # Meshes exported in meters are scaled to millimeters, meshes already in millimeters are Y-up
+    extent = np.ptp(np.asarray(mesh.vertices)[np.unique(mesh.faces)], axis=0).max()
+    if extent < 1:
+        open3d_mesh.vertices = o3d.utility.Vector3dVector(np.asarray(open3d_mesh.vertices) * 1000)
+    else:
+        open3d_mesh.rotate(np.array([[-1, 0, 0], [0, 0, 1], [0, 1, 0]]), [0, 0, 0])
+
+    rpy = np.array(PANDA_LINK_RPY_OVERRIDES.get(link_name, [float(x) for x in rpy_str.split()]))
+    xyz = np.array(PANDA_LINK_XYZ_OVERRIDES.get(link_name, [float(x) for x in xyz_str.split()]))
+    transform_matrix = np.eye(4)
+    transform_matrix[:3, :3] = euler_to_rotation(rpy)
+    transform_matrix[:3, 3] = 1000 * xyz
+    open3d_mesh.transform(transform_matrix)
+    return open3d_mesh
+
+
+class LinkPointCloudTemplates:
+    """
+    Point clouds sampled once from the visual meshes of a robot, stored per link in the link
+    frame. Rendering the robot for a new joint configuration is then one rigid transform per
+    link instead of reloading, merging and resampling every mesh.
+
+    Points are in millimeters, like the meshes in setupMesh. The sampling budget is split
+    between links proportionally to their surface area, which matches sampling the fused mesh.
+    """
+
+    def __init__(self, link_names: list, points: np.ndarray, offsets: np.ndarray):
+        """
+        :param link_names: URDF link name of every template, in links_info order
+        :param points: N x 3 float32 link frame points of all templates, concatenated
+        :param offsets: start index of every template in points, plus the total number of points
+        """
+        self.link_names = list(link_names)
+        self.points = np.ascontiguousarray(points, dtype=np.float32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self._output = np.empty_like(self.points)
+
+    @classmethod
+    def from_links_info(cls, links_info: list, num_points: int = DEFAULT_NUM_POINTS, cache_path: str = None):
+        """
+        Samples the templates for the links of a URDF, or loads them from cache_path when the
+        cache was written for the same links, mesh files and number of points.
+        :param links_info: [filename, link_name, rpy_str, xyz_str] for every visual mesh
+        :param num_points: total number of points over all links
+        :param cache_path: optional .npz file used to persist the templates between runs
+        :return: LinkPointCloudTemplates
+        """
+        cache_key = cls._cache_key(links_info, num_points)
+        if cache_path is not None and os.path.exists(cache_path):
+            cached = np.load(cache_path)
+            if str(cached["cache_key"]) == cache_key:
+                return cls(cached["link_names"].tolist(), cached["points"], cached["offsets"])
+
+        meshes = [load_link_mesh(filename, link_name, rpy_str, xyz_str)
+                  for [filename, link_name, rpy_str, xyz_str] in links_info]
+        areas = np.array([mesh.get_surface_area() for mesh in meshes])
+        points_per_link = np.maximum(np.round(num_points * areas / areas.sum()).astype(np.int64), 1)
+        points = [np.asarray(mesh.sample_points_uniformly(number_of_points=int(n)).points)
+                  for mesh, n in zip(meshes, points_per_link)]
+        offsets = np.concatenate([[0], np.cumsum(points_per_link)])
+        templates = cls([link_info[1] for link_info in links_info], np.concatenate(points), offsets)
+
+        if cache_path is not None:
+            np.savez(cache_path, cache_key=cache_key, link_names=np.array(templates.link_names),
+                     points=templates.points, offsets=templates.offsets)
+        return templates
+
+    @staticmethod
+    def _cache_key(links_info: list, num_points: int) -> str:
+        """
+        Describes everything the sampled templates depend on, including mesh modification times.
+        """
+        entries = [str(num_points)]
+        for [filename, link_name, rpy_str, xyz_str] in links_info:
+            mtime = os.path.getmtime(filename) if os.path.exists(filename) else 0
+            entries.append("|".join([filename, str(mtime), link_name, str(rpy_str), str(xyz_str)]))
+        return "\n".join(entries)
+
+    def transform_points(self, link_transforms: dict) -> np.ndarray:
+        """
+        Moves every template to its pose and returns the merged robot point cloud.
+        The returned array is reused by the next call.
+        :param link_transforms: 4 x 4 transform from each link frame to the output frame, keyed by link name
+        :return: N x 3 float32 points in the output frame
+        """
+        for i, link_name in enumerate(self.link_names):
+            transform = np.asarray(link_transforms[link_name], dtype=np.float32)
+            start, end = self.offsets[i], self.offsets[i + 1]
+            np.matmul(self.points[start:end], transform[:3, :3].T, out=self._output[start:end])
+            self._output[start:end] += transform[:3, 3]
+        return self._output
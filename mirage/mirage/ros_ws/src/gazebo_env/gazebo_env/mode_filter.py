@@ -0,0 +1,53 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Number of masked pixels whose neighborhoods are compared at once, bounds the memory of a chunk
+CHUNK_SIZE = 1 << 15
+
+
+def color_keys(image: np.ndarray):
+    """
+    Maps every color of an H x W x 3 image to an integer key that sorts like the color does
+    lexicographically (the order np.unique(..., axis=0) uses).
+    :param image: H x W x 3 image
+    :return: H x W int64 keys, and a function mapping keys back to N x 3 colors
+    """
+    if image.dtype == np.uint8:
+        channels = image.astype(np.int64)
+        keys = (channels[..., 0] << 16) | (channels[..., 1] << 8) | channels[..., 2]
+        def keys_to_colors(selected_keys):
+            return np.stack([selected_keys >> 16, (selected_keys >> 8) & 0xFF, selected_keys & 0xFF], axis=-1).astype(np.uint8)
+        return keys, keys_to_colors
+    colors, inverse = np.unique(image.reshape(-1, 3), axis=0, return_inverse=True)
+    keys = inverse.reshape(image.shape[:2]).astype(np.int64)
+    return keys, lambda selected_keys: colors[selected_keys]
+
+
+def masked_mode_filter(image: np.ndarray, mask: np.ndarray, kernel_size: int) -> np.ndarray:
+    """
+    Replaces every masked pixel by the most common color of its kernel_size x kernel_size neighborhood.
+    Matches the per-pixel np.unique loop of custom_mode_filter in the write_data nodes: unmasked
+    pixels and pixels within kernel_size // 2 of the border are 0, and ties go to the smallest color.
+    :param image: H x W x 3 image
+    :param mask: H x W mask, nonzero where the mode is computed
+    :param kernel_size: odd size of the neighborhood
+    :return: filtered image
+    """
+    result = np.zeros_like(image)
+    pad = kernel_size // 2
+    height, width = image.shape[:2]
+    if height <= 2 * pad or width <= 2 * pad:
+        return result
+
+    keys, keys_to_colors = color_keys(image)
+    windows = sliding_window_view(keys, (kernel_size, kernel_size))
+    rows, cols = np.nonzero(mask[pad:height - pad, pad:width - pad])
+    for start in range(0, len(rows), CHUNK_SIZE):
+        chunk_rows, chunk_cols = rows[start:start + CHUNK_SIZE], cols[start:start + CHUNK_SIZE]
+        neighborhoods = windows[chunk_rows, chunk_cols].reshape(len(chunk_rows), -1)
+        counts = (neighborhoods[:, :, None] == neighborhoods[:, None, :]).sum(axis=2)
+        # Highest count first, then the smallest key, like argmax over the sorted np.unique output
+        scores = (counts.astype(np.int64) << 32) - neighborhoods
+        modes = neighborhoods[np.arange(len(chunk_rows)), np.argmax(scores, axis=1)]
+        result[chunk_rows + pad, chunk_cols + pad] = keys_to_colors(modes)
+    return result
@@ -0,0 +1,231 @@
+import numpy as np
+
+REPROJECTION_MODES = ("mean", "min", "nearest")
+
+
+def project_to_pixels(points: np.ndarray, intrinsic_matrix: np.ndarray, image_shape) -> tuple:
+    """
+    Projects camera frame points onto the image plane of a pinhole camera.
+    Pixels that fall outside of the image are clipped to the border, which matches
+    project_points_from_world_to_camera in the write_data nodes.
+    :param points: N x 3 points in the camera frame
+    :param intrinsic_matrix: 3 x 3 (or 3 x 4 with a zero last column) intrinsic matrix
+    :param image_shape: (height, width) of the image
+    :return: (rows, cols) integer pixel indices of shape N
+    """
+    height, width = image_shape[0], image_shape[1]
+    intrinsic_matrix = np.asarray(intrinsic_matrix)[:3, :3]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pixels = points @ intrinsic_matrix.T
+        pixels = pixels[:, :2] / pixels[:, 2:3]
+    pixels = np.nan_to_num(pixels, nan=0.0, posinf=0.0, neginf=0.0).round().astype(np.int64)
+    rows = pixels[:, 1].clip(0, height - 1)
+    cols = pixels[:, 0].clip(0, width - 1)
+    return rows, cols
+
+
+def linear_pixel_indices(rows: np.ndarray, cols: np.ndarray, width: int) -> np.ndarray:
+    """
+    Flattens (row, col) pixel indices into indices of a raveled image.
+    :param rows: row indices
+    :param cols: column indices
+    :param width: width of the image
+    :return: linear pixel indices
+    """
+    return rows * width + cols
+
+
+def nearest_point_per_pixel(linear_indices: np.ndarray, depths: np.ndarray) -> np.ndarray:
+    """
+    Z-buffer selection: for every pixel that is hit, finds the point closest to the camera.
+    :param linear_indices: linear pixel index of every point
+    :param depths: depth of every point
+    :return: indices into the point arrays of the nearest point of each hit pixel
+    """
+    order = np.lexsort((depths, linear_indices))
+    sorted_indices = linear_indices[order]
+    first_in_pixel = np.ones(len(order), dtype=bool)
+    first_in_pixel[1:] = sorted_indices[1:] != sorted_indices[:-1]
+    return order[first_in_pixel]
+
+
+def reproject_points(points: np.ndarray,
+                     colors: np.ndarray,
+                     intrinsic_matrix: np.ndarray,
+                     image_shape,
+                     mode: str = "mean") -> tuple:
+    """
+    Renders a colored point cloud into a new camera in one batched scatter pass.
+
+    Modes:
+        mean: color and depth are averaged over all points landing on a pixel
+        min: color is averaged, depth is the minimum over the points landing on a pixel
+        nearest: color and depth are taken from the point closest to the camera (z-buffer)
+
+    :param points: N x 3 points in the frame of the target camera
+    :param colors: N x C colors associated with each point
+    :param intrinsic_matrix: intrinsic matrix of the target camera
+    :param image_shape: (height, width) of the target image
+    :param mode: one of REPROJECTION_MODES
+    :return: (rgb, depth, mask) where rgb is H x W x C float64, depth is H x W float64 and
+             mask is H x W uint8 with 255 for pixels that received at least one point.
+             Pixels without points are 0 in all outputs.
+    """
+    if mode not in REPROJECTION_MODES:
+        raise ValueError(f"Unknown reprojection mode {mode}, expected one of {REPROJECTION_MODES}")
+
+    height, width = image_shape[0], image_shape[1]
+    num_pixels = height * width
+    points = np.asarray(points)
+    colors = np.asarray(colors).reshape(len(points), -1)
+    num_channels = colors.shape[1]
+
+    finite = np.isfinite(points).all(axis=1)
+    if not finite.all():
+        points = points[finite]
+        colors = colors[finite]
+
+    rows, cols = project_to_pixels(points, intrinsic_matrix, (height, width))
+    linear_indices = linear_pixel_indices(rows, cols, width)
+    depths = points[:, 2]
+
+    rgb = np.zeros((num_pixels, num_channels), dtype=np.float64)
+    depth = np.zeros(num_pixels, dtype=np.float64)
+    counts = np.bincount(linear_indices, minlength=num_pixels)
+    hit = counts > 0
+
+    if mode == "nearest":
+        nearest = nearest_point_per_pixel(linear_indices, depths)
+        rgb[linear_indices[nearest]] = colors[nearest]
+        depth[linear_indices[nearest]] = depths[nearest]
+    else:
+        for channel in range(num_channels):
+            channel_sum = np.bincount(linear_indices, weights=colors[:, channel], minlength=num_pixels)
+            rgb[hit, channel] = channel_sum[hit] / counts[hit]
+        if mode == "mean":
+            depth_sum = np.bincount(linear_indices, weights=depths, minlength=num_pixels)
+            depth[hit] = depth_sum[hit] / counts[hit]
+        else:
+            min_depth = np.full(num_pixels, np.inf)
+            np.minimum.at(min_depth, linear_indices, depths)
+            depth[hit] = min_depth[hit]
+
+    mask = np.where(hit, 255, 0).astype(np.uint8)
+    return rgb.reshape(height, width, num_channels), depth.reshape(height, width), mask.reshape(height, width)
+
+
+def rasterize_depth(points: np.ndarray, intrinsic_matrix: np.ndarray, image_shape) -> tuple:
+    """
+    Renders the silhouette and depth of a point cloud in one batched pass.
+    Every pixel gets the depth of the point closest to the camera (z-buffer), so the result does
+    not depend on the order of the points.
+    :param points: N x 3 points in the camera frame
+    :param intrinsic_matrix: intrinsic matrix of the camera
+    :param image_shape: (height, width) of the image
+    :return: (mask, depth) where mask is H x W uint8 with 255 for pixels that received at least one
+             point and depth is H x W float64, 0 for pixels without points
+    """
+    height, width = image_shape[0], image_shape[1]
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    points = points[np.isfinite(points).all(axis=1)]
+
+    rows, cols = project_to_pixels(points, intrinsic_matrix, (height, width))
+    linear_indices = linear_pixel_indices(rows, cols, width)
+
+    depth = np.full(height * width, np.inf)
+    np.minimum.at(depth, linear_indices, points[:, 2])
+    hit = depth != np.inf
+    depth[~hit] = 0
+    mask = np.where(hit, 255, 0).astype(np.uint8)
+    return mask.reshape(height, width), depth.reshape(height, width)
+
+
+class DepthReprojector:
+    """
+    Warps an RGBD image into a second camera with the same intrinsics that is related to the
+    source camera by a rigid transform. Every source pixel carries its own index through the
+    transform, so colors are gathered directly instead of being looked up by point, and
+    collisions are resolved with a z-buffer (nearest point wins).
+
+    Output buffers are allocated once per image shape and reused between calls, so the arrays
+    returned by reproject are overwritten by the next call on the same instance. Use one
+    instance per stream of results that has to stay alive at the same time.
+    """
+
+    def __init__(self, intrinsic_matrix: np.ndarray, dtype=np.float64):
+        """
+        :param intrinsic_matrix: 3 x 3 intrinsic matrix shared by the source and target camera
+        :param dtype: floating point type used for the geometry (np.float32 halves memory traffic)
+        """
+        self._intrinsic_matrix = np.asarray(intrinsic_matrix, dtype=np.float64)[:3, :3]
+        self._dtype = np.dtype(dtype)
+        self._image_shape = None
+
+    def _allocate(self, image_shape) -> None:
+        """
+        Precomputes the normalized ray grid and allocates the output buffers for an image shape.
+        :param image_shape: (height, width) of the images
+        """
+        height, width = image_shape
+        fx = self._intrinsic_matrix[0, 0]
+        fy = self._intrinsic_matrix[1, 1]
+        cx = self._intrinsic_matrix[0, 2]
+        cy = self._intrinsic_matrix[1, 2]
+        u, v = np.meshgrid(np.arange(width), np.arange(height))
+        self._ray_x = ((u.reshape(-1) - cx) / fx).astype(self._dtype)
+        self._ray_y = ((v.reshape(-1) - cy) / fy).astype(self._dtype)
+        self._z_buffer = np.empty(height * width, dtype=self._dtype)
+        self._rgb = np.zeros((height, width, 3), dtype=np.uint8)
+        self._depth = np.zeros((height, width), dtype=self._dtype)
+        self._mask = np.zeros((height, width), dtype=np.uint8)
+        self._image_shape = (height, width)
+
+    def reproject(self, rgb: np.ndarray, depth: np.ndarray, transform: np.ndarray) -> tuple:
+        """
+        Reprojects an RGBD image with a rigid transform.
+        :param rgb: H x W x 3 uint8 image
+        :param depth: H x W depth image in the source camera frame
+        :param transform: 4 x 4 transform applied to the source camera points
+        :return: (rgb, depth, mask) of the reprojected image; mask is 255 where a point landed
+        """
+        image_shape = depth.shape[:2]
+        if self._image_shape != image_shape:
+            self._allocate(image_shape)
+        height, width = image_shape
+
+        z = np.asarray(depth, dtype=self._dtype).reshape(-1)
+        transform = np.asarray(transform, dtype=self._dtype)
+        rotation = transform[:3, :3]
+        translation = transform[:3, 3]
+        x = self._ray_x * z
+        y = self._ray_y * z
+        new_x = rotation[0, 0] * x + rotation[0, 1] * y + rotation[0, 2] * z + translation[0]
+        new_y = rotation[1, 0] * x + rotation[1, 1] * y + rotation[1, 2] * z + translation[1]
+        new_z = rotation[2, 0] * x + rotation[2, 1] * y + rotation[2, 2] * z + translation[2]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            u = np.round(self._intrinsic_matrix[0, 0] * new_x / new_z + self._intrinsic_matrix[0, 2])
+            v = np.round(self._intrinsic_matrix[1, 1] * new_y / new_z + self._intrinsic_matrix[1, 2])
+            valid = (new_z > 0) & (u >= 0) & (u < width) & (v >= 0) & (v < height)
+
+        source_indices = np.flatnonzero(valid)
+        target_indices = v[source_indices].astype(np.int64) * width + u[source_indices].astype(np.int64)
+        target_depths = new_z[source_indices]
+
+        # Gather colors before touching the output buffers in case rgb aliases them
+        source_colors = np.asarray(rgb).reshape(-1, 3)[source_indices]
+
+        self._z_buffer.fill(np.inf)
+        np.minimum.at(self._z_buffer, target_indices, target_depths)
+        nearest = target_depths <= self._z_buffer[target_indices]
+
+        rgb_out = self._rgb.reshape(-1, 3)
+        depth_out = self._depth.reshape(-1)
+        mask_out = self._mask.reshape(-1)
+        rgb_out.fill(0)
+        depth_out.fill(0)
+        mask_out.fill(0)
+        rgb_out[target_indices[nearest]] = source_colors[nearest]
+        depth_out[target_indices[nearest]] = target_depths[nearest]
+        mask_out[target_indices] = 255
+        return self._rgb, self._depth, self._mask
@@ -0,0 +1,30 @@
+# Tracing of the nodes with the tracer of the mirage package, see mirage.infra.tracing.
+# The nodes also run without the mirage package, e.g. with ros2 run outside its conda environment:
+# tracing is then unavailable, span and traced do nothing and tracer is None.
+try:
+    from mirage.infra.tracing import span, traced, tracer
+    TRACING_AVAILABLE = True
+except ImportError:
+    TRACING_AVAILABLE = False
+    tracer = None
+
+
+    class _NullSpan:
+        def __enter__(self) -> "_NullSpan":
+            return self
+
+        def __exit__(self, *exc_info) -> bool:
+            return False
+
+
+    _NULL_SPAN = _NullSpan()
+
+
+    def span(name: str, category: str = "stage", **args):
+        return _NULL_SPAN
+
+
+    def traced(name: str, category: str = "stage"):
+        def decorator(function):
+            return function
+        return decorator
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+import numpy as np
+from gazebo_env.mode_filter import masked_mode_filter
+
+SIZES = {"84x84": (84,84), "256x256": (256,256), "720p": (720,1280)}
+
+def loop_mode_filter(image,mask,kernel_size):
+    """
+    The per-pixel np.unique loop of custom_mode_filter that the write_data nodes used before masked_mode_filter.
+    """
+    result = np.zeros_like(image)
+    pad = kernel_size // 2
+    for i in range(pad, image.shape[0] - pad):
+        for j in range(pad, image.shape[1] - pad):
+            if mask[i, j]:
+                neighborhood = image[i - pad: i + pad + 1, j - pad: j + pad + 1]
+                unique, counts = np.unique(neighborhood.reshape(-1, 3), axis=0, return_counts=True)
+                mode_color = unique[np.argmax(counts)]
+                result[i, j] = mode_color
+    return result
+
+def time_filter(filter_fn,image,mask,num_frames):
+    start_time = time.perf_counter()
+    for _ in range(num_frames):
+        result = filter_fn(image,mask,3)
+    return (time.perf_counter() - start_time) / num_frames,result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the masked mode filter of replace_black_with_surrounding_mode")
+    parser.add_argument("--num_frames", type=int, default=5)
+    parser.add_argument("--skip_loop_720p", action="store_true", help="Skip the slow loop baseline at 720p")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for name,(height,width) in SIZES.items():
+        # Few colors, like a rendered robot, with a thresholded mask as in replace_black_with_surrounding_mode
+        palette = rng.integers(0,256,(8,3),dtype=np.uint8)
+        image = palette[rng.integers(0,len(palette),(height,width))]
+        mask = (rng.random((height,width)) < 0.5).astype(np.uint8) * 255
+        vectorized_time,vectorized_result = time_filter(masked_mode_filter,image,mask,args.num_frames)
+        if name == "720p" and args.skip_loop_720p:
+            print("%-8s masked_mode_filter %.4f s" % (name,vectorized_time))
+            continue
+        loop_time,loop_result = time_filter(loop_mode_filter,image,mask,1)
+        print("%-8s loop %.4f s, masked_mode_filter %.4f s, speedup %.0fx, identical: %s" % (
+            name,loop_time,vectorized_time,loop_time / vectorized_time,np.array_equal(loop_result,vectorized_result)))
+
+if __name__ == '__main__':
+    main()
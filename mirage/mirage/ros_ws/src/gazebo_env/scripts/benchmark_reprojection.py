@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+import numpy as np
+from gazebo_env.reprojection import DepthReprojector, project_to_pixels, rasterize_depth
+
+# Intrinsics and extrinsics used by the *_reproject write_data nodes
+INTRINSIC_MATRIX = np.array([[524.22595215,   0.        , 639.77819824],
+                             [  0.        , 524.22595215, 370.27804565],
+                             [0,0,1]])
+REPROJECT_TF = np.array([[0.987,-0.136,0.083,-0.05],
+                         [0.124,0.983,0.136,-0.05],
+                         [-0.01,-0.124,0.987,0],
+                         [0,0,0,1]])
+
+def dict_reproject(rgb_np,depth_np,reproject_tf):
+    """
+    The tuple-keyed dictionary reprojection that the write_data nodes used before DepthReprojector.
+    """
+    height,width = depth_np.shape
+    fx = INTRINSIC_MATRIX[0][0]
+    fy = INTRINSIC_MATRIX[1][1]
+    cx = INTRINSIC_MATRIX[0][2]
+    cy = INTRINSIC_MATRIX[1][2]
+    u = np.tile(np.arange(width), (height, 1))
+    v = np.tile(np.arange(height),(width,1)).T
+    z = depth_np
+    x = (u - cx) * z / fx
+    y = (v - cy) * z / fy
+    keys = np.stack([x,y,z],axis=-1).reshape(-1,3)
+    data_dict = dict(zip(map(tuple,keys),map(tuple,rgb_np.reshape(-1,3))))
+    points = np.array([x.reshape(-1),y.reshape(-1),z.reshape(-1)]).T
+    homogenous_points = np.column_stack((points, np.ones(len(points))))
+    transformed_points = np.dot(reproject_tf, homogenous_points.T).T[:, :3]
+    point_dict = dict(zip(map(tuple,transformed_points),map(tuple,homogenous_points)))
+    new_image_mask = np.zeros((height,width)).astype(np.uint8)
+    new_image = np.zeros((height,width,3)).astype(np.uint8)
+    new_depth = np.zeros((height,width)).astype(np.float64)
+    u_coords = np.round((fx * transformed_points[:, 0] / transformed_points[:, 2]) + cx).astype(int)
+    v_coords = np.round((fy * transformed_points[:, 1] / transformed_points[:, 2]) + cy).astype(int)
+    valid_coords_mask = (0 <= u_coords) & (u_coords < width) & (0 <= v_coords) & (v_coords < height)
+    point_keys = tuple(map(tuple, transformed_points[valid_coords_mask].tolist()))
+    data_values = np.array([data_dict[point_dict[key][:3]] for key in point_keys], dtype=np.uint8)
+    new_image_mask[v_coords[valid_coords_mask], u_coords[valid_coords_mask]] = 255
+    new_image[v_coords[valid_coords_mask], u_coords[valid_coords_mask]] = data_values
+    new_depth[v_coords[valid_coords_mask], u_coords[valid_coords_mask]] = transformed_points[:,2][valid_coords_mask]
+    return new_image,new_depth,new_image_mask
+
+def loop_rasterize(points,image_shape):
+    """
+    The per-point loop of fullPointcloudCallback before rasterize_depth, where the last point on a pixel wins.
+    """
+    rows,cols = project_to_pixels(points,INTRINSIC_MATRIX,image_shape)
+    mask_image = np.zeros(image_shape, dtype=np.uint8)
+    depth_image = np.zeros(image_shape, dtype=np.float64)
+    for i,(x,y) in enumerate(zip(rows,cols)):
+        mask_image[round(x), round(y)] = 255
+        depth_image[round(x), round(y)] = points[i,2]
+    return mask_image,depth_image
+
+def time_frames(reproject_fn,rgb,depth,num_frames):
+    # Forward and inverse pass per frame, like noTimeGazeboCallback
+    start_time = time.perf_counter()
+    for _ in range(num_frames):
+        _,forward_depth,_ = reproject_fn(rgb,depth,REPROJECT_TF)
+        reproject_fn(rgb,forward_depth,np.linalg.inv(REPROJECT_TF))
+    return num_frames / (time.perf_counter() - start_time)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark depth reprojection at 720p")
+    parser.add_argument("--num_frames", type=int, default=20)
+    parser.add_argument("--skip_dict", action="store_true", help="Skip the slow dictionary baseline")
+    parser.add_argument("--num_points", type=int, default=200000, help="Size of the point cloud rasterized by fullPointcloudCallback")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    rgb = rng.integers(0,256,(720,1280,3),dtype=np.uint8)
+    depth = rng.uniform(0.5,2.0,(720,1280))
+
+    if not args.skip_dict:
+        print("dict (float64):             %.3f frames/sec" % time_frames(dict_reproject,rgb,depth,1))
+    for dtype in [np.float64,np.float32]:
+        forward_reprojector = DepthReprojector(INTRINSIC_MATRIX,dtype=dtype)
+        inverse_reprojector = DepthReprojector(INTRINSIC_MATRIX,dtype=dtype)
+        def reproject_fn(rgb,depth,transform):
+            reprojector = forward_reprojector if transform is REPROJECT_TF else inverse_reprojector
+            return reprojector.reproject(rgb,depth,transform)
+        print("DepthReprojector (%s): %.3f frames/sec" % (np.dtype(dtype).name,time_frames(reproject_fn,rgb,depth,args.num_frames)))
+
+    points = np.column_stack([rng.uniform(-0.5,0.5,(args.num_points,2)),rng.uniform(0.5,2.0,args.num_points)])
+    start_time = time.perf_counter()
+    loop_mask,loop_depth = loop_rasterize(points,depth.shape)
+    loop_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    for _ in range(args.num_frames):
+        mask,nearest_depth = rasterize_depth(points,INTRINSIC_MATRIX,depth.shape)
+    rasterize_time = (time.perf_counter() - start_time) / args.num_frames
+    print("rasterize %d points: loop %.3f s, rasterize_depth %.4f s, same mask: %s, nearest depth <= loop depth: %s" % (
+        args.num_points,loop_time,rasterize_time,np.array_equal(loop_mask,mask),bool(np.all(nearest_depth <= loop_depth))))
+
+if __name__ == '__main__':
+    main()
@@ -15,14 +15,21 @@ import xml.etree.ElementTree as ET
 from functools import partial
 import math
 from message_filters import TimeSynchronizer, Subscriber
-from tf2_ros import TransformException
 from tf2_ros.buffer import Buffer
 from tf2_ros.transform_listener import TransformListener
 from sensor_msgs_py import point_cloud2
+from concurrent.futures import ThreadPoolExecutor
+from gazebo_env.reprojection import project_to_pixels, rasterize_depth, reproject_points
+from gazebo_env.ik_retargeting import RetargetingIKSolver
+from gazebo_env.mode_filter import masked_mode_filter
+from gazebo_env.debug_writer import DebugImageWriter
+from gazebo_env.multi_camera import run_per_camera
+from gazebo_env.mesh_templates import LinkPointCloudTemplates
+from gazebo_env.input_files_payload import depth_map_to_numpy
 import cv2
 from cv_bridge import CvBridge
 import time
-from input_filenames_msg.msg import InputFilesRobosuite, InputFilesRobosuiteData, InputFilesRealData, InputFilesRealDataMulti, MultipleInpaintImages
+from input_filenames_msg.msg import InputFilesRobosuite, InputFilesRobosuiteData, InputFilesRealData, InputFilesRealDataMulti, MultipleInpaintImages, InputFilesRealDataMultiBinary
 from sensor_msgs.msg import JointState
 from tracikpy import TracIKSolver
 from mdh.kinematic_chain import KinematicChain
@@ -43,6 +50,7 @@ class WriteData(Node):
         file_directory = pathlib.Path(__file__).parent.resolve()
         self.panda_panda_gripper_urdf_ = os.path.join(file_directory,'../../../../src/gazebo_env/description/urdf/panda_gripper_ik_real.urdf')        
         self.panda_panda_gripper_solver_ = TracIKSolver(self.panda_panda_gripper_urdf_,"panda_link0","panda_ee")
+        self.panda_panda_gripper_ik_ = RetargetingIKSolver(self.panda_panda_gripper_solver_,max_bound_xyz=0.01)
         self.panda_ur5_gripper_urdf_ = os.path.join(file_directory,'../../../../src/gazebo_env/description/urdf/panda_ur5_gripper_ik_real.urdf')
         # self.chain_ = kp.build_chain_from_urdf(open(self.panda_panda_gripper_urdf_).read())
         self.panda_ur5_gripper_solver_ = TracIKSolver(self.panda_ur5_gripper_urdf_,"panda_with_ur5_gripper_link0","ur5_ee_gripper")
@@ -82,6 +90,11 @@ class WriteData(Node):
             'input_files_data_real',
             self.listenerCallbackOnlineDebug,
             1)
+        self.subscription_data_binary_ = self.create_subscription(
+            InputFilesRealDataMultiBinary,
+            'input_files_data_real_binary',
+            self.listenerCallbackOnlineDebug,
+            1)
         self.joint_state_msg = JointState()
 
         #Harcoding start position
@@ -221,11 +234,16 @@ class WriteData(Node):
             1
         )
         self.cv_bridge_ = CvBridge()
+        self.debug_writer_ = DebugImageWriter.from_node(self)
+        self.camera_executor_ = ThreadPoolExecutor(max_workers=2)
         self.mask_image_publisher_ = self.create_publisher(Image,"mask_image",1)
         self.ready_for_next_input_publisher_ = self.create_publisher(Bool,"/ready_for_next_input",1)
         timer_period = 0.5
         self.links_info_ = []
         self.original_meshes_ = []
+        # Robot point cloud templates are sampled once and cached in the working directory
+        self.link_templates_ = None
+        self.link_templates_cache_path_ = os.path.splitext(os.path.basename(__file__))[0] + "_link_templates.npz"
         self.full_publisher_ = self.create_publisher(PointCloud2,"full_pointcloud",1)
         self.inpainted_publisher_ = self.create_publisher(MultipleInpaintImages,"inpainted_image",1)
         #self.full_subscriber_ = self.create_subscription(PointCloud2,'full_pointcloud',self.fullPointcloudCallback,10)
@@ -271,8 +289,9 @@ class WriteData(Node):
 
     def noTimeGazeboCallback(self,joint_msg):
         start_time = time.time()
-        left_inpainted_image,left_mask = self.doFullInpainting(self.ur5_left_rgb_,self.ur5_left_depth_,self.panda_left_rgb_,self.panda_left_depth_,self.panda_left_no_gripper_depth_,self.left_real_rgb_,self.left_real_depth_)
-        right_inpainted_image,right_mask = self.doFullInpainting(self.ur5_right_rgb_,self.ur5_right_depth_,self.panda_right_rgb_,self.panda_right_depth_,self.panda_right_no_gripper_depth_,self.right_real_rgb_,self.right_real_depth_)
+        (left_inpainted_image,left_mask),(right_inpainted_image,right_mask) = run_per_camera(self.camera_executor_,[
+            partial(self.doFullInpainting,self.ur5_left_rgb_,self.ur5_left_depth_,self.panda_left_rgb_,self.panda_left_depth_,self.panda_left_no_gripper_depth_,self.left_real_rgb_,self.left_real_depth_),
+            partial(self.doFullInpainting,self.ur5_right_rgb_,self.ur5_right_depth_,self.panda_right_rgb_,self.panda_right_depth_,self.panda_right_no_gripper_depth_,self.right_real_rgb_,self.right_real_depth_)])
         inpainted_image_msg = MultipleInpaintImages()
         mask_image_msg = MultipleInpaintImages()
         inpainted_image_msg.images = [self.cv_bridge_.cv2_to_imgmsg(left_inpainted_image),self.cv_bridge_.cv2_to_imgmsg(right_inpainted_image),self.cv_bridge_.cv2_to_imgmsg(left_mask),self.cv_bridge_.cv2_to_imgmsg(right_mask)]
@@ -280,23 +299,15 @@ class WriteData(Node):
         self.inpainted_publisher_.publish(inpainted_image_msg)
         self.full_mask_image_publisher_.publish(mask_image_msg)
         inpaint_number = str(self.i_).zfill(5)
-        if not os.path.exists('left_inpainting'):
-            os.makedirs('left_inpainting')
-        if not os.path.exists('right_inpainting'):
-            os.makedirs('right_inpainting')
-        if not os.path.exists('left_mask'):
-            os.makedirs('left_mask')
-        if not os.path.exists('right_mask'):
-            os.makedirs('right_mask')
         if(self.float_image_):
             left_inpainted_image = (left_inpainted_image * 255).astype(np.uint8)
             right_inpainted_image = (right_inpainted_image * 255).astype(np.uint8)
             left_mask = (left_mask * 255).astype(np.uint8)
             right_mask = (right_mask * 255).astype(np.uint8)
-        cv2.imwrite('left_inpainting/inpaint'+ str(inpaint_number) +'.png',left_inpainted_image)
-        cv2.imwrite('right_inpainting/inpaint'+ str(inpaint_number) +'.png',right_inpainted_image)
-        cv2.imwrite('left_mask/mask'+ str(inpaint_number) +'.png',left_mask)
-        cv2.imwrite('right_mask/mask'+ str(inpaint_number) +'.png',right_mask)
+        self.debug_writer_.write('left_inpainting/inpaint'+ str(inpaint_number) +'.png',left_inpainted_image,level="final")
+        self.debug_writer_.write('right_inpainting/inpaint'+ str(inpaint_number) +'.png',right_inpainted_image,level="final")
+        self.debug_writer_.write('left_mask/mask'+ str(inpaint_number) +'.png',left_mask,level="final")
+        self.debug_writer_.write('right_mask/mask'+ str(inpaint_number) +'.png',right_mask,level="final")
 
     def doFullInpainting(self,real_rgb,real_depth,gazebo_rgb,gazebo_depth,gazebo_no_gripper_depth,world_rgb,world_depth):
         real_rgb_np = self.cv_bridge_.imgmsg_to_cv2(real_rgb)
@@ -304,18 +315,18 @@ class WriteData(Node):
         gazebo_rgb_np = self.cv_bridge_.imgmsg_to_cv2(gazebo_rgb)
         
         gazebo_depth_np = self.cv_bridge_.imgmsg_to_cv2(gazebo_depth)
-        cv2.imwrite('real_rgb.png',real_rgb_np)
-        cv2.imwrite('real_depth.png',self.normalize_depth_image(real_depth_np))
-        cv2.imwrite('gazebo_rgb.png',gazebo_rgb_np)
-        cv2.imwrite('gazebo_depth.png',self.normalize_depth_image(gazebo_depth_np))
+        self.debug_writer_.write('real_rgb.png',real_rgb_np)
+        self.debug_writer_.write('real_depth.png',self.normalize_depth_image,real_depth_np)
+        self.debug_writer_.write('gazebo_rgb.png',gazebo_rgb_np)
+        self.debug_writer_.write('gazebo_depth.png',self.normalize_depth_image,gazebo_depth_np)
         gazebo_no_gripper_depth_np = self.cv_bridge_.imgmsg_to_cv2(gazebo_no_gripper_depth)
         
         real_seg_np = (real_depth_np < 8).astype(np.uint8)
         real_seg_255_np = 255 * real_seg_np
         gazebo_seg_np = (gazebo_depth_np < 8).astype(np.uint8)
         gazebo_seg_255_np = 255 * gazebo_seg_np
-        cv2.imwrite('real_seg.png',real_seg_255_np)
-        cv2.imwrite('gazebo_seg.png',gazebo_seg_255_np)
+        self.debug_writer_.write('real_seg.png',real_seg_255_np)
+        self.debug_writer_.write('gazebo_seg.png',gazebo_seg_255_np)
         real_no_gripper_seg_255_np = (gazebo_no_gripper_depth_np < 8).astype(np.uint8)
         real_no_gripper_seg_255_np = 255 * real_no_gripper_seg_255_np
         real_rgb = world_rgb
@@ -335,44 +346,44 @@ class WriteData(Node):
         _, gazebo_seg = cv2.threshold(gazebo_seg, 128, 255, cv2.THRESH_BINARY)
         _, seg_file = cv2.threshold(seg_file, 128, 255, cv2.THRESH_BINARY)
         _, seg_file_no_gripper = cv2.threshold(seg_file_no_gripper, 128, 255, cv2.THRESH_BINARY)
-        cv2.imwrite('seg_file.png',seg_file)
-        cv2.imwrite('seg_file_no_gripper.png',seg_file_no_gripper)
+        self.debug_writer_.write('seg_file.png',seg_file)
+        self.debug_writer_.write('seg_file_no_gripper.png',seg_file_no_gripper)
         seg_file_gripper = abs(seg_file - seg_file_no_gripper)
         seg_file_gripper = cv2.erode(seg_file_gripper,np.ones((3,3),np.uint8),iterations=3)
         seg_file_gripper = cv2.dilate(seg_file_gripper,np.ones((3,3),np.uint8),iterations=15)
-        cv2.imwrite('seg_file_gripper.png',seg_file_gripper)
+        self.debug_writer_.write('seg_file_gripper.png',seg_file_gripper)
         gazebo_segmentation_mask_255 = gazebo_seg
         inverted_segmentation_mask_255_original = cv2.bitwise_not(seg_file_no_gripper)
-        cv2.imwrite('inverted_mask1.png',inverted_segmentation_mask_255_original)
+        self.debug_writer_.write('inverted_mask1.png',inverted_segmentation_mask_255_original)
         inverted_segmentation_mask_255 = cv2.erode(inverted_segmentation_mask_255_original,np.ones((3,3),np.uint8),iterations=30)
-        cv2.imwrite('inverted_mask2.png',inverted_segmentation_mask_255)
+        self.debug_writer_.write('inverted_mask2.png',inverted_segmentation_mask_255)
         eroded_segmentation_mask_255 = cv2.bitwise_not(inverted_segmentation_mask_255)
-        cv2.imwrite('eroded_mask1.png',eroded_segmentation_mask_255)
+        self.debug_writer_.write('eroded_mask1.png',eroded_segmentation_mask_255)
         eroded_segmentation_mask_255 = eroded_segmentation_mask_255 + seg_file_gripper
-        cv2.imwrite('eroded_mask2.png',eroded_segmentation_mask_255)
+        self.debug_writer_.write('eroded_mask2.png',eroded_segmentation_mask_255)
         inverted_segmentation_mask_255 = cv2.bitwise_not(eroded_segmentation_mask_255)
-        cv2.imwrite('final_mask.png',inverted_segmentation_mask_255)
+        self.debug_writer_.write('final_mask.png',inverted_segmentation_mask_255)
         gazebo_only = cv2.bitwise_and(gazebo_rgb,gazebo_rgb,mask=gazebo_segmentation_mask_255)
         # gazebo_only = cv2.cvtColor(gazebo_only,cv2.COLOR_BGR2RGB)
         #gazebo_robot_only_lab = cv2.cvtColor(gazebo_only,cv2.COLOR_BGR2LAB)
         #gazebo_robot_only_lab[:,:,0] += 10
         #gazebo_robot_only_lab[:,:,0] = np.where(gazebo_segmentation_mask_255 > 0, gazebo_robot_only_lab[:,:,0] + 150, gazebo_robot_only_lab[:,:,0])
         #gazebo_only = cv2.cvtColor(gazebo_robot_only_lab,cv2.COLOR_LAB2BGR)
-        cv2.imwrite('gazebo_robot_only.png',gazebo_only)
-        cv2.imwrite('background_only_pre1.png',rgb)
-        cv2.imwrite('background_only_pre2.png',inverted_segmentation_mask_255)
+        self.debug_writer_.write('gazebo_robot_only.png',gazebo_only)
+        self.debug_writer_.write('background_only_pre1.png',rgb)
+        self.debug_writer_.write('background_only_pre2.png',inverted_segmentation_mask_255)
         _, inverted_segmentation_mask_255 = cv2.threshold(inverted_segmentation_mask_255, 128, 255, cv2.THRESH_BINARY)
-        cv2.imwrite('background_only_pre2.png',inverted_segmentation_mask_255)
+        self.debug_writer_.write('background_only_pre2.png',inverted_segmentation_mask_255)
         background_only = cv2.bitwise_and(rgb,rgb,mask=inverted_segmentation_mask_255)
-        cv2.imwrite('background_only_pre3.png',background_only)
+        self.debug_writer_.write('background_only_pre3.png',background_only)
         background_only = cv2.inpaint(background_only,cv2.bitwise_not(inverted_segmentation_mask_255),3,cv2.INPAINT_TELEA)
-        cv2.imwrite('background_only2.png',background_only)
+        self.debug_writer_.write('background_only2.png',background_only)
         inverted_seg_file_original = cv2.bitwise_not(seg_file)
         inverted_seg_file = cv2.erode(inverted_seg_file_original,np.ones((3,3),np.uint8),iterations=3)
         background_only = cv2.bitwise_and(background_only,background_only,mask=cv2.bitwise_not(gazebo_segmentation_mask_255))
-        cv2.imwrite('background_only3.png',background_only)
+        self.debug_writer_.write('background_only3.png',background_only)
         inpainted_image = gazebo_only + background_only
-        cv2.imwrite('background_only4.png',inpainted_image)
+        self.debug_writer_.write('background_only4.png',inpainted_image)
         better_dilated_blend_mask = cv2.bitwise_not(inverted_seg_file)*cv2.bitwise_not(gazebo_seg)*255
         diffusion_input = cv2.bitwise_and(inpainted_image,inpainted_image,mask=cv2.bitwise_not(better_dilated_blend_mask))
         if(self.float_image_):
@@ -491,12 +502,8 @@ class WriteData(Node):
     
     def getPixels(self,msg):
         if(self.is_ready_):
-            msg_data = point_cloud2.read_points(msg)
-            msg_data = np.array([[item.tolist() for item in row] for row in msg_data])
-            depth_data = msg_data[:,2]
-            camera_transform = np.vstack((self.camera_intrinsic_matrix_,np.array([0,0,0,1]).reshape(1,4)))
-            pixel_data = self.project_points_from_world_to_camera(msg_data,camera_transform,self.image_shape_[1],self.image_shape_[0])
-            return pixel_data, depth_data
+            points = point_cloud2.read_points_numpy(msg,field_names=("x","y","z"))
+            return rasterize_depth(points,self.camera_intrinsic_matrix_,self.image_shape_[:2])
         
     def project_points_from_world_to_camera(self,points, world_to_camera_transform, camera_height, camera_width,pixel_to_point_dicts=False):
         """
@@ -610,9 +617,9 @@ class WriteData(Node):
         _, gazebo_seg = cv2.threshold(gazebo_seg, 128, 255, cv2.THRESH_BINARY)
         gazebo_segmentation_mask_255 = gazebo_seg
         inverted_segmentation_mask_255_original = cv2.bitwise_not(gazebo_seg)
-        cv2.imwrite('inverted_mask1.png',inverted_segmentation_mask_255_original)
+        self.debug_writer_.write('inverted_mask1.png',inverted_segmentation_mask_255_original)
         inverted_segmentation_mask_255 = cv2.erode(inverted_segmentation_mask_255_original,np.ones((3,3),np.uint8),iterations=10)
-        cv2.imwrite('inverted_mask2.png',inverted_segmentation_mask_255)
+        self.debug_writer_.write('inverted_mask2.png',inverted_segmentation_mask_255)
         outline_mask = abs(inverted_segmentation_mask_255 - inverted_segmentation_mask_255_original)*255
         gazebo_only = cv2.bitwise_and(gazebo_rgb,gazebo_rgb,mask=gazebo_segmentation_mask_255)
         # gazebo_only = cv2.cvtColor(gazebo_only,cv2.COLOR_BGR2RGB)
@@ -620,20 +627,20 @@ class WriteData(Node):
         #gazebo_robot_only_lab[:,:,0] += 10
         #gazebo_robot_only_lab[:,:,0] = np.where(gazebo_segmentation_mask_255 > 0, gazebo_robot_only_lab[:,:,0] + 150, gazebo_robot_only_lab[:,:,0])
         #gazebo_only = cv2.cvtColor(gazebo_robot_only_lab,cv2.COLOR_LAB2BGR)
-        cv2.imwrite('gazebo_robot_only.png',gazebo_only)
+        self.debug_writer_.write('gazebo_robot_only.png',gazebo_only)
         background_only = cv2.bitwise_and(rgb,rgb,mask=inverted_segmentation_mask_255_original)
         inverted_seg_file_original = cv2.bitwise_not(seg_file)
         #cv2.imwrite('inverted_seg_file_original.png',inverted_seg_file_original)
         inverted_seg_file = cv2.erode(inverted_seg_file_original,np.ones((3,3),np.uint8),iterations=3)
         #cv2.imwrite('inverted_seg_file.png',inverted_seg_file)
         background_only = cv2.bitwise_and(background_only,background_only,mask=inverted_seg_file)
-        cv2.imwrite('background_only.png',background_only)
+        self.debug_writer_.write('background_only.png',background_only)
         inpainted_image = gazebo_only + background_only
         #cv2.imwrite('no_fill.png',inpainted_image)
 
         better_dilated_blend_mask = cv2.bitwise_not(inverted_seg_file)*cv2.bitwise_not(gazebo_seg)*255
-        cv2.imwrite('better_dilated_blend_mask.png',better_dilated_blend_mask)
-        cv2.imwrite('pre_inpainted_image.png',inpainted_image)
+        self.debug_writer_.write('better_dilated_blend_mask.png',better_dilated_blend_mask)
+        self.debug_writer_.write('pre_inpainted_image.png',inpainted_image)
         cv2_inpaint_image = cv2.inpaint(inpainted_image,better_dilated_blend_mask,3,cv2.INPAINT_TELEA)
 
         target_color = (39,43,44)
@@ -641,16 +648,12 @@ class WriteData(Node):
         target_mask[:,:] = target_color
         inpainted_image = np.where(better_dilated_blend_mask[:,:,None] != 0,target_mask,inpainted_image).astype(np.uint8)
         inpainted_image = cv2_inpaint_image
-        cv2.imwrite('og_inpainted_image.png',inpainted_image)
+        self.debug_writer_.write('og_inpainted_image.png',inpainted_image)
         import pdb
         pdb.set_trace()
         inpaint_number = str(self.i_).zfill(5)
-        if not os.path.exists('inpainting'):
-            os.makedirs('inpainting')
-        if not os.path.exists('mask'):
-            os.makedirs('mask')
-        cv2.imwrite('inpainting/inpaint'+ str(inpaint_number) +'.png',inpainted_image)
-        cv2.imwrite('mask/mask'+ str(inpaint_number) +'.png',better_dilated_blend_mask.astype(np.uint8))
+        self.debug_writer_.write('inpainting/inpaint'+ str(inpaint_number) +'.png',inpainted_image,level="final")
+        self.debug_writer_.write('mask/mask'+ str(inpaint_number) +'.png',better_dilated_blend_mask.astype(np.uint8),level="final")
         if(self.float_image_):
             inpainted_image = (inpainted_image / 255.0).astype(np.float32)
         inpainted_image_msg = self.cv_bridge_.cv2_to_imgmsg(inpainted_image)
@@ -776,17 +779,7 @@ class WriteData(Node):
         self.inpainted_publisher_.publish(inpainted_image_msg)
 
     def custom_mode_filter(self,image, mask, kernel_size):
-        result = np.zeros_like(image)
-        pad = kernel_size // 2
-        for i in range(pad, image.shape[0] - pad):
-            for j in range(pad, image.shape[1] - pad):
-                if mask[i, j]:
-                    neighborhood = image[i - pad: i + pad + 1, j - pad: j + pad + 1]
-                    unique, counts = np.unique(neighborhood.reshape(-1, 3), axis=0, return_counts=True)
-                    mode_color = unique[np.argmax(counts)]
-                    result[i, j] = mode_color
-
-        return result
+        return masked_mode_filter(image, mask, kernel_size)
 
     def replace_black_with_surrounding_mode(self,img):
 
@@ -804,35 +797,12 @@ class WriteData(Node):
 
         return replaced_img
 
-    def transformGazeboImage(self,gazebo_rgb,gazebo_seg,pointcloud_msg):
-        pointcloud = point_cloud2.read_points(pointcloud_msg)
+    def transformGazeboImage(self,gazebo_rgb,gazebo_seg,pointcloud_msg,mode="mean"):
         # Pointcloud is in camera frame
-        pointcloud = np.array([[item.tolist() for item in row] for row in pointcloud])
-        
-        gazebo_camera_transform = np.vstack((self.camera_intrinsic_matrix_,np.array([0,0,0,1]).reshape(1,4)))
-        _,points_to_pixels_gazebo,pixels_to_points_gazebo = self.project_points_from_world_to_camera(pointcloud,gazebo_camera_transform,self.image_shape_[0],self.image_shape_[1],True)
-        robosuite_camera_transform = np.hstack((self.robosuite_intrinsic_matrix_,np.array([0,0,0]).reshape(3,1)))
-        robosuite_camera_transform = np.vstack((robosuite_camera_transform,np.array([0,0,0,1]).reshape(1,4)))
-        robosuite_img_points,points_to_pixels_robosuite,pixels_to_points_robosuite = self.project_points_from_world_to_camera(pointcloud,robosuite_camera_transform,self.robosuite_image_shape_[0],self.robosuite_image_shape_[1],True)
-        transformed_gazebo_rgb_noisy = np.zeros((self.robosuite_image_shape_[0],self.robosuite_image_shape_[1],3))
-        transformed_gazebo_seg = np.zeros((self.robosuite_image_shape_[0],self.robosuite_image_shape_[1]))
-        gazebo_depth = np.zeros((self.robosuite_image_shape_[0],self.robosuite_image_shape_[1])) * 1000
-        for pixel in pixels_to_points_robosuite.keys():
-            points = pixels_to_points_robosuite[pixel]
-            points_np = np.array([list(point) for point in points])
-            depth_value = np.mean(points_np[:,2])
-            gazebo_pixels = []
-            for point in points: 
-                gazebo_pixels.append(list(points_to_pixels_gazebo[point]))
-            rgb_values = []
-            for gazebo_pixel in gazebo_pixels:
-                rgb_values.append(gazebo_rgb[gazebo_pixel[0],gazebo_pixel[1],:])
-            
-            rgb_values_np = np.array(rgb_values)
-            mean_rgb_value = np.mean(rgb_values_np,axis=0).astype(int)
-            transformed_gazebo_rgb_noisy[pixel[0],pixel[1],:] = mean_rgb_value
-            gazebo_depth[pixel[0],pixel[1]] = depth_value
-            transformed_gazebo_seg[pixel[0],pixel[1]] = 255
+        pointcloud = point_cloud2.read_points_numpy(pointcloud_msg,field_names=("x","y","z")).astype(np.float64)
+        gazebo_rows,gazebo_cols = project_to_pixels(pointcloud,self.camera_intrinsic_matrix_,self.image_shape_[:2])
+        gazebo_colors = gazebo_rgb[gazebo_rows,gazebo_cols,:]
+        transformed_gazebo_rgb_noisy,gazebo_depth,transformed_gazebo_seg = reproject_points(pointcloud,gazebo_colors,self.robosuite_intrinsic_matrix_,self.robosuite_image_shape_,mode=mode)
         gazebo_depth_after= cv2.dilate(gazebo_depth,(3,3),iterations=3)
         gazebo_depth_after = cv2.erode(gazebo_depth_after,(3,3),iterations=3)
         transformed_gazebo_seg_after= cv2.dilate(transformed_gazebo_seg,(3,3),iterations=3)
@@ -849,33 +819,21 @@ class WriteData(Node):
         if(self.is_ready_):
             if(self.camera_intrinsic_matrix_ is None):
                 return
-            all_pixels,depth_data = self.getPixels(msg)
-            mask_image = np.zeros(self.image_shape_[:2], dtype=np.uint8)
-            clean_mask_image = np.zeros(self.image_shape_[:2], dtype=np.uint8)
-            depth_image = np.zeros(self.image_shape_[:2], dtype=np.float64)
-            clean_depth_image = np.zeros(self.image_shape_[:2], dtype=np.float64)
-            white_color = (255,255,255)
-            i = 0
+            mask_image,depth_image = self.getPixels(msg)
             block_background_mask = np.all(self.original_image_ != [155,155,155],axis=2)
-            for coord in all_pixels:
-                x,y = coord
-                mask_image[round(x), round(y)] = 255
-                depth_image[round(x), round(y)] = depth_data[i]
-                if(block_background_mask[round(x),round(y)]):
-                    clean_mask_image[round(x),round(y)] = 255
-                    clean_depth_image[round(x),round(y)] = depth_data[i]
-                i += 1
-            cv2.imwrite('clean_mask_image.png',clean_mask_image)
-            cv2.imwrite('mask_image.png',mask_image)
-            cv2.imwrite('depth_image.png',self.normalize_depth_image(depth_image))
+            clean_mask_image = np.where(block_background_mask,mask_image,0).astype(np.uint8)
+            clean_depth_image = np.where(block_background_mask,depth_image,0)
+            self.debug_writer_.write('clean_mask_image.png',clean_mask_image)
+            self.debug_writer_.write('mask_image.png',mask_image)
+            self.debug_writer_.write('depth_image.png',self.normalize_depth_image,depth_image)
             mask_image = clean_mask_image
             depth_image = clean_depth_image
             if(self.original_image_ is not None):
                 mask_image = cv2.resize(mask_image, (mask_image.shape[1], mask_image.shape[0]))
                 gazebo_masked_image = np.zeros_like(self.original_image_)
                 gazebo_masked_image = cv2.bitwise_and(self.original_image_, self.original_image_, mask=clean_mask_image)
-                cv2.imwrite('original_image.png',self.original_image_)
-                cv2.imwrite('gazebo_masked_image.png',gazebo_masked_image)
+                self.debug_writer_.write('original_image.png',self.original_image_)
+                self.debug_writer_.write('gazebo_masked_image.png',gazebo_masked_image)
                 self.inpainting(rgb,depth,segmentation,gazebo_masked_image,mask_image,depth_image)
             return
             np.save('/home/lawrence/gazebo_robot_depth.npy',depth_image)
@@ -897,112 +855,13 @@ class WriteData(Node):
                 # Apply the gazebo_mask to the original image using element-wise multiplication
                 gazebo_masked_image = cv2.bitwise_and(self.original_image_, self.original_image_, mask=mask_image)
                 gazebo_masked_image[:, :, 0], gazebo_masked_image[:, :, 2] = gazebo_masked_image[:, :, 2].copy(), gazebo_masked_image[:, :, 0].copy()
-                cv2.imwrite('/home/lawrence/gazebo_robot_only.jpg',gazebo_masked_image)
-                cv2.imwrite('/home/lawrence/gazebo_mask.jpg',mask_image)
+                self.debug_writer_.write('/home/lawrence/gazebo_robot_only.jpg',gazebo_masked_image)
+                self.debug_writer_.write('/home/lawrence/gazebo_mask.jpg',mask_image)
                 #mask_image = cv2.convertScaleAbs(mask_image, alpha=(255.0/65535.0))
                 ros_mask_image = self.cv_bridge_.cv2_to_imgmsg(old_mask_image,encoding="bgr8")
                 self.full_mask_image_publisher_.publish(ros_mask_image)
                 self.inpainting(rgb,depth,segmentation,gazebo_masked_image,mask_image,msg)
 
-    def setupMesh(self,filename,link_name,rpy_str,xyz_str):
-        if(self.is_ready_):
-            # RPY is in ZYX I'm pretty sure
-            mesh_scene = trimesh.load(filename)
-            if(link_name == "panda_link6"):
-                meshes = mesh_scene.geometry
-                for mesh in meshes:
-                    if(mesh != 'Shell006_000-mesh'):
-                        vertices = o3d.utility.Vector3dVector(meshes[mesh].vertices)
-                        triangles = o3d.utility.Vector3iVector(meshes[mesh].faces)
-                        open3d_mesh = o3d.geometry.TriangleMesh(vertices, triangles)
-                        open3d_mesh.translate(np.array([0,0,-0.028439417985386614/2]))
-                        meshes[mesh] = trimesh.Trimesh(vertices=open3d_mesh.vertices,faces=open3d_mesh.triangles)
-                #meshes['Shell012_000-mesh'] = trimesh.Trimesh(vertices=open3d_mesh.vertices,faces=open3d_mesh.triangles)
-                mesh = trimesh.util.concatenate(tuple(trimesh.Trimesh(vertices=g.vertices, faces=g.faces)
-                                                for g in meshes.values()))
-
-            mesh = trimesh.util.concatenate(tuple(trimesh.Trimesh(vertices=g.vertices, faces=g.faces)
-                                                for g in mesh_scene.geometry.values()))
-            # Convert Trimesh to Open3D TriangleMesh
-            vertices = o3d.utility.Vector3dVector(mesh.vertices)
-            triangles = o3d.utility.Vector3iVector(mesh.faces)
-            open3d_mesh = o3d.geometry.TriangleMesh(vertices, triangles)
-            test_pcd = open3d_mesh.sample_points_uniformly(number_of_points=50000)
-            test_pcd_data = np.asarray(test_pcd.points)
-            
-            diff = max(np.max(test_pcd_data[:, 0]) - np.min(test_pcd_data[:, 0]),np.max(test_pcd_data[:, 1]) - np.min(test_pcd_data[:, 1]),np.max(test_pcd_data[:, 2]) - np.min(test_pcd_data[:, 2]))
-            # Checks to make sure units are in mm instead of m (We convert uniformly to meters later)
-            
-            if(diff < 1):
-                open3d_mesh.vertices = o3d.utility.Vector3dVector(np.asarray(open3d_mesh.vertices) * 1000)
-            else:
-                R = np.array([[-1,0,0],[0,0,1],[0,1,0]])
-                open3d_mesh.rotate(R,[0,0,0])
-            test_pcd = open3d_mesh.sample_points_uniformly(number_of_points=50000)
-            #mesh_coordinate_frame = o3d.geometry.TriangleMesh.create_coordinate_frame(size=100, origin=[0,0,0])
-            #o3d.visualization.draw_geometries([test_pcd,mesh_coordinate_frame])
-            rpy_str_list = rpy_str.split()
-            rpy_floats = [float(x) for x in rpy_str_list]
-            rpy_np = np.array(rpy_floats)
-            xyz_str_list = xyz_str.split()
-            xyz_floats = [float(x) for x in xyz_str_list]
-            if(link_name == "panda_link1"):
-                xyz_floats = [0, 0, -0.1929999099]
-            elif(link_name == "panda_link3"):
-                xyz_floats = [0,0,-0.1219998142]
-            elif(link_name == "panda_link5"):
-                xyz_floats = [0,0,-0.2630000007]
-            elif(link_name == "panda_link7"):
-                rpy_np = np.array([0,0,-math.pi/4])
-                xyz_floats = [0,0,0.03679997502 + (0.028439417985386614/2)]
-            xyz_np = 1000 * np.array(xyz_floats)
-            R2 = self.eulerToR(rpy_np)
-            # Create a 4x4 identity matrix
-            transform_matrix = np.eye(4)
-
-            # Replace the top-left 3x3 submatrix with the rotation matrix
-            transform_matrix[:3, :3] = R2
-
-            # Set the first three elements in the fourth column to the translation vector
-            transform_matrix[:3, 3] = xyz_np
-
-            # Set the bottom-right element to 1
-            transform_matrix[3, 3] = 1.0
-            open3d_mesh.transform(transform_matrix)
-
-            transform = self.fks_[link_name]
-
-            position = Vector3()
-            quaternion = Quaternion()
-            position.x = transform.pos[0]
-            position.y = transform.pos[1]
-            position.z = transform.pos[2]
-
-            quaternion.w = transform.rot[0]
-            quaternion.x = transform.rot[1]
-            quaternion.y = transform.rot[2]
-            quaternion.z = transform.rot[3]
-
-            robot_fk = self.transformStampedToMatrix(quaternion,position)
-            t_matrix = self.camera_to_world_ @ robot_fk
-            open3d_mesh.transform(t_matrix)
-            return open3d_mesh
-            
-            # REQUIRES CAMERA TO BE IN GAZEBO SCENE
-            while True:
-                try:
-                    t = self.tf_buffer_.lookup_transform(
-                        "camera_color_optical_frame",
-                        link_name,
-                        rclpy.time.Time(),
-                    )
-                    t_matrix = self.transformStampedToMatrix(t.transform.rotation,t.transform.translation)
-                    open3d_mesh.transform(t_matrix)
-                    return open3d_mesh
-                except TransformException as ex:
-                    #TODO Change This
-                    pass
-
     def transformStampedToMatrix(self,rotation,translation):
         if(self.is_ready_):
             q0 = rotation.w
@@ -1033,16 +892,27 @@ class WriteData(Node):
 
     def setupMeshes(self,rgb,depth,segmentation):
         if(self.is_ready_):
-            open3d_mesh = None        
-            for [filename,link_name,rpy_str,xyz_str] in self.links_info_:
-                if open3d_mesh is None:
-                    open3d_mesh = self.setupMesh(filename,link_name,rpy_str,xyz_str)
-                else:
-                    open3d_mesh += self.setupMesh(filename,link_name,rpy_str,xyz_str)
-            pcd = open3d_mesh.sample_points_uniformly(number_of_points=200000)
-            pcd.points = o3d.utility.Vector3dVector(np.asarray(pcd.points) / 1000)
-            pcd_data = np.asarray(pcd.points)
-            np.save('panda_gazebo_pointcloud.npy',pcd_data)
+            if self.link_templates_ is None:
+                self.link_templates_ = LinkPointCloudTemplates.from_links_info(self.links_info_,cache_path=self.link_templates_cache_path_)
+            link_transforms = {}
+            for link_name in set(self.link_templates_.link_names):
+                transform = self.fks_[link_name]
+
+                position = Vector3()
+                quaternion = Quaternion()
+                position.x = transform.pos[0]
+                position.y = transform.pos[1]
+                position.z = transform.pos[2]
+
+                quaternion.w = transform.rot[0]
+                quaternion.x = transform.rot[1]
+                quaternion.y = transform.rot[2]
+                quaternion.z = transform.rot[3]
+
+                robot_fk = self.transformStampedToMatrix(quaternion,position)
+                link_transforms[link_name] = self.camera_to_world_ @ robot_fk
+            pcd_data = self.link_templates_.transform_points(link_transforms) / 1000
+            self.debug_writer_.save_array('panda_gazebo_pointcloud.npy',pcd_data)
             point_cloud_msg = PointCloud2()
             point_cloud_msg.header = Header()
             point_cloud_msg.header.frame_id = "real_camera_link"
@@ -1134,7 +1004,7 @@ class WriteData(Node):
             ee_pose = self.ur5e_solver_.fk(np.array(joint_array))
             scipy_rotation = R.from_matrix(ee_pose[:3,:3])
             scipy_quaternion = scipy_rotation.as_quat()
-            qout = self.panda_panda_gripper_solver_.ik(ee_pose,qinit=self.q_init_)
+            qout,_ = self.panda_panda_gripper_ik_.ik(ee_pose,self.q_init_)
             self.q_init_ = qout
             # Hardcoded gripper
             qout_list = qout.tolist()
@@ -1168,7 +1038,7 @@ class WriteData(Node):
         
         left_rgb_np = self.cv_bridge_.imgmsg_to_cv2(left_msg.rgb)
         # rgb_np = np.array(msg.rgb,dtype=np.uint8).reshape((msg.segmentation.width,msg.segmentation.height,3))
-        left_depth_np = np.array(left_msg.depth_map,dtype=np.float64).reshape((left_msg.rgb.height,left_msg.rgb.width))
+        left_depth_np = depth_map_to_numpy(left_msg)
         left_depth_np[np.isinf(left_depth_np) & (left_depth_np < 0)] = 0.01
         left_depth_np[np.isinf(left_depth_np) & (left_depth_np > 0)] = 10
         left_depth_np[np.isnan(left_depth_np)] = 0
@@ -1178,7 +1048,7 @@ class WriteData(Node):
 
         right_rgb_np = self.cv_bridge_.imgmsg_to_cv2(right_msg.rgb)
         # rgb_np = np.array(msg.rgb,dtype=np.uint8).reshape((msg.segmentation.width,msg.segmentation.height,3))
-        right_depth_np = np.array(right_msg.depth_map,dtype=np.float64).reshape((right_msg.rgb.height,right_msg.rgb.width))
+        right_depth_np = depth_map_to_numpy(right_msg)
         right_depth_np[np.isinf(right_depth_np) & (right_depth_np < 0)] = 0.01
         right_depth_np[np.isinf(right_depth_np) & (right_depth_np > 0)] = 10
         right_depth_np[np.isnan(right_depth_np)] = 0
@@ -1194,16 +1064,7 @@ class WriteData(Node):
         ee_pose = ee_pose @ end_effector_rotation_with_no_translation
         scipy_rotation = R.from_matrix(ee_pose[:3,:3])
         scipy_quaternion = scipy_rotation.as_quat()
-        qout = self.panda_panda_gripper_solver_.ik(ee_pose,qinit=self.q_init_)
-        b_xyz = 1e-5
-        b_rpy = 1e-3
-        while(qout is None):
-            b_xyz *= 10
-            b_rpy *= 10
-            qout = self.panda_panda_gripper_solver_.ik(ee_pose,qinit=self.q_init_,bx=b_xyz,by=b_xyz,bz=b_xyz,brx=b_rpy,bry=b_rpy,brz=b_rpy)
-            if(b_xyz == 0.01):
-                print("Couldn't find good IK")
-                qout = self.q_init_
+        qout,b_xyz = self.panda_panda_gripper_ik_.ik(ee_pose,self.q_init_)
         print("Bound xyz: " + str(b_xyz))
         self.q_init_ = qout
         panda_ur5_arm_joints = panda_ur5_gripper_joints.tolist()
@@ -1258,7 +1119,7 @@ class WriteData(Node):
             joint_array = joint_array[:-1]
 
             ee_pose = self.ur5e_solver_.fk(np.array(joint_array))
-            qout = self.panda_panda_gripper_solver_.ik(ee_pose,qinit=self.q_init_)
+            qout,_ = self.panda_panda_gripper_ik_.ik(ee_pose,self.q_init_)
             self.q_init_ = qout
 
             # Hardcoded gripper
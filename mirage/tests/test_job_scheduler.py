@@ -0,0 +1,107 @@
+import threading
+
+from mirage.infra import job_scheduler
+from mirage.infra.job_scheduler import CPU_DEVICE, FakeProbe, JobQueue, Worker
+
+def test_claim_picks_the_fullest_gpu_that_fits(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    probe = FakeProbe(gpu_memory=[8000, 4000, 2000], cpu_cores=8)
+    large = queue.submit("large", "true", gpu_memory=3000)
+    small = queue.submit("small", "true", gpu_memory=1500)
+    cpu = queue.submit("cpu", "true")
+
+    job = queue.claim("worker", "host", probe)
+    assert (job.id, job.device, job.attempts) == (large, "cuda:1", 1)
+    # cuda:1 has 1000 MB left, cuda:2 is the fullest GPU that still fits
+    assert queue.claim("worker", "host", probe).device == "cuda:2"
+    job = queue.claim("worker", "host", probe)
+    assert (job.id, job.device) == (cpu, CPU_DEVICE)
+    assert queue.claim("worker", "host", probe) is None
+    assert [job.id for job in queue.jobs("running")] == [large, small, cpu]
+
+def test_claim_counts_the_cores_of_running_jobs(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    probe = FakeProbe(cpu_cores=4)
+    queue.submit("first", "true", cpu_cores=3)
+    queue.submit("too large", "true", cpu_cores=2)
+    last = queue.submit("last", "true", cpu_cores=1)
+
+    assert queue.claim("worker", "host", probe).name == "first"
+    # The second job does not fit in the remaining core, later jobs that fit are started
+    assert queue.claim("worker", "host", probe).id == last
+    assert queue.claim("worker", "host", probe) is None
+    # Jobs of other hosts do not use the cores of this host
+    assert queue.claim("other worker", "other host", probe).name == "too large"
+
+def test_finish_retries_then_fails(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    probe = FakeProbe()
+    job_id = queue.submit("crashing", "false", max_retries=1)
+
+    queue.claim("worker", "host", probe)
+    assert queue.finish(job_id, "worker", 1) == "queued"
+    queue.claim("worker", "host", probe)
+    assert queue.finish(job_id, "worker", 1) == "failed"
+    job, = queue.jobs()
+    assert (job.status, job.attempts, job.returncode) == ("failed", 2, 1)
+
+    done_id = queue.submit("succeeding", "true", max_retries=0)
+    queue.claim("worker", "host", probe)
+    assert queue.finish(done_id, "worker", 0) == "done"
+
+def test_requeue_lost_jobs(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    probe = FakeProbe()
+    job_id = queue.submit("lost", "true")
+    queue.heartbeat("alive", "host")
+    queue.claim("silent", "host", probe)
+
+    assert queue.requeue_lost_jobs(timeout=60.0) == 1
+    job, = queue.jobs()
+    assert (job.status, job.attempts) == ("queued", 1)
+
+    queue.claim("alive", "host", probe)
+    assert queue.requeue_lost_jobs(timeout=60.0) == 0
+    # The result of the silent worker does not overwrite the new attempt
+    assert queue.finish(job_id, "silent", 1) is None
+    assert queue.jobs()[0].status == "running"
+    assert queue.finish(job_id, "alive", 0) == "done"
+
+def test_concurrent_queues_never_claim_the_same_job(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    submitter = JobQueue(path)
+    for i in range(50):
+        submitter.submit(f"job {i}", "true")
+    claimed = {"first": [], "second": []}
+
+    def claim_all(worker):
+        queue = JobQueue(path)
+        while True:
+            job = queue.claim(worker, worker, FakeProbe(cpu_cores=100))
+            if job is None:
+                break
+            claimed[worker].append(job.id)
+        queue.close()
+
+    threads = [threading.Thread(target=claim_all, args=(worker,)) for worker in claimed]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ids = claimed["first"] + claimed["second"]
+    assert sorted(ids) == list(range(1, 51))
+
+def test_stopped_worker_releases_its_jobs(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    queue.submit("healthy", "sleep 30", max_retries=0)
+
+    def interrupt(seconds):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(job_scheduler.time, "sleep", interrupt)
+    worker = Worker(queue, FakeProbe(), log_dir=str(tmp_path / "logs"))
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
+    job, = queue.jobs()
+    assert (job.status, job.attempts) == ("queued", 0)
@@ -0,0 +1,45 @@
+from mirage.benchmark.results_store import ResultsIndex, ResultsStore, RolloutRecord
+
+def write_store(path, run_id, num_records):
+    store = ResultsStore(path, run_id=run_id)
+    for rollout in range(num_records):
+        store.append(RolloutRecord(robot="UR5e", seed=0, rollout=rollout, success=rollout % 2 == 0,
+                                   return_=1.0, horizon=100, rollout_time=2.0))
+    store.close()
+
+def test_refresh_reads_appended_records(tmp_path):
+    path = str(tmp_path / "target.jsonl")
+    write_store(path, "run", 2)
+    index = ResultsIndex(":memory:")
+    index.add("experiment", path)
+    assert index.refresh() == 2
+    assert index.refresh() == 0
+    summary, = index.summary()
+    assert summary["num_rollouts"] == 2
+    assert summary["num_success"] == 1
+
+def test_refresh_after_rewrite_with_larger_file(tmp_path):
+    path = str(tmp_path / "target.jsonl")
+    write_store(path, "first run", 2)
+    index = ResultsIndex(":memory:")
+    index.add("experiment", path)
+    assert index.refresh() == 2
+
+    # A new run of the evaluation rewrites the store, past the offset of the first run
+    write_store(path, "second run", 5)
+    assert index.refresh() == 5
+    summary, = index.summary()
+    assert summary["num_rollouts"] == 5
+    assert summary["num_success"] == 3
+
+def test_refresh_after_rewrite_with_smaller_file(tmp_path):
+    path = str(tmp_path / "target.jsonl")
+    write_store(path, "first run", 5)
+    index = ResultsIndex(":memory:")
+    index.add("experiment", path)
+    assert index.refresh() == 5
+
+    write_store(path, "second run", 1)
+    assert index.refresh() == 1
+    summary, = index.summary()
+    assert summary["num_rollouts"] == 1
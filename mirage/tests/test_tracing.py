@@ -0,0 +1,18 @@
+from mirage.infra.tracing import Tracer
+
+def test_summary_covers_spans_dropped_from_the_chrome_trace():
+    tracer = Tracer(enabled=True, max_events=3)
+    for _ in range(10):
+        with tracer.span("env.step"):
+            pass
+    with tracer.span("policy"):
+        pass
+
+    assert len(tracer.chrome_trace()["traceEvents"]) == 3
+    assert tracer.num_dropped == 8
+    counts = {summary["stage"]: summary["count"] for summary in tracer.summary()}
+    assert counts == {"env.step": 10, "policy": 1}
+
+    tracer.clear()
+    assert tracer.summary() == []
+    assert tracer.num_dropped == 0
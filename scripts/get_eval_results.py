@@ -7,9 +7,17 @@ import csv
 import json
 import argparse
 from pathlib import Path
+from mirage.benchmark.results_store import ResultsIndex, results_store_path
 
-def find_results(path):
+def find_results(path, index=None):
     """Returns num_rollouts, num_success"""
+    # The rollout records next to the stats file are read incrementally through the index
+    jsonl_path = results_store_path(path)
+    if index is not None and os.path.exists(jsonl_path):
+        index.add(path, jsonl_path)
+        index.refresh(path)
+        summaries = index.summary(path)
+        return sum(s['num_rollouts'] for s in summaries), sum(s['num_success'] for s in summaries)
     try:
         with open(path, 'r') as f:
             content = f.read().strip()
@@ -36,7 +44,7 @@ def find_results(path):
 # Robot name mapping
 ROBOT_MAP = {'panda': 'Panda', 'sawyer': 'Sawyer', 'ur5e': 'UR5e', 'kinova3': 'Kinova3', 'jaco': 'Jaco', 'iiwa': 'IIWA'}
 
-def test_results(exp_name, mode):
+def test_results(exp_name, mode, index=None):
     """Get results for a specific experiment and mode"""
     results = []
     with open('experiments_to_run.csv', 'r') as f:
@@ -54,7 +62,7 @@ def test_results(exp_name, mode):
                     if mode in ['patch', 'lighting'] and robot_name != 'Panda':
                         continue
                     results_path = get_results_path(exp_name, robot_name, mode)
-                    num_rollouts, num_success = find_results(results_path)
+                    num_rollouts, num_success = find_results(results_path, index)
                     
                     results.append({
                         'Exp Name': exp_name,
@@ -114,6 +122,8 @@ def main():
     parser.add_argument('mode', nargs='?', choices=['patch', 'lighting', 'standard', 'all'], 
                        default='all', help='Evaluation mode: patch, lighting, standard, or all (default: all)')
     parser.add_argument('--output', '-o', help='Output CSV filename (default: auto-generated)')
+    parser.add_argument('--index', default='results/results_index.sqlite',
+                       help='SQLite index of the per rollout records, only new records are read on every run (empty to disable)')
     
     args = parser.parse_args()
     
@@ -124,6 +134,10 @@ def main():
         modes_to_process = [args.mode]
     
     experiments = get_experiment_list()
+    index = None
+    if args.index:
+        os.makedirs(os.path.dirname(args.index) or '.', exist_ok=True)
+        index = ResultsIndex(args.index)
     
     
     
@@ -135,7 +149,7 @@ def main():
             if mode in ['patch', 'lighting'] and 'all_minus' in exp_name:
                 continue
                 
-            results = test_results(exp_name, mode)
+            results = test_results(exp_name, mode, index)
             all_results.extend(results)
             
         output_filename = f'evaluation_results_{mode}_mode.csv'
@@ -8,12 +8,15 @@ from pathlib import Path
 import os
 import sys
 import csv
-import json
 import subprocess
 import time
+import argparse
 import yaml
 import os
 import numpy as np
+from mirage.infra.job_scheduler import JobQueue
+from mirage.benchmark.results_store import ResultsIndex
+from get_eval_results import find_results
 def generate_config(source_agent_path, target_agent_path, source_robot_name, target_robot_name, results_folder, output_path=None):
     """
     Generate a YAML configuration file based on the template with specified parameters.
@@ -71,33 +74,8 @@ def generate_config(source_agent_path, target_agent_path, source_robot_name, tar
     print(f"Configuration file generated at: {output_path}")
     return output_path
 
-def find_results(path):
-    """Returns num_rollouts, num_success"""
-    try:
-        with open(path, 'r') as f:
-            content = f.read().strip()
-            # Split content into individual JSON objects
-            json_objects = content.split('}{')
-            if len(json_objects) > 1:
-                # Add back the missing braces
-                json_objects = [json_objects[0] + '}'] + ['{' + obj for obj in json_objects[1:]]
-            
-            # Parse the first JSON object which contains the main results
-            data = json.loads(json_objects[0])
-            num_rollouts = data.get('Num Rollouts', 0)
-            num_success = data.get('Num_Success', [0])[0]
-            return num_rollouts, num_success
-    except FileNotFoundError:
-        return 0, 0
-    except json.JSONDecodeError:
-        print(f"Error: Invalid JSON format in {path}")
-        return 0, 0
-    except Exception as e:
-        print(f"Error reading results file: {str(e)}")
-        return 0, 0
-
 map = {'panda': 'Panda', 'sawyer': 'Sawyer', 'ur5e': 'UR5e', 'kinova3': 'Kinova3', 'jaco': 'Jaco', 'iiwa': 'IIWA'}
-def test_results(exp_name):
+def test_results(exp_name, queue=None, gpu_memory=8000, max_retries=2, index=None):
     with open('experiments_to_run.csv', 'r') as f:
         reader = csv.DictReader(f)
         for row in reader:
@@ -109,18 +87,19 @@ def test_results(exp_name):
 
                 for robot in robots:
                     results_path = get_results_path(exp_name, map[robot.lower()])
-                    num_rollouts, num_success = find_results(results_path)
+                    num_rollouts, num_success = find_results(results_path, index)
                     
                     
 
-                    create_config(exp_name, map[robot.lower()])
-                    time.sleep(5)  # Wait for 5 seconds
+                    create_config(exp_name, map[robot.lower()], queue, gpu_memory, max_retries)
+                    if queue is None:
+                        time.sleep(5)  # Wait for 5 seconds
 def get_results_path(exp_name, robot):
     return f'mirage/mirage/benchmark/robosuite/results/{exp_name}/{robot}/target.txt'
 
 def get_absolute_path(relative_path):
     return str(os.path.abspath(relative_path))
-def create_config(exp_name, robot):
+def create_config(exp_name, robot, queue=None, gpu_memory=8000, max_retries=2):
     model_path = get_absolute_path(getModels(exp_name))
     results_folder = get_absolute_path(f'mirage/mirage/benchmark/robosuite/results/{exp_name}/{robot}')
     
@@ -140,6 +119,9 @@ def create_config(exp_name, robot):
 
     Path(results_folder + '/source.txt').touch()
     Path(results_folder + '/target.txt').touch()
+    if queue is not None:
+        queue_eval(queue, f'{exp_name}_{robot}', output_path, gpu_memory, max_retries)
+        return
     gpu_info = find_least_used_gpu()
     gpu_id = gpu_info['gpu_id']
     if gpu_info['gpu_utilization'] > 80 or gpu_info['memory_utilization'] > 95 or gpu_info['memory_percent'] > 80:
@@ -151,6 +133,11 @@ def create_config(exp_name, robot):
     command += f' && read -p "Press Enter to close..."'
     run_in_tmux(command, f'{exp_name}_{robot}')
 
+def queue_eval(queue, name, config_path, gpu_memory, max_retries):
+    # The queue workers pick the GPU, so the command does not set CUDA_VISIBLE_DEVICES
+    cwd = get_absolute_path('mirage/mirage/benchmark/robosuite')
+    job_id = queue.submit(name, f'python run_robosuite_benchmark.py --config {config_path}', cwd=cwd, gpu_memory=gpu_memory, max_retries=max_retries)
+    print(f"Queued job {job_id}: evaluating {name}")
 
 def getModels(folder_name):
     folder_path = f'robomimic-mirage/trained_diffusion_policies/{folder_name}'
@@ -241,10 +228,19 @@ def run_in_tmux(command, window_name=None):
         return False
 
 if __name__ == "__main__":
-    # Example usage
-    
+    parser = argparse.ArgumentParser(description='Launch the robosuite evaluations of the experiments')
+    parser.add_argument('--queue', type=str, default=None, help="Submit the evaluations to the job queue at this path instead of launching tmux windows")
+    parser.add_argument('--gpu_memory', type=int, default=8000, help="MB of GPU memory reserved by every evaluation submitted to the queue")
+    parser.add_argument('--max_retries', type=int, default=2, help="Number of times a crashed evaluation submitted to the queue is retried")
+    parser.add_argument('--index', default='results/results_index.sqlite',
+                        help='SQLite index of the per rollout records, only new records are read on every run (empty to disable)')
+    args = parser.parse_args()
+    queue = JobQueue(args.queue) if args.queue is not None else None
+    index = None
+    if args.index:
+        os.makedirs(os.path.dirname(args.index) or '.', exist_ok=True)
+        index = ResultsIndex(args.index)
 
-    
     exps = ['panda_stack',
 'sawyer_stack',
 'jaco_stack',
@@ -260,4 +256,6 @@ if __name__ == "__main__":
 'all_minus_ur5e_merged_stack',
 'all_stack']
     for exp_name in list((exps)):
-        test_results(exp_name)
\ No newline at end of file
+        test_results(exp_name, queue, args.gpu_memory, args.max_retries, index)
+    if queue is not None:
+        queue.close()
\ No newline at end of file
@@ -2,8 +2,10 @@ import subprocess
 import sys
 import os
 import time
+import argparse
 import pandas as pd
 from find_least_used_gpu import find_least_used_gpu
+from mirage.infra.job_scheduler import JobQueue
 
 def create_tmux_window(gpu_id, config_name):
     # Create a new tmux window with a specific name
@@ -36,11 +38,29 @@ def launch_training(exp_name):
         print(f'python scripts/launch_training.py {exp_name} ../../../{train_data_filepath}')
         
     create_tmux_window(gpu_info['gpu_id'], exp_name)
-        
-        
+
+def queue_training(queue, exp_name, gpu_memory, max_retries):
+    # The queue workers pick the GPU, so the command does not set CUDA_VISIBLE_DEVICES
+    config_path = f"robomimic-mirage/configs/{exp_name}.json"
+    cwd = os.path.abspath("robomimic-mirage/robomimic/scripts")
+    job_id = queue.submit(f"train_{exp_name}", f"python train.py --config ../../../{config_path}", cwd=cwd, gpu_memory=gpu_memory, max_retries=max_retries)
+    print(f"Queued job {job_id}: training {exp_name}")
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queue', type=str, default=None, help="Submit the trainings to the job queue at this path instead of launching tmux windows")
+    parser.add_argument('--gpu_memory', type=int, default=16000, help="MB of GPU memory reserved by every training submitted to the queue")
+    parser.add_argument('--max_retries', type=int, default=1, help="Number of times a crashed training submitted to the queue is retried")
+    args = parser.parse_args()
+
     experiments_to_run = pd.read_csv('experiments_to_run.csv')
+    if args.queue is not None:
+        queue = JobQueue(args.queue)
+        for _, row in experiments_to_run.iterrows():
+            queue_training(queue, row['exp_name'], args.gpu_memory, args.max_retries)
+        queue.close()
+        sys.exit(0)
     for _, row in experiments_to_run.iterrows():
         launch_training(row['exp_name'])
         time.sleep(20)
\ No newline at end of file
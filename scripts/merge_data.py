@@ -1,117 +1,162 @@
 import h5py
+import argparse
 import os
 import numpy as np
 import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def merge_hdf5_files(input_files, output_file, task):
-    if task in ['can', 'square', 'lift']:
-        length = 200
-    elif task in ['stack', 'two_piece_assembly']:
-        length = 1000
+MERGE_MODES = ['virtual', 'copy']
+
+
+def plan_demos(input_files):
+    """
+    Numbers the demos of the input files one after the other, in file order and demo number order.
+    The offset of every file is the number of demos in the files before it.
+    :return: list of (input file index, demo, merged demo)
+    """
+    plan = []
+    for file_ind, input_file in enumerate(input_files):
+        with h5py.File(input_file, 'r') as f:
+            demo_groups = [k for k in f['data'].keys() if k.startswith('demo_')]
+        demo_groups.sort(key=lambda x: int(x.split('_')[1]))
+        for demo in demo_groups:
+            plan.append((file_ind, demo, f"demo_{len(plan)}"))
+    return plan
+
+
+def add_dataset(f_out, path, dataset, mode):
+    """
+    Adds a dataset to the merged file, as a virtual dataset mapping the input dataset or as a copy.
+    Copies are made chunk by chunk by HDF5 and keep the chunking and compression of the input.
+    """
+    # Virtual datasets cannot be scalar, empty or variable length, those are small and copied
+    if mode == 'virtual' and dataset.ndim > 0 and dataset.size > 0 and dataset.dtype.kind != 'O':
+        layout = h5py.VirtualLayout(shape=dataset.shape, dtype=dataset.dtype)
+        # The dataset object resolves the external links of split files to the file holding the data
+        layout[...] = h5py.VirtualSource(os.path.abspath(dataset.file.filename), dataset.name, shape=dataset.shape)
+        f_out.create_virtual_dataset(path, layout)
     else:
-        assert(False)
+        f_out.copy(dataset, path)
+
+
+def merge_hdf5_files(input_files, output_file, mode='copy'):
+    """
+    Merges the demos of several files into one, renumbering them sequentially.
+    :param mode: 'virtual' for a merged file made of virtual datasets that read the input files, 'copy' for a standalone file
+    """
+    if mode not in MERGE_MODES:
+        raise ValueError(f"Unknown merge mode {mode}, expected one of {MERGE_MODES}")
+    plan = plan_demos(input_files)
+    merged_demos = {(file_ind, demo): new_demo for file_ind, demo, new_demo in plan}
+
     # Create output file
     with h5py.File(output_file, 'w') as f_out:
         # Create data group first
         data_group = f_out.create_group('data')
-        
+
         # Copy env_args and other attributes from the first file
         with h5py.File(input_files[0], 'r') as f_first:
             if 'env_args' in f_first['data'].attrs:
                 env_args = json.loads(f_first['data'].attrs['env_args'])
                 data_group.attrs['env_args'] = json.dumps(env_args)
-                
+
         keep_keys = []
 
         for file_ind in range(len(input_files)):
-            with h5py.File(input_files[file_ind], 'r') as f:                
+            with h5py.File(input_files[file_ind], 'r') as f:
                 mask_name = 'train'
                 mask_data = [b.decode('utf-8') for b in list(f[f'mask/{mask_name}'])]
-                keep_keys.extend([f"demo_{file_ind * length + int(s.split('_')[1])}" for s in mask_data])
+            for demo in mask_data:
+                if (file_ind, demo) not in merged_demos:
+                    raise ValueError(f"Mask {mask_name} of {input_files[file_ind]} has {demo}, which is not in its data")
+                keep_keys.append(merged_demos[(file_ind, demo)])
         f_out.create_dataset(f'mask/{mask_name}', data=[k.encode("utf-8") for k in keep_keys])
-        print(keep_keys)
-        demo_count = 0
-        
-        for input_file in input_files:
-            print(f"Processing {input_file}...")
-            with h5py.File(input_file, 'r') as f_in:
-                # Get all demo groups
-                demo_groups = [k for k in f_in['data'].keys() if k.startswith('demo_')]
-                demo_groups.sort(key=lambda x: int(x.split('_')[1]))
-                
-                for demo in demo_groups:
-                    # Create new demo name with sequential number
-                    new_demo = f"demo_{demo_count}"
-                    demo_count += 1
-                    
-                    # Create corresponding group in output
-                    out_demo_group = f_out.create_group(f'data/{new_demo}')
-                    
-                    # Copy num_samples attribute
-                    if 'num_samples' in f_in[f'data/{demo}'].attrs:
-                        out_demo_group.attrs['num_samples'] = f_in[f'data/{demo}'].attrs['num_samples']
-                    
-                    # Copy all datasets from the demo group
-                    for dataset_name, dataset in f_in[f'data/{demo}'].items():
-                        
-                        if isinstance(dataset, h5py.Dataset):
-                            # Copy dataset
-                            f_out.create_dataset(f'data/{new_demo}/{dataset_name}', 
-                                               data=dataset[:],
-                                               dtype=dataset.dtype)
-                        elif isinstance(dataset, h5py.Group):
-                            # Create subgroup and copy its datasets
-                            subgroup = f_out.create_group(f'data/{new_demo}/{dataset_name}')
-                            for subdataset_name, subdataset in dataset.items():
-                                if 'eef_error' in subdataset_name: continue
-                                subgroup.create_dataset(subdataset_name,
-                                                      data=subdataset[:],
-                                                      dtype=subdataset.dtype)
-                    
-                    # Copy all other attributes
-                    for attr_name, attr_value in f_in[f'data/{demo}'].attrs.items():
-                        if attr_name != 'num_samples':  # We already copied this above
-                            f_out[f'data/{new_demo}'].attrs[attr_name] = attr_value
-                    
-                    # Add source file and original demo name as attributes
-                    f_out[f'data/{new_demo}'].attrs['source_file'] = os.path.basename(input_file)
-                    f_out[f'data/{new_demo}'].attrs['original_demo'] = demo
-        print(f"\nMerged {demo_count} demos into {output_file}")
+
+        input_handles = [h5py.File(input_file, 'r') for input_file in input_files]
+        try:
+            for file_ind, demo, new_demo in plan:
+                f_in = input_handles[file_ind]
+                # Create corresponding group in output
+                out_demo_group = f_out.create_group(f'data/{new_demo}')
+
+                # Copy all datasets from the demo group
+                for dataset_name, dataset in f_in[f'data/{demo}'].items():
+                    if isinstance(dataset, h5py.Dataset):
+                        add_dataset(f_out, f'data/{new_demo}/{dataset_name}', dataset, mode)
+                    elif isinstance(dataset, h5py.Group):
+                        # Create subgroup and copy its datasets
+                        f_out.create_group(f'data/{new_demo}/{dataset_name}')
+                        for subdataset_name, subdataset in dataset.items():
+                            if 'eef_error' in subdataset_name: continue
+                            add_dataset(f_out, f'data/{new_demo}/{dataset_name}/{subdataset_name}', subdataset, mode)
+
+                # Copy all attributes, including num_samples
+                for attr_name, attr_value in f_in[f'data/{demo}'].attrs.items():
+                    out_demo_group.attrs[attr_name] = attr_value
+
+                # Add source file and original demo name as attributes
+                out_demo_group.attrs['source_file'] = os.path.basename(input_files[file_ind])
+                out_demo_group.attrs['original_demo'] = demo
+        finally:
+            for f_in in input_handles:
+                f_in.close()
+    print(f"\nMerged {len(plan)} demos ({len(keep_keys)} in mask {mask_name}) into {output_file}")
+    return output_file
+
+
+def merge_jobs(task):
+    """
+    Returns the (input files, output file) of every merged dataset of a task.
+    """
+    robot_to_path = {
+        'Jaco': f"xembody_data/{task}/split_data/robotJaco.hdf5",
+        'Panda': f"xembody_data/{task}/split_data/robotPanda.hdf5",
+        'Sawyer': f"xembody_data/{task}/split_data/robotSawyer.hdf5",
+        'UR5e': f"xembody_data/{task}/split_data/robotUR5e.hdf5",
+        'Kinova3': f"xembody_data/{task}/split_data/robotKinova3.hdf5"
+    }
+    all = ['Jaco', 'Panda', 'Sawyer', 'UR5e', 'Kinova3']
+    dct = {'all_minus_jaco': [i for i in all if i!='Jaco'],
+     'all_minus_sawyer': [i for i in all if i!='Sawyer'],
+     'all_minus_ur5e': [i for i in all if i!='UR5e'],
+     'all_minus_kinova3': [i for i in all if i!='Kinova3']
+    }
+    jobs = []
+    #all minus data
+    for name in dct.keys():
+        input_files = [robot_to_path[robot] for robot in dct[name]]
+        assert(len(input_files) == 4)
+        output_file = f"xembody_data/{task}/merged_data/{name}_merged.hdf5".lower()
+        jobs.append((input_files, output_file))
+
+    #1+1 and all data
+    for robots_to_merge in [['Panda', 'Jaco'],
+                            ['Panda', 'Sawyer'],
+                            ['Panda', 'UR5e'],
+                            ['Panda', 'Kinova3'],
+                            list(robot_to_path.keys())]:
+        input_files = [robot_to_path[robot] for robot in robots_to_merge]
+
+        # Output file
+        output_file = f"xembody_data/{task}/merged_data/{'_'.join(robots_to_merge)}_merged.hdf5".lower()
+        jobs.append((input_files, output_file))
+    return jobs
+
 
 if __name__ == "__main__":
-    # List of input files
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--merge_mode', type=str, default='virtual', choices=MERGE_MODES,
+                        help="virtual: merged files read the split files, which have to be kept. copy: standalone merged files")
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count(), help="Merged files written in parallel")
+    args = parser.parse_args()
+
+    # Merged files are independent, so each is written by its own process: HDF5 files
+    # cannot be written from several processes at once
+    jobs = []
     for task in ['can', 'lift', 'square', 'stack', 'two_piece_assembly']:
-        robot_to_path = {
-            'Jaco': f"xembody_data/{task}/split_data/robotJaco.hdf5",
-            'Panda': f"xembody_data/{task}/split_data/robotPanda.hdf5",
-            'Sawyer': f"xembody_data/{task}/split_data/robotSawyer.hdf5",
-            'UR5e': f"xembody_data/{task}/split_data/robotUR5e.hdf5",
-            'Kinova3': f"xembody_data/{task}/split_data/robotKinova3.hdf5"
-        }
-        all = ['Jaco', 'Panda', 'Sawyer', 'UR5e', 'Kinova3']
-        dct = {'all_minus_jaco': [i for i in all if i!='Jaco'],
-         'all_minus_sawyer': [i for i in all if i!='Sawyer'],
-         'all_minus_ur5e': [i for i in all if i!='UR5e'],
-         'all_minus_kinova3': [i for i in all if i!='Kinova3']
-        }
-        #all minus data
-        for name in dct.keys():
-            input_files = [robot_to_path[robot] for robot in dct[name]]
-            assert(len(input_files) == 4)
-            os.makedirs(f'xembody_data/{task}/merged_data', exist_ok=True)
-            output_file = f"xembody_data/{task}/merged_data/{name}_merged.hdf5".lower()
-            merge_hdf5_files(input_files, output_file, task) 
-        
-
-        #1+1 and all data
-        for robots_to_merge in [['Panda', 'Jaco'], 
-                                ['Panda', 'Sawyer'], 
-                                ['Panda', 'UR5e'],
-                                ['Panda', 'Kinova3'],
-                                list(robot_to_path.keys())]:
-            input_files = [robot_to_path[robot] for robot in robots_to_merge]
-            
-            # Output file
-            output_file = f"xembody_data/{task}/merged_data/{'_'.join(robots_to_merge)}_merged.hdf5".lower()
-            
-            merge_hdf5_files(input_files, output_file, task) 
+        os.makedirs(f'xembody_data/{task}/merged_data', exist_ok=True)
+        jobs.extend(merge_jobs(task))
+    with ProcessPoolExecutor(max_workers=args.num_workers) as executor:
+        futures = [executor.submit(merge_hdf5_files, input_files, output_file, args.merge_mode) for input_files, output_file in jobs]
+        for future in as_completed(futures):
+            future.result()
@@ -7,6 +7,7 @@ import time
 import pynvml
 import argparse
 from pathlib import Path
+from mirage.infra.job_scheduler import JobQueue
 
 def get_gpu_utilization():
     """Get GPU memory and utilization information for all GPUs"""
@@ -110,6 +111,13 @@ def main():
     parser.add_argument('mode', choices=['patch', 'lighting', 'standard'], 
                        help='Evaluation mode: patch, lighting, or standard')
     
+    parser.add_argument('--queue', type=str, default=None,
+                       help='Submit the commands to the job queue at this path instead of launching tmux windows')
+    parser.add_argument('--gpu_memory', type=int, default=8000,
+                       help='MB of GPU memory reserved by every command submitted to the queue')
+    parser.add_argument('--max_retries', type=int, default=2,
+                       help='Number of times a crashed command submitted to the queue is retried')
+    
     args = parser.parse_args()
     
     # Capitalize mode for display
@@ -124,6 +132,17 @@ def main():
         commands = read_commands(args.mode)
         print(f"Found {len(commands)} commands to run\n")
         
+        if args.queue is not None:
+            # Workers started with `python -m mirage.infra.job_scheduler --db <queue> worker` pick the
+            # commands up as soon as a GPU has room, and retry the ones that crash
+            queue = JobQueue(args.queue)
+            cwd = str(Path(__file__).resolve().parent.parent / "mirage" / "mirage" / "benchmark" / "robosuite")
+            for i, command in enumerate(commands, 1):
+                job_id = queue.submit(f"{args.mode}_eval_{i}", command, cwd=cwd, gpu_memory=args.gpu_memory, max_retries=args.max_retries)
+                print(f"Queued job {job_id}: {command[:80]}")
+            queue.close()
+            return
+        
         # Create tmux session
         session_name = f"{args.mode}_evals"
         create_tmux_session(session_name)
@@ -2,8 +2,8 @@ import h5py
 import argparse
 import numpy as np
 import os
-import shutil
 import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 lengths = {
     'can': 200,
     'square': 200,
@@ -25,144 +25,114 @@ blacklist_task = { task: {
     } for task in ['can', 'lift', 'square', 'stack', 'two_piece_assembly']}
 
 
-def split_robot_data(input_hdf5_path, output_dir, task):
+# Datasets of every demo that are kept in the split files, besides the image of the robot
+DEMO_DATASETS = ['actions', 'dones', 'rewards', 'states']
+OBS_DATASETS = ['object', 'robot0_eef_pos', 'robot0_eef_quat', 'robot0_gripper_qpos']
+SPLIT_MODES = ['link', 'copy']
+def robot_image_name(robot):
+    """
+    Name of the agentview image of a robot in the input file, the Panda image is the original one.
+    """
+    return 'agentview_image' if robot == 'Panda' else f'agentview_image_{robot}'
 
-    os.makedirs(output_dir, exist_ok=True)    
-    # Create separate HDF5 files for each robot
-    for robot_id in range(len(robots)):
-        output_path = os.path.join(output_dir, f"robot{robots[robot_id]}.hdf5")
-        
 
-        shutil.copy2(input_hdf5_path, output_path)
-        
+def add_dataset(f_in, group, name, source_path, input_hdf5_path, mode):
+    """
+    Adds a dataset of the input file to a split file, as an external link or as a copy.
+    Copies are made chunk by chunk by HDF5 without decompressing and loading the whole dataset.
+    """
+    if mode == 'link':
+        group[name] = h5py.ExternalLink(input_hdf5_path, source_path)
+    else:
+        f_in.copy(f_in[source_path], group, name=name)
 
-        with h5py.File(output_path, 'r+') as f:
 
-            with h5py.File(input_hdf5_path, 'r') as f_in:
-                if 'env_args' in f_in['data'].attrs:
-                    env_args = json.loads(f_in['data'].attrs['env_args'])
-                    f['data'].attrs['env_args'] = json.dumps(env_args)
-                
-                # Copy mask data
-                                
-                if 'mask' not in f:
-                    f.create_group('mask')
+def split_robot_file(input_hdf5_path, output_path, task, robot, mode):
+    """
+    Writes the split file of one robot, whose demos only contain the agentview image of that robot.
+    In link mode the datasets are external links into the input file, which therefore has to stay in place.
+    """
+    input_hdf5_path = os.path.abspath(input_hdf5_path)
+    with h5py.File(input_hdf5_path, 'r') as f_in, h5py.File(output_path, 'w') as f:
+        data_group = f.create_group('data')
+        if 'env_args' in f_in['data'].attrs:
+            env_args = json.loads(f_in['data'].attrs['env_args'])
+            data_group.attrs['env_args'] = json.dumps(env_args)
 
-                mask_name = 'train'
-                keep_keys = [
-                    f'demo_{i}' for i in range(lengths[task])
-                    if i not in blacklist_task[task][robots[robot_id]]
-                ]
-                if f.get(f'mask/{mask_name}'):
-                    del f[f'mask/{mask_name}']
-                f.create_dataset(f'mask/{mask_name}', data=[k.encode("utf-8") for k in keep_keys])
-            
-            # Get all demo groups
-            demo_groups = [k for k in f['data'].keys() if k.startswith('demo_')]
-            
-            for demo_group in demo_groups:
-                # Copy num_samples attribute for each episode
-                if 'num_samples' in f[f'data/{demo_group}'].attrs:
-                    f[f'data/{demo_group}'].attrs['num_samples'] = f[f'data/{demo_group}'].attrs['num_samples']
-                
-                obs_group = f[f'data/{demo_group}/obs']
-                
-                # Get all agentview_image and eef_error datasets
-                agentview_images = [k for k in obs_group.keys() if 'agentview_image' in k.lower()]
-                
-                # Keep only the datasets for this robot
-                for dataset_name in agentview_images:
-                    if robots[robot_id].lower() not in dataset_name.lower():
-                        # Delete datasets that don't belong to this robot
-                        del obs_group[dataset_name]
-                    else:
-                        if dataset_name.startswith('agentview_image_'):
-                            new_name = 'agentview_image'
-                        else:
-                            continue
-                            
-                        obs_group[new_name] = obs_group[dataset_name]
-                        del obs_group[dataset_name]
-                
-                # Add blacklist attribute based on task and robot
-                demo_num = int(demo_group.split('_')[-1])
-                is_blacklisted = demo_num in blacklist_task[task][robots[robot_id]]
-                f[f'data/{demo_group}'].attrs['blacklist'] = is_blacklisted
-                # Store original demo number
-                f[f'data/{demo_group}'].attrs['original_demo_num'] = demo_num
-        
-        print(f"Created split data for robot {robots[robot_id]} at: {output_path}")
+        # Copy mask data, the masks are small so they are always copied
+        mask_group = f.create_group('mask')
+        if 'mask' in f_in:
+            for mask_name in f_in['mask'].keys():
+                mask_group.create_dataset(mask_name, data=f_in[f'mask/{mask_name}'][:])
+        mask_name = 'train'
+        keep_keys = [
+            f'demo_{i}' for i in range(lengths[task])
+            if i not in blacklist_task[task][robot]
+        ]
+        if mask_name in mask_group:
+            del mask_group[mask_name]
+        mask_group.create_dataset(mask_name, data=[k.encode("utf-8") for k in keep_keys])
 
-def convert_hdf5(input_path, output_path, task):
+        demos = [k for k in f_in['data'].keys() if k.startswith('demo_')]
+        for demo in demos:
+            demo_group = f_in[f'data/{demo}']
+            out_demo_group = data_group.create_group(demo)
+            if 'num_samples' in demo_group.attrs:
+                out_demo_group.attrs['num_samples'] = demo_group.attrs['num_samples']
 
-    with h5py.File(input_path, 'r') as f_in:
+            for dataset in DEMO_DATASETS:
+                if dataset in demo_group:
+                    add_dataset(f_in, out_demo_group, dataset, f'/data/{demo}/{dataset}', input_hdf5_path, mode)
 
-        with h5py.File(output_path, 'w') as f_out:
+            obs_group = out_demo_group.create_group('obs')
+            image_name = robot_image_name(robot)
+            if image_name in demo_group['obs']:
+                add_dataset(f_in, obs_group, 'agentview_image', f'/data/{demo}/obs/{image_name}', input_hdf5_path, mode)
+            else:
+                print(f"Warning: agentview_image for {robot} not found in {demo}")
+            for dataset in OBS_DATASETS:
+                if dataset in demo_group['obs']:
+                    add_dataset(f_in, obs_group, dataset, f'/data/{demo}/obs/{dataset}', input_hdf5_path, mode)
+                else:
+                    print(f"Warning: {dataset} not found in {demo}")
 
-            data_group = f_out.create_group('data')
-            
-            # Copy env_args attribute from input file
-            if 'env_args' in f_in['data'].attrs:
-                env_args = json.loads(f_in['data'].attrs['env_args'])
-                data_group.attrs['env_args'] = json.dumps(env_args)
-            
-            # Copy mask data
-            if 'mask' in f_in:
-                mask_group = f_out.create_group('mask')
-                for mask_name in f_in['mask'].keys():
-                    mask_data = f_in[f'mask/{mask_name}'][:]
-                    mask_group.create_dataset(mask_name, data=mask_data)
-            
-            # Get all demo groups
-            demos = [k for k in f_in['data'].keys() if k.startswith('demo_')]
-            
-            for demo in demos:
-                demo_group = f_in[f'data/{demo}']
-                out_demo_group = data_group.create_group(demo)
-                
-                if 'num_samples' in demo_group.attrs:
-                    out_demo_group.attrs['num_samples'] = demo_group.attrs['num_samples']
-                
-                for dataset in ['actions', 'dones', 'rewards', 'states']:
-                    if dataset in demo_group:
-                        data = demo_group[dataset][:]
-                        out_demo_group.create_dataset(dataset, data=data)
-                obs_group = out_demo_group.create_group('obs')
-  
-                for robot in robots:
-                    try:
-                        # Copy agentview image
-                        if robot == 'Panda':
-                            # For Panda, use the base agentview_image
-                            agentview_image = demo_group['obs/agentview_image'][:]
-                            obs_group.create_dataset('agentview_image_panda', data=agentview_image)
-                        else:
-                            # For other robots, use the robot-specific image
-                            agentview_image = demo_group[f'obs/agentview_image_{robot}'][:]
-                            obs_group.create_dataset(f'agentview_image_{robot.lower()}', data=agentview_image)
-                    except KeyError:
+            # Add blacklist attribute based on task and robot
+            demo_num = int(demo.split('_')[-1])
+            out_demo_group.attrs['blacklist'] = demo_num in blacklist_task[task][robot]
+            # Store original demo number
+            out_demo_group.attrs['original_demo_num'] = demo_num
+    return output_path
 
-                        print(f"Warning: agentview_image for {robot} not found in {demo}")
-                
 
-                for dataset in ['object', 'robot0_eef_pos', 'robot0_eef_quat', 'robot0_gripper_qpos']:
-                    try:
-                        if dataset in demo_group['obs']:
-                            data = demo_group[f'obs/{dataset}'][:]
-                            obs_group.create_dataset(dataset, data=data)
-                    except KeyError:
-                        print(f"Warning: {dataset} not found in {demo}")
+def split_robot_data(input_hdf5_path, output_dir, task, mode='link', num_workers=len(robots)):
+    """
+    Creates separate HDF5 files for each robot.
+    :param mode: 'link' for files that reference the datasets of the input file, 'copy' for standalone files
+    :param num_workers: number of robot files written at the same time in copy mode
+    """
+    if mode not in SPLIT_MODES:
+        raise ValueError(f"Unknown split mode {mode}, expected one of {SPLIT_MODES}")
+    os.makedirs(output_dir, exist_ok=True)
+    output_paths = {robot: os.path.join(output_dir, f"robot{robot}.hdf5") for robot in robots}
+    if mode == 'link' or num_workers <= 1:
+        for robot in robots:
+            split_robot_file(input_hdf5_path, output_paths[robot], task, robot, mode)
+            print(f"Created split data for robot {robot} at: {output_paths[robot]}")
+        return
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(split_robot_file, input_hdf5_path, output_paths[robot], task, robot, mode): robot for robot in robots}
+        for future in as_completed(futures):
+            print(f"Created split data for robot {futures[future]} at: {future.result()}")
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--input_data_path', type=str, required=True)
+    parser.add_argument('--split_mode', type=str, default='link', choices=SPLIT_MODES,
+                        help="link: split files reference the input files, which have to be kept. copy: standalone split files")
+    parser.add_argument('--num_workers', type=int, default=len(robots), help="Robot files copied in parallel in copy mode")
     args = parser.parse_args()
 
     for task in ['can', 'lift', 'square', 'stack', 'two_piece_assembly']:
         input_path = f'{args.input_data_path}/{task}/image_84.hdf5'
-        tmp_path = f'{args.input_data_path}/{task}/tmp.hdf5' 
         output_path = f'xembody_data/{task}/split_data'
-        os.makedirs(output_path, exist_ok=True) 
-        convert_hdf5(input_path, tmp_path, task)
-        split_robot_data(tmp_path, output_path, task) 
-        os.remove(tmp_path)
+        split_robot_data(input_path, output_path, task, mode=args.split_mode, num_workers=args.num_workers)